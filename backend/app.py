@@ -1,22 +1,53 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, request, jsonify, Response, stream_with_context, g, send_file
 from flask_cors import CORS
 from config import Config
 from services.auth_service import AuthService
+from services.onboarding_service import OnboardingService
 from services.lot_service import LotService
 from services.offline_sync import OfflineSyncService
-import firebase_admin
-from firebase_admin import auth
+from services.token_cache import token_cache
+from services.lot_stream import lot_stream_hub
+from services.report_service import ReportService
+from services.trace_service import TraceService
+from services.label_service import LabelService
+from services.http_response import FastJSONProvider, finalize_response, json_response, docs_etag, weak_etag, dumps, loads, is_fresh, not_modified
+from services.metrics import registry, REQUEST_LATENCY
+from services.structured_log import get_logger
+from services.lot_cache import lot_cache
+from services.user_cache import user_cache
+from services.lot_writer import lot_writer
+from services.qr_worker import qr_renderer
+from services.qr_store import qr_store
+from models.lot import Lot
+from firebase_config import db, db_initialized
 from functools import wraps
+import click
+import hmac
+import uuid
 from datetime import datetime
 import os
+import time
 
-# Crear aplicación Flask
-app = Flask(__name__)
-app.config.from_object(Config)
-CORS(app)
+# Rutas y comandos del API; la aplicación se arma en create_app()
+api = Blueprint('api', __name__, cli_group=None)
 
-# Crear directorio para QR codes si no existe
-os.makedirs(Config.QR_CODES_PATH, exist_ok=True)
+log = get_logger('app')
+
+# ===================== MEDICIÓN DE PETICIONES =====================
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+def record_request_metrics(response):
+    """Latencia por ruta (plantilla, no URL: /api/lots/<lot_id>)"""
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_LATENCY.observe(elapsed, method=request.method, route=route, status=str(response.status_code))
+    log.info('request', method=request.method, route=route, status=response.status_code,
+             ms=round(elapsed * 1000, 2))
+    return response
 
 # ===================== DECORADOR DE AUTENTICACIÓN =====================
 def require_auth(f):
@@ -29,7 +60,7 @@ def require_auth(f):
         id_token = auth_header.split(" ")[1]
 
         try:
-            decoded_token = auth.verify_id_token(id_token)
+            decoded_token = token_cache.verify(id_token)
             request.user = decoded_token
         except Exception as e:
             return jsonify({'error': 'Token inválido', 'details': str(e)}), 401
@@ -39,7 +70,7 @@ def require_auth(f):
 
 # ===================== RUTAS DE AUTENTICACIÓN =====================
 
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     """Registrar nuevo agricultor"""
     data = request.json
@@ -52,7 +83,7 @@ def register():
     )
     return jsonify(response), status
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     """Login de agricultor"""
     data = request.json
@@ -62,7 +93,7 @@ def login():
     )
     return jsonify(response), status
 
-@app.route('/api/auth/reset-password', methods=['POST'])
+@api.route('/api/auth/reset-password', methods=['POST'])
 def reset_password():
     """Recuperar contraseña"""
     data = request.get_json()
@@ -73,9 +104,62 @@ def reset_password():
     result, status_code = AuthService.reset_password(data['email'])
     return jsonify(result), status_code
 
+def has_bearer(token):
+    """¿La petición trae Authorization: Bearer <token>? (comparación en tiempo constante)"""
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+def require_onboarding_token(f):
+    """Alta masiva: solo con Bearer ONBOARDING_TOKEN (sin configurar, deshabilitada)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not Config.ONBOARDING_TOKEN:
+            return jsonify({'error': 'Alta masiva deshabilitada'}), 403
+        if not has_bearer(Config.ONBOARDING_TOKEN):
+            return jsonify({'error': 'No autorizado'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+@api.route('/api/auth/register/bulk', methods=['POST'])
+@require_onboarding_token
+def bulk_register():
+    """Alta masiva de agricultores desde un arreglo JSON o un CSV
+
+    Con ?job=<id> de un trabajo interrumpido se retoma donde quedó.
+    """
+    job = request.args.get('job') or uuid.uuid4().hex
+    if not OnboardingService.valid_job(job):
+        return jsonify({'error': 'Identificador de trabajo inválido'}), 400
+
+    if 'file' in request.files:
+        rows = OnboardingService.parse_csv(request.files['file'].read().decode('utf-8-sig'))
+    elif request.mimetype == 'text/csv':
+        rows = OnboardingService.parse_csv(request.get_data(as_text=True))
+    else:
+        data = request.get_json(silent=True)
+        rows = data.get('farmers') if isinstance(data, dict) else data
+    if isinstance(rows, list) and len(rows) > Config.ONBOARDING_MAX_ROWS:
+        return jsonify({'error': f'Máximo {Config.ONBOARDING_MAX_ROWS} agricultores por petición; '
+                                 'para más usa `flask import-farmers`'}), 413
+
+    result, status_code = OnboardingService.import_farmers(rows, OnboardingService.results_path(job))
+    if 'error' not in result:
+        result['job'] = job
+    return jsonify(result), status_code
+
+@api.route('/api/auth/register/bulk/<job>', methods=['GET'])
+@require_onboarding_token
+def bulk_register_results(job):
+    """Archivo CSV con el resultado de cada fila de un trabajo"""
+    path = OnboardingService.results_path(job) if OnboardingService.valid_job(job) else None
+    if path is None or not os.path.exists(path):
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return send_file(os.path.abspath(path), mimetype='text/csv', as_attachment=True,
+                     download_name=f'onboarding-{job}.csv')
+
 # ===================== RUTAS DE GESTIÓN DE LOTES =====================
 
-@app.route('/api/lots', methods=['POST'])
+@api.route('/api/lots', methods=['POST'])
 @require_auth
 def create_lot():
     """Crear nuevo lote"""
@@ -85,18 +169,395 @@ def create_lot():
     result, status_code = LotService.create_lot(farmer_uid, data)
     return jsonify(result), status_code
 
-@app.route('/api/lots', methods=['GET'])
+@api.route('/api/lots/bulk', methods=['POST'])
+@require_auth
+def bulk_create_lots():
+    """Crear lotes en bloque desde un arreglo JSON o un CSV"""
+    farmer_uid = request.user['uid']
+    
+    if 'file' in request.files:
+        rows = LotService.parse_csv(request.files['file'].read().decode('utf-8-sig'))
+    elif request.mimetype == 'text/csv':
+        rows = LotService.parse_csv(request.get_data(as_text=True))
+    else:
+        data = request.get_json(silent=True)
+        rows = data.get('lots') if isinstance(data, dict) else data
+    
+    result, status_code = LotService.bulk_create_lots(farmer_uid, rows)
+    return jsonify(result), status_code
+
+@api.route('/api/lots', methods=['GET'])
 @require_auth
 def get_lots():
-    """Obtener todos los lotes del agricultor"""
+    """Obtener los lotes del agricultor (paginado con ?limit=&cursor=&fields=)"""
     farmer_uid = request.user['uid']
     include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
     
-    result, status_code = LotService.get_farmer_lots(farmer_uid, include_deleted)
+    result, status_code = LotService.get_farmer_lots(
+        farmer_uid,
+        include_deleted,
+        limit=request.args.get('limit'),
+        cursor=request.args.get('cursor'),
+        fields=fields or None
+    )
+    etag = docs_etag(result['lots'], farmer_uid, result['next_cursor']) if status_code == 200 else None
+    return json_response(result, status_code, etag)
+
+@api.route('/api/lots/stream', methods=['GET'])
+@require_auth
+def stream_lots():
+    """Cambios de los lotes del agricultor en tiempo real (Server-Sent Events)"""
+    farmer_uid = request.user['uid']
+    subscription = lot_stream_hub.subscribe(farmer_uid)
+    
+    def generate():
+        try:
+            while True:
+                event = subscription.get(timeout=Config.LOT_STREAM_HEARTBEAT)
+                if event is None:
+                    # Comentario SSE para mantener viva la conexión
+                    yield ': ping\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {dumps(event).decode()}\n\n"
+                if event['type'] == 'reconnect':
+                    # El worker se está apagando
+                    return
+        finally:
+            lot_stream_hub.unsubscribe(subscription)
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@api.route('/api/lots/labels', methods=['POST'])
+@require_auth
+def lot_labels():
+    """Hojas de etiquetas imprimibles (PDF o ZIP de PNG) transmitidas página a página"""
+    data = request.get_json() or {}
+    farmer_uid = request.user['uid']
+    
+    job, status_code = LabelService.prepare_job(farmer_uid, data)
+    if status_code != 200:
+        return jsonify(job), status_code
+    
+    headers = {'Content-Disposition': f'attachment; filename="{job["filename"]}"'}
+    return Response(stream_with_context(LabelService.stream_sheets(job)), mimetype=job['mimetype'], headers=headers)
+
+@api.route('/api/lots/<lot_id>/qr', methods=['GET'])
+def get_lot_qr(lot_id):
+    """Imagen QR del lote (pública: es la misma que va impresa en la etiqueta)"""
+    qr_ref, image = Lot.get_qr(lot_id)
+    if not image:
+        return jsonify({'error': 'QR no disponible'}), 404
+    
+    etag = f'"{qr_ref}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={Config.QR_CACHE_MAX_AGE}'
+    }
+    
+    if is_fresh(etag):
+        return not_modified(etag, headers)
+    
+    return Response(image, mimetype=qr_store.mimetype(qr_ref), headers=headers)
+
+@api.route('/api/lots/<lot_id>', methods=['PUT'])
+@require_auth
+def update_lot(lot_id):
+    """Actualizar lote"""
+    data = request.get_json()
+    farmer_uid = request.user['uid']
+    
+    result, status_code = LotService.update_lot(lot_id, farmer_uid, data)
+    return jsonify(result), status_code
+
+@api.route('/api/lots/<lot_id>', methods=['DELETE'])
+@require_auth
+def delete_lot(lot_id):
+    """Eliminar lote (soft delete)"""
+    farmer_uid = request.user['uid']
+    
+    result, status_code = LotService.delete_lot(lot_id, farmer_uid)
+    return jsonify(result), status_code
+
+@api.route('/api/lots/<lot_id>/events', methods=['GET'])
+@require_auth
+def get_lot_events(lot_id):
+    """Historial de trazabilidad del lote (paginado con ?limit=&cursor=)"""
+    farmer_uid = request.user['uid']
+    
+    result, status_code = LotService.get_lot_events(
+        lot_id,
+        farmer_uid,
+        limit=request.args.get('limit'),
+        cursor=request.args.get('cursor')
+    )
+    # Los eventos no cambian una vez escritos: basta con sus ids
+    etag = None
+    if status_code == 200:
+        etag = weak_etag(request.full_path, farmer_uid, [event.get('id') for event in result['events']], result['next_cursor'])
+    return json_response(result, status_code, etag)
+
+@api.route('/api/overview', methods=['GET'])
+@require_auth
+def overview():
+    """Perfil, primera página de lotes y reporte del agricultor (?limit=)"""
+    result, status_code = LotService.get_overview(request.user['uid'], limit=request.args.get('limit'))
+    return jsonify(result), status_code
+
+# ===================== RUTAS DE SINCRONIZACIÓN OFFLINE =====================
+
+@api.route('/api/sync', methods=['POST'])
+@require_auth
+def sync_offline():
+    """Sincronizar operaciones hechas sin conexión"""
+    data = request.get_json()
+    farmer_uid = request.user['uid']
+    items = data.get('items', []) if isinstance(data, dict) else data
+    
+    if not isinstance(items, list):
+        return jsonify({'error': 'Se esperaba una lista de items'}), 400
+    
+    result, status_code = OfflineSyncService.sync_offline_data(farmer_uid, items)
+    return jsonify(result), status_code
+
+@api.route('/api/sync/stream', methods=['POST'])
+@require_auth
+def sync_offline_stream():
+    """Sincronizar un backlog NDJSON devolviendo un resultado NDJSON por item"""
+    farmer_uid = request.user['uid']
+    
+    def generate():
+        items = OfflineSyncService.parse_ndjson(request.stream)
+        for result in OfflineSyncService.sync_stream(farmer_uid, items):
+            yield dumps(result) + b'\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@api.route('/api/sync/changes', methods=['GET'])
+@require_auth
+def sync_changes():
+    """Lotes, bajas y eventos que cambiaron desde ?since=<cursor>"""
+    farmer_uid = request.user['uid']
+    
+    result, status_code = OfflineSyncService.get_changes(
+        farmer_uid,
+        since=request.args.get('since'),
+        limit=request.args.get('limit')
+    )
+    return jsonify(result), status_code
+
+@api.route('/api/sync/resolve', methods=['POST'])
+@require_auth
+def sync_resolve():
+    """Resolver un conflicto de sincronización ('server', 'client' o 'merge')"""
+    data = request.get_json() or {}
+    farmer_uid = request.user['uid']
+    
+    if not data.get('lot_id'):
+        return jsonify({'error': 'lot_id es obligatorio'}), 400
+    
+    result, status_code = OfflineSyncService.resolve_conflict(
+        data['lot_id'],
+        data.get('strategy', 'server'),
+        farmer_uid=farmer_uid,
+        client_data=data.get('data'),
+        client_timestamp=data.get('timestamp')
+    )
     return jsonify(result), status_code
 
 # ... (el resto de tus rutas siguen igual, ya con @require_auth funcionando)
 
+# ===================== RUTAS PÚBLICAS DE TRAZABILIDAD =====================
+
+@api.route('/api/trace/<traceability_code>', methods=['GET'])
+@api.route('/T/<traceability_code>', methods=['GET'])
+def trace_lot(traceability_code):
+    """Consulta pública de un lote al escanear su QR
+
+    /T/<código> es la URL corta de los QR compactos; el código puede
+    venir firmado (<código>.<firma>).
+    """
+    result, status_code = TraceService.lookup(traceability_code)
+    response = jsonify(result)
+    if status_code in (200, 404, 410):
+        response.headers['Cache-Control'] = f'public, max-age={Config.TRACE_HTTP_MAX_AGE}'
+    return response, status_code
+
+# ===================== MONITOREO =====================
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """Histogramas y contadores en formato de texto de Prometheus"""
+    if Config.METRICS_TOKEN and not has_bearer(Config.METRICS_TOKEN):
+        return jsonify({'error': 'No autorizado'}), 401
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+# ===================== RUTAS DE REPORTES =====================
+
+@api.route('/api/reports/sustainability', methods=['GET'])
+@require_auth
+def sustainability_report():
+    """Impacto de sostenibilidad e inventario del agricultor"""
+    farmer_uid = request.user['uid']
+    
+    result, status_code = ReportService.get_sustainability_report(farmer_uid)
+    return jsonify(result), status_code
+
+# ===================== COMANDOS =====================
+
+@api.cli.command('migrate-events')
+def migrate_events():
+    """Mover los eventos embebidos en los lotes a lots/{id}/events"""
+    lots, events = Lot.migrate_embedded_events(batch_limit=Config.FIRESTORE_BATCH_LIMIT)
+    print(f"✅ Migrados {events} eventos de {lots} lotes")
+    owners = Lot.backfill_event_owners(batch_limit=Config.FIRESTORE_BATCH_LIMIT)
+    print(f"✅ Completados lot_id y farmer_uid en {owners} eventos")
+
+@api.cli.command('backfill-trace-codes')
+def backfill_trace_codes():
+    """Crear el índice de códigos de trazabilidad para los lotes existentes"""
+    written = TraceService.backfill_index(batch_limit=Config.FIRESTORE_BATCH_LIMIT)
+    print(f"✅ Indexados {written} códigos de trazabilidad")
+
+@api.cli.command('repair-qr')
+def repair_qr():
+    """Migrar los QR embebidos y regenerar las imágenes que faltan en el QRStore"""
+    counts = Lot.repair_qr(batch_limit=Config.FIRESTORE_BATCH_LIMIT)
+    print(f"✅ Migrados {counts['migrated']} QR y regenerados {counts['rendered']}; con error: {counts['failed']}")
+
+@api.cli.command('recompute-reports')
+@click.option('--farmer', default=None, help='UID de un agricultor (por defecto, todos)')
+def recompute_reports(farmer):
+    """Recalcular agregados y series de reportes desde los lotes"""
+    farmers = ReportService.recompute(farmer)
+    print(f"✅ Reportes recalculados para {farmers} agricultores")
+
+@api.cli.command('storage-pull')
+def storage_pull():
+    """Cargar en el almacén local los documentos de Firestore (STORAGE_BACKEND=sqlite)"""
+    if getattr(db, 'replicator', None) is None:
+        raise click.ClickException('Requiere STORAGE_BACKEND=sqlite con STORAGE_REPLICATE=true')
+    imported = db.replicator.pull()
+    print(f"✅ Importados {imported} documentos desde Firestore")
+
+@api.cli.command('storage-push')
+def storage_push():
+    """Subir ya a Firestore todos los cambios locales pendientes"""
+    if getattr(db, 'replicator', None) is None:
+        raise click.ClickException('Requiere STORAGE_BACKEND=sqlite con STORAGE_REPLICATE=true')
+    replicated = db.replicator.drain()
+    print(f"✅ Replicados {replicated} cambios; pendientes: {db.pending_count()}")
+
+@api.cli.command('import-farmers')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--results', default=None, help='CSV de resultados (por defecto, <archivo>.results.csv)')
+def import_farmers(path, results):
+    """Alta masiva de agricultores desde un CSV o JSON (se retoma con el mismo --results)"""
+    with open(path, encoding='utf-8-sig') as f:
+        text = f.read()
+    if path.lower().endswith('.json'):
+        data = loads(text)
+        rows = data.get('farmers') if isinstance(data, dict) else data
+    else:
+        rows = OnboardingService.parse_csv(text)
+
+    results = results or f"{os.path.splitext(path)[0]}.results.csv"
+    summary, status_code = OnboardingService.import_farmers(rows, results)
+    if 'error' in summary:
+        raise click.ClickException(summary['error'])
+    print(f"✅ Creados {summary['created']}, ya existentes {summary['skipped']}, "
+          f"con error {summary['failed']}; detalle en {results}")
+
 # ===================== INICIALIZACIÓN =====================
+def create_app(config=Config):
+    """Crear la aplicación Flask
+
+    No conecta a Firestore ni lee credenciales: los clientes se crean en
+    la primera petición que los usa (o antes, con warmup()).
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    CORS(app)
+
+    # Serialización rápida para jsonify y request.get_json
+    app.json = FastJSONProvider(app)
+
+    app.before_request(start_request_timer)
+    app.after_request(record_request_metrics)
+    # ETags débiles, 304 y compresión para todas las rutas. Flask ejecuta los
+    # after_request en orden inverso, así la medición incluye la compresión.
+    app.after_request(finalize_response)
+
+    app.register_blueprint(api)
+    return app
+
+# Estadísticas del proceso en /metrics (los colectores que fallan se omiten,
+# así el almacén no se crea solo para exponer sus gauges)
+registry.collector('lot_cache', lot_cache.stats)
+registry.collector('user_cache', user_cache.stats)
+registry.collector('qr_renderer', qr_renderer.stats)
+registry.collector('qr_store', qr_store.stats)
+registry.collector('token_cache', token_cache.stats)
+registry.collector('lot_writer', lot_writer.stats)
+registry.collector('lot_stream', lot_stream_hub.stats)
+registry.collector('trace', TraceService.stats)
+registry.collector('storage', lambda: db.stats() if db_initialized() else {})
+registry.collector('storage_replicator', lambda: db.replicator.stats() if db_initialized() else {})
+
+def warmup():
+    """Pagar antes del fork los costos de arranque que sí se heredan
+
+    Pensado para `gunicorn --preload`: importa el SDK de Firebase, lee las
+    credenciales, carga qrcode/Pillow renderizando un QR y crea el
+    directorio de imágenes. No crea el cliente de Firestore ni hilos ni
+    pools de procesos: eso no sobrevive a un fork y se hace en cada worker.
+    Devuelve los milisegundos de cada paso.
+    """
+    from firebase_config import get_firebase_app
+
+    timings = {}
+
+    def step(name, fn):
+        start = time.perf_counter()
+        fn()
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    def import_sdk():
+        import firebase_admin.auth
+        import google.cloud.firestore_v1
+
+    step('imports', import_sdk)
+    step('credentials', get_firebase_app)
+    step('qr', qr_renderer.warmup)
+    step('qr_dir', lambda: os.makedirs(Config.QR_CODES_PATH, exist_ok=True))
+    log.info('warmup', **timings)
+    return timings
+
+def after_fork():
+    """Preparar un worker recién creado (gunicorn post_fork)"""
+    from firebase_config import reset_after_fork
+
+    reset_after_fork()
+    log.info('worker iniciado', pid=os.getpid())
+
+def shutdown(timeout=None):
+    """Apagado ordenado de un worker: terminar lo que quedó en vuelo
+
+    Los QR en cola se renderizan y se guardan antes de cerrar el almacén;
+    con el almacén local el outbox se sube a Firestore si hay conexión.
+    """
+    from firebase_config import close_db
+
+    # gunicorn mata al worker si no termina dentro de graceful_timeout, que
+    # también cubre la espera de las peticiones en curso
+    timeout = Config.WEB_GRACEFUL_TIMEOUT / 3 if timeout is None else timeout
+    start = time.perf_counter()
+    lot_stream_hub.close()
+    qr_renderer.shutdown(wait=True)
+    close_db(timeout)
+    token_cache.stop()
+    log.info('worker detenido', pid=os.getpid(), ms=round((time.perf_counter() - start) * 1000, 2))
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    create_app().run(debug=True, port=5000)
@@ -0,0 +1,425 @@
+"""Modo de servicio asíncrono (ASGI)
+
+Uso (desde backend/):
+    uvicorn asgi:app --workers 2
+
+Las rutas más usadas (listar, crear, actualizar y eliminar lotes, eventos,
+importación masiva JSON y /api/sync) se atienden con los servicios async
+sobre firestore.AsyncClient: mientras una petición espera a Firestore el
+mismo proceso sigue atendiendo otras. El resto del API se delega a la app
+Flask en el executor del loop (puente WSGI), así todo sigue disponible; su
+cuerpo se le entrega como stream, sin leerlo antes a memoria.
+"""
+import asyncio
+import contextvars
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from werkzeug.http import parse_accept_header, parse_etags
+from config import Config
+from app import create_app
+from firebase_config import get_async_db
+from services.token_cache import token_cache
+from services.lot_service_async import AsyncLotService
+from services.offline_sync_async import AsyncOfflineSyncService
+from services.http_response import dumps, loads, choose_encoding, compress, weak_etag
+from services.metrics import REQUEST_LATENCY
+from services.structured_log import get_logger
+
+log = get_logger('asgi')
+
+# Rutas que no tienen versión async
+flask_app = create_app()
+
+class RequestTooLarge(Exception):
+    """El cuerpo de una ruta async supera Config.ASGI_MAX_BODY_BYTES"""
+
+
+class Request:
+    """Petición ASGI de una ruta async (cuerpo completo en memoria)"""
+
+    def __init__(self, scope, body=b''):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.args = {key: values[-1] for key, values in parse_qs(self.query_string).items()}
+        self.body = body
+        self.user = None
+
+    @property
+    def full_path(self):
+        return f"{self.path}?{self.query_string}"
+
+    def json(self):
+        try:
+            return loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+# ===================== RUTAS ASÍNCRONAS =====================
+
+ROUTES = []  # (método, patrón, plantilla, handler, content-type)
+
+
+def route(method, template, content_type=None):
+    """Registrar un handler async; <nombre> captura un segmento de la ruta
+
+    Con content_type, las peticiones de otro tipo las atiende Flask (se
+    decide antes de leer el cuerpo).
+    """
+    pattern = re.compile('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', template) + '$')
+
+    def register(handler):
+        ROUTES.append((method, pattern, template, handler, content_type))
+        return handler
+    return register
+
+
+def match(scope):
+    """(handler, plantilla, parámetros) de la ruta async, o (None, None, None) para Flask"""
+    for route_method, pattern, template, handler, content_type in ROUTES:
+        if route_method == scope['method']:
+            found = pattern.match(scope['path'])
+            if found:
+                if content_type and not _header(scope, b'content-type').startswith(content_type):
+                    break
+                return handler, template, found.groupdict()
+    return None, None, None
+
+
+def _header(scope, name):
+    for header, value in scope.get('headers', []):
+        if header.lower() == name:
+            return value.decode('latin-1')
+    return ''
+
+
+async def authenticate(request):
+    """Equivalente a require_auth; la verificación corre en el executor"""
+    header = request.headers.get('authorization')
+    if not header or not header.startswith('Bearer '):
+        return {'error': 'Token no proporcionado'}, 401
+    try:
+        request.user = await asyncio.get_running_loop().run_in_executor(
+            None, token_cache.verify, header.split(' ')[1])
+    except Exception as e:
+        return {'error': 'Token inválido', 'details': str(e)}, 401
+    return None
+
+
+def docs_etag(request, docs, *extra):
+    """Como http_response.docs_etag, con la ruta de la petición ASGI"""
+    versions = []
+    for doc in docs:
+        if 'updated_at' not in doc:
+            return None
+        versions.append((doc.get('id'), doc.get('updated_at'), doc.get('status'), doc.get('qr_status')))
+    return weak_etag(request.full_path, *extra, versions)
+
+
+@route('GET', '/api/lots')
+async def get_lots(request):
+    farmer_uid = request.user['uid']
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    result, status_code = await AsyncLotService.get_farmer_lots(
+        farmer_uid,
+        request.args.get('include_deleted', 'false').lower() == 'true',
+        limit=request.args.get('limit'),
+        cursor=request.args.get('cursor'),
+        fields=fields or None
+    )
+    etag = docs_etag(request, result['lots'], farmer_uid, result['next_cursor']) if status_code == 200 else None
+    return result, status_code, etag
+
+
+@route('POST', '/api/lots')
+async def create_lot(request):
+    return await AsyncLotService.create_lot(request.user['uid'], request.json() or {})
+
+
+# Los CSV (multipart o text/csv) los sigue procesando Flask
+@route('POST', '/api/lots/bulk', content_type='application/json')
+async def bulk_create_lots(request):
+    data = request.json()
+    rows = data.get('lots') if isinstance(data, dict) else data
+    return await AsyncLotService.bulk_create_lots(request.user['uid'], rows)
+
+
+@route('PUT', '/api/lots/<lot_id>')
+async def update_lot(request, lot_id):
+    return await AsyncLotService.update_lot(lot_id, request.user['uid'], request.json() or {})
+
+
+@route('DELETE', '/api/lots/<lot_id>')
+async def delete_lot(request, lot_id):
+    return await AsyncLotService.delete_lot(lot_id, request.user['uid'])
+
+
+@route('GET', '/api/lots/<lot_id>/events')
+async def get_lot_events(request, lot_id):
+    farmer_uid = request.user['uid']
+    result, status_code = await AsyncLotService.get_lot_events(
+        lot_id, farmer_uid, limit=request.args.get('limit'), cursor=request.args.get('cursor'))
+    etag = None
+    if status_code == 200:
+        etag = weak_etag(request.full_path, farmer_uid, [event.get('id') for event in result['events']],
+                         result['next_cursor'])
+    return result, status_code, etag
+
+
+@route('GET', '/api/overview')
+async def overview(request):
+    return await AsyncLotService.get_overview(request.user['uid'], limit=request.args.get('limit'))
+
+
+@route('POST', '/api/sync')
+async def sync_offline(request):
+    data = request.json()
+    items = data.get('items', []) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return {'error': 'Se esperaba una lista de items'}, 400
+    return await AsyncOfflineSyncService.sync_offline_data(request.user['uid'], items)
+
+
+# ===================== RESPUESTAS =====================
+
+def _header_list(headers):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()]
+
+
+async def send_json(send, request, result, status_code, etag=None):
+    """JSON con ETag débil, 304 condicional y compresión (como finalize_response)"""
+    headers = {'Content-Type': 'application/json'}
+    if 'origin' in request.headers:
+        headers['Access-Control-Allow-Origin'] = '*'
+    if etag and status_code == 200:
+        headers['ETag'] = etag
+        tag = etag[2:] if etag.startswith('W/') else etag
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(tag.strip('"')):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': _header_list(headers)})
+            await send({'type': 'http.response.body', 'body': b''})
+            return 304
+
+    body = dumps(result)
+    if status_code == 200:
+        headers['Vary'] = 'Accept-Encoding'
+        if len(body) >= Config.COMPRESS_MIN_BYTES:
+            encoding = choose_encoding(parse_accept_header(request.headers.get('accept-encoding')))
+            if encoding:
+                body = compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+    headers['Content-Length'] = len(body)
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': _header_list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+    return status_code
+
+
+# ===================== PUENTE WSGI =====================
+
+class BodyStream(io.RawIOBase):
+    """wsgi.input que recibe el cuerpo de receive() a medida que Flask lo lee
+
+    Un solo task (pump) lee receive(): los fragmentos pasan por una cola
+    acotada, así la memoria no depende del tamaño del cuerpo (/api/sync/stream
+    procesa el NDJSON mientras llega). Terminado el cuerpo sigue esperando
+    el aviso de desconexión del cliente.
+    """
+
+    def __init__(self, loop, receive, max_chunks=8):
+        self._loop = loop
+        self._receive = receive
+        self._queue = asyncio.Queue(maxsize=max_chunks)
+        self._chunk = memoryview(b'')
+        self._eof = False
+        self._done = False
+        self.disconnected = asyncio.Event()
+
+    async def pump(self):
+        try:
+            while True:
+                message = await self._receive()
+                if message['type'] == 'http.disconnect':
+                    self.disconnected.set()
+                    return
+                if message.get('body'):
+                    await self._queue.put(message['body'])
+                if not message.get('more_body'):
+                    await self._queue.put(None)
+        finally:
+            self._done = True
+            # Un lector que espera ve el fin del cuerpo
+            try:
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Corre en el executor: espera el siguiente fragmento del loop
+        while not self._chunk and not self._eof:
+            if self._done and self._queue.empty():
+                self._eof = True
+                break
+            chunk = asyncio.run_coroutine_threadsafe(self._queue.get(), self._loop).result()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def build_environ(scope, stream):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BufferedReader(stream, 64 * 1024),
+        # El stream termina solo (también con chunked): werkzeug puede leerlo sin Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    """Atender la petición con la app Flask en el executor, transmitiendo el cuerpo
+
+    Flask lee el cuerpo a medida que llega y cada fragmento de la respuesta
+    se pide en el executor, así los streams (SSE, etiquetas, NDJSON) no
+    bloquean el loop. Si el cliente se desconecta se cierra el iterador de
+    Flask.
+    """
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return lambda data: None
+
+    # Cada paso puede caer en otro hilo del executor: todos corren en el mismo
+    # contexto, así stream_with_context conserva la petición de Flask
+    context = contextvars.copy_context()
+    stream = BodyStream(loop, receive)
+    pump = asyncio.ensure_future(stream.pump())
+    iterable = None
+    try:
+        iterable = await loop.run_in_executor(None, context.run, flask_app, build_environ(scope, stream),
+                                              start_response)
+        iterator = iter(iterable)
+        chunk = await loop.run_in_executor(None, context.run, next, iterator, None)
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        while chunk is not None and not stream.disconnected.is_set():
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(None, context.run, next, iterator, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        pump.cancel()
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            await loop.run_in_executor(None, context.run, close)
+
+
+# ===================== APLICACIÓN ASGI =====================
+
+async def read_body(scope, receive, limit):
+    """Cuerpo completo de una ruta async; None si el cliente se desconecta"""
+    declared = _header(scope, b'content-length')
+    if declared.isdigit() and int(declared) > limit:
+        raise RequestTooLarge()
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise RequestTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            # Executor del loop: puente WSGI, verificación de tokens y E/S de disco
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=Config.ASGI_THREADS,
+                                                         thread_name_prefix='asgi'))
+            get_async_db()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    handler, template, params = match(scope)
+    if handler is None:
+        return await call_flask(scope, receive, send)
+
+    start = time.perf_counter()
+    request = Request(scope)
+    try:
+        request.body = await read_body(scope, receive, Config.ASGI_MAX_BODY_BYTES)
+        if request.body is None:
+            return
+        result = await authenticate(request)
+        if result is None:
+            result = await handler(request, **params)
+    except RequestTooLarge:
+        result = {'error': f'El cuerpo supera el máximo de {Config.ASGI_MAX_BODY_BYTES} bytes'}, 413
+    except Exception:
+        # Un error no controlado también responde JSON, con CORS, métricas y log
+        log.exception('Error no controlado', method=request.method, route=template)
+        result = {'error': 'Error interno del servidor'}, 500
+
+    result, status_code, etag = (tuple(result) + (None,))[:3]
+    status_code = await send_json(send, request, result, status_code, etag)
+
+    elapsed = time.perf_counter() - start
+    REQUEST_LATENCY.observe(elapsed, method=request.method, route=template, status=str(status_code))
+    log.info('request', method=request.method, route=template, status=status_code, ms=round(elapsed * 1000, 2),
+             mode='async')
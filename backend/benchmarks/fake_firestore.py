@@ -0,0 +1,77 @@
+"""Firestore en memoria con latencia simulada por llamada
+
+La semántica de documentos, consultas y lotes es la de
+storage.documents.DocumentStore (la misma que usa el backend SQLite).
+Cada llamada que en producción sería un viaje de red duerme `latency`
+segundos y se cuenta en `calls`, así los benchmarks detectan tanto
+lentitud como viajes de más.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from storage.documents import DocumentStore
+
+_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeFirestore(DocumentStore):
+    """Cliente de Firestore en memoria con latencia configurable por llamada"""
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._docs = {}  # ruta (tupla) -> {'data', 'create_time', 'update_time'}
+        self._lock = threading.RLock()
+        self._clock = 0
+        self._random = random.Random(seed)
+
+    # ---------------- soporte de benchmarks ----------------
+
+    @property
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def document_count(self, collection=None):
+        with self._lock:
+            if collection is None:
+                return len(self._docs)
+            return sum(1 for path in self._docs if len(path) >= 2 and path[-2] == collection)
+
+    # ---------------- backend ----------------
+
+    def _round_trip(self, operation):
+        self.calls[operation] += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _now(self):
+        # Reloj determinista: los resultados no dependen de la hora real
+        self._clock += 1
+        return _EPOCH + timedelta(microseconds=self._clock)
+
+    def _read(self, path):
+        with self._lock:
+            return self._docs.get(path)
+
+    def _scan(self, query):
+        with self._lock:
+            return list(self._docs.items())
+
+    def _write(self, writes):
+        """Aplicar escrituras de forma atómica (se validan todas antes de escribir)"""
+        with self._lock:
+            states, update_time = self._resolve(writes, self._docs.get)
+            for path, entry in states.items():
+                if entry is None:
+                    self._docs.pop(path, None)
+                else:
+                    self._docs[path] = entry
+            return update_time
@@ -0,0 +1,151 @@
+"""Tiempo de importación de los puntos de entrada (al estilo de -X importtime)
+
+Uso (desde backend/):
+    python -m benchmarks.import_time                      # mostrar el reporte
+    python -m benchmarks.import_time --check              # comparar con import_baselines.json
+    python -m benchmarks.import_time --update-baselines   # guardar los resultados como baseline
+
+Cada módulo se importa en un proceso nuevo con -X importtime y una ruta de
+credenciales inexistente: importar no debe conectar ni leerlas. --check
+falla (exit 1) si un punto de entrada carga alguno de los módulos pesados
+que deben diferirse hasta su primer uso, o si su tiempo empeora más que
+--tolerance respecto a la baseline.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'import_baselines.json')
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ('app', 'asgi', 'models.lot', 'services.lot_service', 'services.offline_sync')
+
+# Paquetes que solo se importan al usarse (o en warmup antes del fork)
+DEFERRED = ('firebase_admin', 'google.cloud.firestore', 'google.cloud.firestore_v1', 'google.api_core',
+            'grpc', 'qrcode', 'PIL', 'numpy')
+
+
+def import_profile(module):
+    """Importar `module` en un proceso nuevo y devolver sus filas de -X importtime
+
+    Cada fila es (nombre, µs propios, µs acumulados, profundidad).
+    """
+    env = dict(os.environ,
+               FIREBASE_CREDENTIALS_PATH=os.path.join(tempfile.gettempdir(), 'biotrazo-sin-credenciales.json'),
+               LOG_LEVEL='WARNING')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {module}:\n{completed.stderr[-2000:]}")
+
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module, repeat):
+    """Mejor de `repeat` importaciones (la primera compila los .pyc y se descarta)"""
+    import_profile(module)
+    best = None
+    for _ in range(repeat):
+        rows = import_profile(module)
+        total = next(cumulative for name, _, cumulative, depth in rows if name == module and depth == 0)
+        if best is None or total < best[0]:
+            best = (total, rows)
+
+    total, rows = best
+    # -X importtime escribe cada módulo después de sus dependencias: lo que
+    # arrastra el módulo es el bloque anidado que precede a su línea
+    end = next(i for i, row in enumerate(rows) if row[0] == module and row[3] == 0)
+    start = end
+    while start > 0 and rows[start - 1][3] > 0:
+        start -= 1
+    own = rows[start:end + 1]
+    names = {name for name, _, _, _ in own}
+    heaviest = sorted(own, key=lambda row: row[1], reverse=True)[:5]
+    return {
+        'ms': round(total / 1000, 2),
+        'modules': len(own),
+        'deferred_loaded': sorted(prefix for prefix in DEFERRED
+                                  if any(name == prefix or name.startswith(prefix + '.') for name in names)),
+        'heaviest': [(name, round(self_us / 1000, 2)) for name, self_us, _, _ in heaviest]
+    }
+
+
+def check(results, baselines, tolerance):
+    """Lista de regresiones respecto a la baseline"""
+    failures = []
+    for module, result in results.items():
+        if result['deferred_loaded']:
+            failures.append(f"{module}: importa {', '.join(result['deferred_loaded'])} al cargarse")
+        base = baselines.get('modules', {}).get(module)
+        if not base:
+            continue
+        # Margen absoluto de 20 ms: el arranque de un proceso es ruidoso
+        limit = base['ms'] * (1 + tolerance) + 20.0
+        if result['ms'] > limit:
+            failures.append(f"{module}: {result['ms']} ms (baseline {base['ms']} ms, límite {limit:.1f} ms)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tiempo de importación de los puntos de entrada del backend')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='Módulos separados por coma')
+    parser.add_argument('--check', action='store_true', help='Fallar si hay regresiones respecto a la baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Empeoramiento permitido (0.5 = 50%%)')
+    parser.add_argument('--update-baselines', action='store_true')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args(argv)
+
+    modules = args.only.split(',') if args.only else list(ENTRY_POINTS)
+
+    results = {}
+    print(f"{'módulo':<24} {'ms':>8} {'módulos':>8}  más pesados (ms propios)")
+    for module in modules:
+        result = results[module] = measure(module, args.repeat)
+        heaviest = ', '.join(f"{name} {ms}" for name, ms in result['heaviest'][:3])
+        print(f"{module:<24} {result['ms']:>8.1f} {result['modules']:>8}  {heaviest}")
+
+    output = {'python': sys.version.split()[0], 'modules': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.update_baselines:
+        baselines = {'python': output['python'], 'modules': {
+            module: {key: result[key] for key in ('ms', 'modules')} for module, result in results.items()
+        }}
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2)
+            f.write('\n')
+        print(f"Baselines guardadas en {BASELINES_PATH}")
+
+    if args.check:
+        if not os.path.exists(BASELINES_PATH):
+            print('No hay baselines; ejecuta con --update-baselines')
+            return 1
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+        failures = check(results, baselines, args.tolerance)
+        if failures:
+            print('\nRegresiones:')
+            for failure in failures:
+                print(f"  - {failure}")
+            return 1
+        print('\nSin regresiones respecto a la baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
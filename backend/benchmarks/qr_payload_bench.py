@@ -0,0 +1,95 @@
+"""Comparación de los modos de payload y formatos de salida del QR
+
+Uso (desde backend/):
+    python -m benchmarks.qr_payload_bench [--iterations 200]
+
+Para cada combinación muestra la longitud del payload, la versión del QR,
+el tiempo medio de renderizado y el tamaño en bytes. La fila 'legacy' es
+el renderizado anterior (JSON + qrcode.make_image + PNG RGB).
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime
+from io import BytesIO
+
+from services.qr_payload import compact_payload
+from services.qr_worker import qr_matrix, render_qr
+
+BASE_URL = 'https://biotrazo.co'
+
+
+def sample_lot():
+    """Lote de ejemplo con los mismos campos que Lot.qr_payload en modo 'json'"""
+    created_at = datetime.utcnow()
+    return {
+        'lot_id': str(uuid.uuid4()),
+        'traceability_code': f"LOT-{created_at.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8].upper()}",
+        'crop_type': 'Café',
+        'quantity': '1250.5 kg',
+        'created_at': created_at.isoformat(),
+        'farmer_uid': 'x1Yz2AbC3dEf4GhI5jKl6MnO7pQ2'
+    }
+
+
+def payloads(lot):
+    code = lot['traceability_code']
+    return {
+        'json': json.dumps(lot),
+        'compact': compact_payload(code, url=BASE_URL, secret='bench'),
+        'signed': compact_payload(code, signed=True, url=BASE_URL, secret='bench')
+    }
+
+
+def legacy_render(payload):
+    """Renderizado anterior a los modos compactos (referencia)"""
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L,
+                       box_size=10, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def measure(render, payload, iterations):
+    data = render(payload)  # calentamiento
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render(payload)
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations * 1000, len(data)
+
+
+def run(iterations=200):
+    rows = []
+    mode_payloads = payloads(sample_lot())
+
+    ms, size = measure(legacy_render, mode_payloads['json'], iterations)
+    rows.append(('legacy', 'png', len(mode_payloads['json']), qr_matrix(mode_payloads['json'])[0], ms, size))
+
+    for mode, payload in mode_payloads.items():
+        version = qr_matrix(payload)[0]
+        for fmt in ('png', 'svg', 'matrix'):
+            ms, size = measure(lambda p: render_qr(p, fmt), payload, iterations)
+            rows.append((mode, fmt, len(payload), version, ms, size))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    rows = run(args.iterations)
+    print(f"{'modo':<8} {'formato':<7} {'payload':>7} {'versión':>7} {'ms/QR':>8} {'bytes':>7}")
+    for mode, fmt, length, version, ms, size in rows:
+        print(f"{mode:<8} {fmt:<7} {length:>7} {version:>7} {ms:>8.3f} {size:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Suite de benchmarks sin conexión contra un Firestore en memoria
+
+Uso (desde backend/):
+    python -m benchmarks.run                      # ejecutar y mostrar resultados
+    python -m benchmarks.run --check              # comparar con baselines.json
+    python -m benchmarks.run --update-baselines   # guardar los resultados como baseline
+
+Cada escenario mide latencia (p50/p95/p99), throughput y viajes a
+Firestore por operación. --check falla (exit 1) si un escenario hace más
+viajes que su baseline o si su p95 empeora más que --tolerance.
+
+El tiempo de importación de los puntos de entrada se mide aparte con
+python -m benchmarks.import_time.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+FARMER = 'bench-farmer'
+SEED_LOTS = 200
+
+
+def configure_environment():
+    """Configuración determinista; debe correr antes de importar el backend"""
+    os.environ.setdefault('QR_RENDER_MODE', 'sync')
+    os.environ.setdefault('QR_CODES_PATH', tempfile.mkdtemp(prefix='bench-qr-'))
+    os.environ.setdefault('LOT_CACHE_BACKEND', 'memory')
+    os.environ.setdefault('METRICS_ENABLED', 'false')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('AUTH_CERTS_REFRESH_INTERVAL', '0')
+
+
+def install_fake_firestore():
+    """Sustituir firebase_config por un módulo cuyo db es el fake"""
+    from benchmarks.fake_firestore import FakeFirestore
+
+    fake = FakeFirestore(seed=42)
+    from firebase_admin import auth
+
+    module = types.ModuleType('firebase_config')
+    module.db = fake
+    module.get_db = lambda: fake
+    module.db_initialized = lambda: True
+    module.initialize_firebase = lambda: fake
+
+    def get_async_db():
+        # Modo ASGI: el mismo fake detrás del adaptador asíncrono
+        from storage.aio import AsyncStoreAdapter
+        return AsyncStoreAdapter(fake)
+
+    module.get_async_db = get_async_db
+    # verify_id_token, get_user_by_email y create_custom_token se sustituyen en los escenarios de auth
+    module.get_auth = lambda: auth
+    sys.modules['firebase_config'] = module
+    return fake
+
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def lot_payload(i):
+    return {
+        'crop_type': ('Café', 'Cacao', 'Aguacate')[i % 3],
+        'quantity': 100 + i,
+        'unit': 'kg',
+        'location': {'lat': 4.6, 'lng': -74.1},
+        'price': 12000,
+        'sustainability_metrics': {'carbonSaved': 1.5, 'waterSaved': 20, 'emissionsReduced': 0.8}
+    }
+
+
+def expect(result, *statuses):
+    body, status = result
+    if status not in statuses:
+        raise RuntimeError(f"Estado inesperado {status}: {body}")
+    return body
+
+
+# ===================== ESCENARIOS =====================
+# Cada escenario prepara sus datos (sin latencia) y devuelve op(i)
+
+def seed_lots(count):
+    from services.lot_service import LotService
+    body = expect(LotService.bulk_create_lots(FARMER, [lot_payload(i) for i in range(count)]), 201)
+    return [row['id'] for row in body['results']]
+
+
+def scenario_lots_create(ctx):
+    from services.lot_service import LotService
+    return lambda i: expect(LotService.create_lot(FARMER, lot_payload(i)), 201)
+
+
+def scenario_lots_list(ctx):
+    from services.lot_service import LotService
+    ctx.setdefault('seeded', seed_lots(SEED_LOTS))
+    return lambda i: expect(LotService.get_farmer_lots(FARMER, limit=50), 200)
+
+
+def scenario_lots_list_uncached(ctx):
+    from services.lot_service import LotService
+    from services.lot_cache import lot_cache
+    ctx.setdefault('seeded', seed_lots(SEED_LOTS))
+
+    def op(i):
+        lot_cache.invalidate_farmer(FARMER)
+        expect(LotService.get_farmer_lots(FARMER, limit=50), 200)
+    return op
+
+
+def scenario_lots_update(ctx):
+    from services.lot_service import LotService
+    lot_ids = ctx.setdefault('seeded', seed_lots(SEED_LOTS))
+    return lambda i: expect(LotService.update_lot(lot_ids[i % len(lot_ids)], FARMER, {'quantity': 500 + i}), 200)
+
+
+def scenario_lots_delete(ctx):
+    from services.lot_service import LotService
+    lot_ids = seed_lots(ctx['iterations'] + ctx['warmup'])
+    return lambda i: expect(LotService.delete_lot(lot_ids[i], FARMER), 200)
+
+
+def scenario_sync_offline(ctx):
+    """Backlog de 20 items: 10 lotes nuevos y 10 actualizaciones"""
+    from services.offline_sync import OfflineSyncService
+    lot_ids = ctx.setdefault('seeded', seed_lots(SEED_LOTS))
+
+    def op(i):
+        timestamp = '2024-06-01T12:00:00Z'
+        items = [{'type': 'lot_creation', 'offline_id': f'c-{i}-{n}', 'timestamp': timestamp,
+                  'data': lot_payload(n)} for n in range(10)]
+        items += [{'type': 'lot_update', 'offline_id': f'u-{i}-{n}', 'timestamp': timestamp,
+                   'lot_id': lot_ids[(i * 10 + n) % len(lot_ids)], 'data': {'quantity': 50 + n}}
+                  for n in range(10)]
+        body = expect(OfflineSyncService.sync_offline_data(FARMER, items), 200)
+        if body['failed']:
+            raise RuntimeError(f"Items fallidos: {body['failed'][:2]}")
+    return op
+
+
+def scenario_qr_generate(ctx):
+    from models.lot import Lot
+
+    def op(i):
+        Lot(FARMER, 'Café', 100 + i).generate_qr()
+    return op
+
+
+def scenario_auth_require(ctx):
+    """Ruta protegida con require_auth; 20 tokens distintos (la caché acierta)"""
+    from firebase_admin import auth
+    import app as app_module
+
+    def verify_id_token(id_token, check_revoked=False, **kwargs):
+        time.sleep(ctx['auth_latency'])
+        return {'uid': FARMER, 'exp': time.time() + 3600}
+
+    auth.verify_id_token = verify_id_token
+    view = app_module.require_auth(lambda: 'ok')
+    flask_app = app_module.create_app()
+
+    def op(i):
+        headers = {'Authorization': f'Bearer token-{i % 20}'}
+        with flask_app.test_request_context('/api/lots', headers=headers):
+            if view() != 'ok':
+                raise RuntimeError('require_auth rechazó el token')
+    return op
+
+
+def scenario_auth_login(ctx):
+    """AuthService.login_user con 20 cuentas; Auth simulado con auth_latency"""
+    from firebase_admin import auth
+    from models.user import User
+    from services.auth_service import AuthService
+
+    accounts = [f'bench-user-{n}' for n in range(20)]
+    for uid in accounts:
+        User(uid, f'{uid}@example.com', name=uid).save()
+
+    def get_user_by_email(email, app=None):
+        time.sleep(ctx['auth_latency'])
+        return types.SimpleNamespace(uid=email.split('@')[0], email=email)
+
+    auth.get_user_by_email = get_user_by_email
+    auth.create_custom_token = lambda uid, developer_claims=None, app=None: f'token-{uid}'.encode()
+
+    def op(i):
+        body, status = AuthService.login_user(f'{accounts[i % len(accounts)]}@example.com', 'secreto')
+        if status != 200 or body['user_data'] is None:
+            raise RuntimeError(f"Login fallido: {body}")
+    return op
+
+
+SCENARIOS = {
+    'lots.create': scenario_lots_create,
+    'lots.list': scenario_lots_list,
+    'lots.list_uncached': scenario_lots_list_uncached,
+    'lots.update': scenario_lots_update,
+    'lots.delete': scenario_lots_delete,
+    'sync.offline': scenario_sync_offline,
+    'qr.generate': scenario_qr_generate,
+    'auth.require_auth': scenario_auth_require,
+    'auth.login': scenario_auth_login,
+}
+
+
+def run_scenario(name, fake, ctx):
+    fake.latency, fake.jitter = 0.0, 0.0
+    op = SCENARIOS[name](ctx)
+    for i in range(ctx['warmup']):
+        op(i)
+
+    fake.latency, fake.jitter = ctx['latency'], ctx['jitter']
+    fake.reset_calls()
+    samples = []
+    start = time.perf_counter()
+    for i in range(ctx['warmup'], ctx['warmup'] + ctx['iterations']):
+        op_start = time.perf_counter()
+        op(i)
+        samples.append((time.perf_counter() - op_start) * 1000)
+    elapsed = time.perf_counter() - start
+    fake.latency, fake.jitter = 0.0, 0.0
+
+    samples.sort()
+    return {
+        'iterations': len(samples),
+        'throughput': round(len(samples) / elapsed, 2),
+        'p50_ms': round(percentile(samples, 0.50), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+        'round_trips': round(fake.round_trips / len(samples), 3),
+        'calls': dict(fake.calls)
+    }
+
+
+def check(results, baselines, config, tolerance):
+    """Lista de regresiones respecto a la baseline"""
+    failures = []
+    same_latency = baselines.get('config', {}).get('latency_ms') == config['latency_ms']
+    for name, result in results.items():
+        base = baselines.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        if result['round_trips'] > base['round_trips'] + 1e-6:
+            failures.append(f"{name}: {result['round_trips']} viajes por operación (baseline {base['round_trips']})")
+        # Margen absoluto de 1 ms para no fallar por ruido en operaciones muy rápidas
+        limit = base['p95_ms'] * (1 + tolerance) + 1.0
+        if same_latency and result['p95_ms'] > limit:
+            failures.append(f"{name}: p95 {result['p95_ms']} ms (baseline {base['p95_ms']} ms, límite {limit:.3f} ms)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks sin conexión del backend')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Latencia simulada por llamada a Firestore')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--auth-latency-ms', type=float, default=2.0, help='Costo simulado de las llamadas a Firebase Auth')
+    parser.add_argument('--only', help='Escenarios separados por coma')
+    parser.add_argument('--check', action='store_true', help='Fallar si hay regresiones respecto a la baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Empeoramiento permitido del p95 (0.5 = 50%%)')
+    parser.add_argument('--update-baselines', action='store_true')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo')
+    args = parser.parse_args(argv)
+
+    configure_environment()
+    fake = install_fake_firestore()
+
+    names = args.only.split(',') if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(unknown)}")
+
+    ctx = {
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'latency': args.latency_ms / 1000,
+        'jitter': args.jitter_ms / 1000,
+        'auth_latency': args.auth_latency_ms / 1000
+    }
+    config = {'latency_ms': args.latency_ms, 'iterations': args.iterations}
+
+    results = {}
+    print(f"{'escenario':<20} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'viajes':>7}")
+    for name in names:
+        result = results[name] = run_scenario(name, fake, ctx)
+        print(f"{name:<20} {result['throughput']:>9.1f} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+              f"{result['p99_ms']:>9.3f} {result['round_trips']:>7.2f}")
+
+    output = {'config': config, 'scenarios': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.update_baselines:
+        baselines = {'config': config, 'scenarios': {
+            name: {key: result[key] for key in ('round_trips', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput')}
+            for name, result in results.items()
+        }}
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2)
+            f.write('\n')
+        print(f"Baselines guardadas en {BASELINES_PATH}")
+
+    if args.check:
+        if not os.path.exists(BASELINES_PATH):
+            print('No hay baselines; ejecuta con --update-baselines')
+            return 1
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+        failures = check(results, baselines, config, args.tolerance)
+        if failures:
+            print('\nRegresiones:')
+            for failure in failures:
+                print(f"  - {failure}")
+            return 1
+        print('\nSin regresiones respecto a la baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,3 +9,129 @@ class Config:
     FIREBASE_DATABASE_URL = os.environ.get('FIREBASE_DATABASE_URL')
     QR_CODES_PATH = os.environ.get('QR_CODES_PATH', 'qr_codes')
 
+    # Almacenamiento de documentos: 'firestore' o 'sqlite' (local, para nodos
+    # de cooperativa). Con STORAGE_REPLICATE los cambios locales se suben a
+    # Firestore en lotes cada REPLICATION_INTERVAL segundos cuando hay conexión
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+    SQLITE_STORAGE_PATH = os.environ.get('SQLITE_STORAGE_PATH', os.path.join('data', 'biotrazo.sqlite3'))
+    STORAGE_REPLICATE = os.environ.get('STORAGE_REPLICATE', 'true').lower() == 'true'
+    REPLICATION_INTERVAL = float(os.environ.get('REPLICATION_INTERVAL', 5))
+    REPLICATION_MAX_BACKOFF = float(os.environ.get('REPLICATION_MAX_BACKOFF', 300))
+    # Cada cuánto los listeners sobre SQLite miran si otro proceso escribió
+    SQLITE_WATCH_INTERVAL = float(os.environ.get('SQLITE_WATCH_INTERVAL', 1))
+
+    # Logging estructurado ('json' o 'text'); LOG_SAMPLE_RATE aplica por debajo de WARNING
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+
+    # Métricas Prometheus en /metrics (con METRICS_TOKEN se exige Bearer)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Caché de ID tokens verificados
+    AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+    AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+    AUTH_CERTS_REFRESH_INTERVAL = int(os.environ.get('AUTH_CERTS_REFRESH_INTERVAL', 1800))
+    AUTH_CHECK_REVOKED = os.environ.get('AUTH_CHECK_REVOKED', 'false').lower() == 'true'
+
+    # Renderizado de códigos QR ('process' en segundo plano o 'sync' para tests)
+    QR_RENDER_MODE = os.environ.get('QR_RENDER_MODE', 'process')
+    QR_WORKERS = int(os.environ.get('QR_WORKERS', 0)) or None
+    QR_MAX_PENDING = int(os.environ.get('QR_MAX_PENDING', 64))
+    QR_QUEUE_TIMEOUT = float(os.environ.get('QR_QUEUE_TIMEOUT', 2.0))
+    QR_CACHE_BYTES = int(os.environ.get('QR_CACHE_BYTES', 8 * 1024 * 1024))
+    QR_CACHE_MAX_AGE = int(os.environ.get('QR_CACHE_MAX_AGE', 86400))
+
+    # Contenido y formato del QR. QR_PAYLOAD_MODE: 'json' (histórico), 'compact'
+    # (URL corta con el código) o 'signed' (URL corta con firma HMAC).
+    # QR_OUTPUT_FORMAT: 'png' (1 bit), 'svg' o 'matrix' (JSON con los módulos)
+    QR_PAYLOAD_MODE = os.environ.get('QR_PAYLOAD_MODE', 'json')
+    QR_BASE_URL = os.environ.get('QR_BASE_URL', 'http://localhost:5000')
+    QR_OUTPUT_FORMAT = os.environ.get('QR_OUTPUT_FORMAT', 'png')
+    QR_BOX_SIZE = int(os.environ.get('QR_BOX_SIZE', 10))
+    QR_BORDER = int(os.environ.get('QR_BORDER', 4))
+
+    # Hojas de etiquetas imprimibles (A4, columnas x filas por página)
+    LABELS_MAX_LOTS = int(os.environ.get('LABELS_MAX_LOTS', 5000))
+    LABELS_COLUMNS = int(os.environ.get('LABELS_COLUMNS', 3))
+    LABELS_ROWS = int(os.environ.get('LABELS_ROWS', 8))
+    LABELS_DPI = int(os.environ.get('LABELS_DPI', 300))
+    LABELS_FONT = os.environ.get('LABELS_FONT')
+
+    # Compresión de respuestas (br si está instalado brotli, si no gzip)
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+    BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+    # Paginación de GET /api/lots
+    LOTS_PAGE_SIZE = int(os.environ.get('LOTS_PAGE_SIZE', 50))
+    LOTS_MAX_PAGE_SIZE = int(os.environ.get('LOTS_MAX_PAGE_SIZE', 200))
+
+    # Importación masiva de lotes
+    FIRESTORE_BATCH_LIMIT = 500
+    BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 5000))
+
+    # Alta masiva de agricultores (POST /api/auth/register/bulk exige ONBOARDING_TOKEN;
+    # sin él la ruta queda deshabilitada y solo se puede usar `flask import-farmers`)
+    ONBOARDING_TOKEN = os.environ.get('ONBOARDING_TOKEN')
+    ONBOARDING_MAX_ROWS = int(os.environ.get('ONBOARDING_MAX_ROWS', 1000))
+    ONBOARDING_RESULTS_PATH = os.environ.get('ONBOARDING_RESULTS_PATH', 'onboarding')
+    ONBOARDING_HASH_ROUNDS = int(os.environ.get('ONBOARDING_HASH_ROUNDS', 50000))
+    ONBOARDING_HASH_THREADS = int(os.environ.get('ONBOARDING_HASH_THREADS', os.cpu_count() or 1))
+
+    # Reintentos cuando un lote cambia entre la lectura y la escritura
+    WRITE_CONFLICT_RETRIES = int(os.environ.get('WRITE_CONFLICT_RETRIES', 3))
+
+    # Sincronización offline
+    SYNC_CHUNK_SIZE = int(os.environ.get('SYNC_CHUNK_SIZE', 100))
+    # Margen con el que get_changes vuelve a leer el final del feed (commits
+    # visibles tarde y relojes de workers desfasados en los eventos)
+    SYNC_CHANGES_WINDOW_SECONDS = int(os.environ.get('SYNC_CHANGES_WINDOW_SECONDS', 60))
+
+    # Caché de lecturas de lotes ('memory', 'sqlite' para varios workers o 'none')
+    LOT_CACHE_BACKEND = os.environ.get('LOT_CACHE_BACKEND', 'memory')
+    LOT_CACHE_PATH = os.environ.get('LOT_CACHE_PATH', os.path.join('cache', 'lots.sqlite3'))
+    LOT_CACHE_TTL = int(os.environ.get('LOT_CACHE_TTL', 30))
+    LOT_CACHE_MAX_ITEMS = int(os.environ.get('LOT_CACHE_MAX_ITEMS', 2048))
+
+    # Caché de perfiles de usuario y del uid de cada email (login)
+    USER_CACHE_BACKEND = os.environ.get('USER_CACHE_BACKEND', 'memory')
+    USER_CACHE_PATH = os.environ.get('USER_CACHE_PATH', os.path.join('cache', 'users.sqlite3'))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    USER_CACHE_MAX_ITEMS = int(os.environ.get('USER_CACHE_MAX_ITEMS', 4096))
+    AUTH_LOGIN_THREADS = int(os.environ.get('AUTH_LOGIN_THREADS', 8))
+
+    # Server-Sent Events de lotes
+    LOT_STREAM_IDLE_SECONDS = int(os.environ.get('LOT_STREAM_IDLE_SECONDS', 60))
+    LOT_STREAM_MAX_QUEUE = int(os.environ.get('LOT_STREAM_MAX_QUEUE', 100))
+    LOT_STREAM_HEARTBEAT = int(os.environ.get('LOT_STREAM_HEARTBEAT', 15))
+
+    # Consulta pública por código de trazabilidad
+    TRACE_CACHE_MAX_ITEMS = int(os.environ.get('TRACE_CACHE_MAX_ITEMS', 10000))
+    TRACE_POSITIVE_TTL = int(os.environ.get('TRACE_POSITIVE_TTL', 86400))
+    TRACE_NEGATIVE_TTL = int(os.environ.get('TRACE_NEGATIVE_TTL', 60))
+    TRACE_HTTP_MAX_AGE = int(os.environ.get('TRACE_HTTP_MAX_AGE', 60))
+
+    # Servidor de producción: gunicorn -c gunicorn.conf.py wsgi:app
+    # (workers gthread; cada uno crea su app de Firebase y su canal gRPC)
+    WEB_BIND = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', (os.cpu_count() or 1) + 1))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 60))
+    WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+    WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', 5))
+    WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+    WEB_PRELOAD = os.environ.get('WEB_PRELOAD', 'true').lower() == 'true'
+
+    # Canal gRPC de Firestore y pool HTTP de la API de Auth (por worker)
+    FIRESTORE_KEEPALIVE_MS = int(os.environ.get('FIRESTORE_KEEPALIVE_MS', 30000))
+    FIRESTORE_KEEPALIVE_TIMEOUT_MS = int(os.environ.get('FIRESTORE_KEEPALIVE_TIMEOUT_MS', 10000))
+    AUTH_HTTP_POOL_SIZE = int(os.environ.get('AUTH_HTTP_POOL_SIZE', 16))
+
+    # Modo ASGI (uvicorn asgi:app): hilos del executor del loop para el
+    # puente WSGI, la verificación de tokens y la E/S de disco
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+    # Tope del cuerpo de las rutas async (se lee completo antes del handler);
+    # las rutas de Flask lo reciben como stream y no tienen este límite
+    ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', 16 * 1024 * 1024))
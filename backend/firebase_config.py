@@ -1,12 +1,207 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import sys
+import threading
 from config import Config
 
+# Nada se conecta ni se leen credenciales al importar este módulo: el SDK de
+# Firebase y el cliente de Firestore se crean en el primer uso (o en warmup)
+_lock = threading.RLock()
+_db = None
+_async_db = None
+_auth_app = None  # app cuyo cliente de Auth ya se preparó
+
+
+def get_firebase_app():
+    """Inicializar Firebase Admin SDK (una sola vez por proceso)"""
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _lock:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(Config.FIREBASE_CREDENTIALS_PATH)
+            firebase_admin.initialize_app(cred)
+    return firebase_admin.get_app()
+
+
+def get_auth():
+    """Módulo firebase_admin.auth con la app ya inicializada"""
+    global _auth_app
+    app = get_firebase_app()
+    from firebase_admin import auth
+
+    if _auth_app is not app:
+        with _lock:
+            if _auth_app is not app:
+                _configure_auth_pool(auth, app)
+                _prepare_token_signer(auth, app)
+                _auth_app = app
+    return auth
+
+
+def _configure_auth_pool(auth, app):
+    """Un pool HTTP del tamaño de Config.AUTH_HTTP_POOL_SIZE para la API de Auth
+
+    requests usa 10 conexiones por defecto; con más hilos por worker las
+    sobrantes se abren y se descartan en cada llamada.
+    """
+    import requests
+    from firebase_admin import _http_client
+
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=Config.AUTH_HTTP_POOL_SIZE,
+                                            max_retries=_http_client.DEFAULT_RETRY_CONFIG)
+    auth._get_client(app)._user_manager.http_client.session.mount('https://', adapter)
+
+
+def _prepare_token_signer(auth, app):
+    """Crear una sola vez, bajo el lock, el firmante de los custom tokens
+
+    El SDK lo crea perezosamente en el primer create_custom_token, sin lock
+    y reintentándolo en cada llamada si falla; así el primer login no paga
+    la carga de la credencial y cada token solo cuesta la firma.
+    """
+    try:
+        auth._get_client(app)._token_generator.signing_provider
+    except ValueError:
+        # Credencial sin cuenta de servicio: create_custom_token dará el error
+        pass
+
+
+def _configure_channel():
+    """Opciones del canal gRPC que crea cada cliente de Firestore (sync y async)"""
+    from google.cloud.firestore_v1 import base_client
+
+    options = dict(base_client._DEFAULT_CHANNEL_OPTIONS)
+    options.update({
+        'grpc.keepalive_time_ms': Config.FIRESTORE_KEEPALIVE_MS,
+        'grpc.keepalive_timeout_ms': Config.FIRESTORE_KEEPALIVE_TIMEOUT_MS,
+        'grpc.http2.max_pings_without_data': 0,
+    })
+    base_client._DEFAULT_CHANNEL_OPTIONS = list(options.items())
+
+
 def initialize_firebase():
-    """Inicializar Firebase Admin SDK"""
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(Config.FIREBASE_CREDENTIALS_PATH)
-        firebase_admin.initialize_app(cred)
+    """Cliente de Firestore de la app por defecto"""
+    from firebase_admin import firestore
+
+    get_firebase_app()
+    _configure_channel()
     return firestore.client()
 
-db = initialize_firebase()
+
+def create_db(name):
+    """Crear el almacén de documentos configurado en Config.STORAGE_BACKEND"""
+    if name == 'firestore':
+        return initialize_firebase()
+    if name == 'sqlite':
+        from storage.sqlite_store import SQLiteStore
+        store = SQLiteStore(Config.SQLITE_STORAGE_PATH, track_changes=Config.STORAGE_REPLICATE,
+                            watch_interval=Config.SQLITE_WATCH_INTERVAL)
+        if Config.STORAGE_REPLICATE:
+            from storage.replicator import FirestoreReplicator
+            store.replicator = FirestoreReplicator(
+                store, initialize_firebase,
+                batch_size=Config.FIRESTORE_BATCH_LIMIT,
+                interval=Config.REPLICATION_INTERVAL,
+                max_backoff=Config.REPLICATION_MAX_BACKOFF
+            )
+            store.replicator.start()
+        return store
+    raise ValueError(f"Backend de almacenamiento desconocido: {name}")
+
+
+def get_db():
+    """Almacén de documentos del proceso (se crea al primer uso)"""
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                if Config.METRICS_ENABLED:
+                    from services.metrics import instrument_firestore
+                    instrument_firestore()
+                _db = create_db(Config.STORAGE_BACKEND)
+    return _db
+
+
+def close_client(client):
+    """Cerrar el canal gRPC de un cliente de Firestore (si llegó a abrirse)"""
+    transport = getattr(client, '_transport', None)
+    if transport is not None:
+        transport.close()
+
+
+def close_db(timeout=10):
+    """Cerrar el almacén del proceso al apagar un worker
+
+    Con el almacén local, el replicador sube lo pendiente antes de cerrar
+    (si este proceso tiene el lease).
+    """
+    global _db
+    with _lock:
+        store, _db = _db, None
+    if store is None:
+        return
+    replicator = getattr(store, 'replicator', None)
+    if replicator is not None:
+        replicator.shutdown(timeout)
+        close_client(replicator.remote)
+    close_client(store)
+
+
+def reset_after_fork():
+    """Descartar en un proceso hijo la app y los clientes heredados del padre
+
+    Los canales gRPC no sobreviven a un fork: cada worker crea los suyos al
+    primer uso. Se conserva la credencial ya leída (no abre conexiones).
+    """
+    global _lock, _db, _async_db, _auth_app
+    # Un lock tomado por otro hilo del padre quedaría tomado para siempre
+    _lock = threading.RLock()
+    _db = None
+    _async_db = None
+    _auth_app = None
+
+    firebase_admin = sys.modules.get('firebase_admin')
+    if firebase_admin is None or not firebase_admin._apps:
+        return
+    app = firebase_admin.get_app()
+    firebase_admin.delete_app(app)
+    firebase_admin.initialize_app(app.credential)
+    # Pool HTTP y firmante de la app nueva: locales, no abren conexiones
+    get_auth()
+
+
+def db_initialized():
+    """Si el almacén ya se creó en este proceso"""
+    return _db is not None
+
+
+class LazyClient:
+    """Referencia al almacén que lo crea en el primer acceso
+
+    Los módulos siguen haciendo `from firebase_config import db`; con este
+    proxy importarlos ya no conecta a Firestore ni exige credenciales.
+    """
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __repr__(self):
+        return f"<LazyClient {Config.STORAGE_BACKEND} {'listo' if db_initialized() else 'sin crear'}>"
+
+
+db = LazyClient()
+
+
+def get_async_db():
+    """Cliente asíncrono para el modo ASGI (se crea al primer uso, dentro del loop)"""
+    global _async_db
+    if _async_db is None:
+        if Config.STORAGE_BACKEND == 'firestore':
+            from firebase_admin import firestore_async
+            get_firebase_app()
+            _async_db = firestore_async.client()
+        else:
+            from storage.aio import AsyncStoreAdapter
+            _async_db = AsyncStoreAdapter(get_db())
+    return _async_db
@@ -0,0 +1,54 @@
+"""Configuración de gunicorn para producción
+
+Uso (desde backend/):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Los valores salen de Config (WEB_*). Con preload_app el maestro importa la
+app y ejecuta warmup() una sola vez; después del fork cada worker recrea la
+app de Firebase y crea su propio canal gRPC (post_fork), y al salir termina
+lo que tenía en vuelo: QR pendientes, outbox del almacén local (worker_exit).
+"""
+import signal
+import threading
+from config import Config
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+worker_class = 'gthread'
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+keepalive = Config.WEB_KEEPALIVE
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS // 10
+preload_app = Config.WEB_PRELOAD
+
+
+def post_fork(server, worker):
+    from app import after_fork
+
+    after_fork()
+
+
+def post_worker_init(worker):
+    """Con SIGTERM cerrar los streams SSE antes de esperar las peticiones en curso
+
+    Si no, cada cliente SSE conectado retiene el apagado hasta graceful_timeout.
+    """
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        from services.lot_stream import lot_stream_hub
+
+        # Fuera del manejador de señales: cerrar los listeners toma locks y red
+        threading.Thread(target=lot_stream_hub.close, name='lot-stream-close', daemon=True).start()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+
+    shutdown()
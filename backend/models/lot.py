@@ -1,11 +1,21 @@
 import uuid
 from datetime import datetime
-from firebase_admin import firestore
 from firebase_config import db
-import qrcode
+from services.qr_worker import qr_renderer
+from services.qr_store import QRStore, qr_store
+from services.lot_cache import lot_cache
+from services.qr_payload import compact_payload
+from services.structured_log import get_logger
+from config import Config
 import json
 import base64
-from io import BytesIO
+
+log = get_logger('lot')
+
+
+class InvalidCursorError(ValueError):
+    """Cursor de paginación malformado"""
+
 
 class Lot:
     def __init__(self, farmer_uid, crop_type, quantity, unit='kg', location=None, 
@@ -17,7 +27,8 @@ class Lot:
         self.unit = unit
         self.location = location
         self.status = 'active'
-        self.qr_code = None
+        self.qr_ref = None
+        self.qr_status = None
         
         # Generar código de trazabilidad DIRECTAMENTE aquí
         timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
@@ -26,7 +37,6 @@ class Lot:
         self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
         self.harvest_date = None
-        self.events = []
         
         # Nuevos campos
         self.certifications = certifications or []
@@ -38,35 +48,35 @@ class Lot:
             'emissionsReduced': 0
         }
     
-    def generate_qr(self):
-        """Generar código QR para el lote"""
+    def qr_payload(self):
+        """Contenido que se codifica en el QR (según Config.QR_PAYLOAD_MODE)"""
+        return Lot.qr_payload_for(self.id, vars(self))
+
+    @staticmethod
+    def qr_payload_for(lot_id, lot_data):
+        """Contenido del QR a partir de los datos de un lote (objeto o documento)"""
+        mode = Config.QR_PAYLOAD_MODE
+        if mode in ('compact', 'signed'):
+            return compact_payload(lot_data['traceability_code'], signed=mode == 'signed')
+
+        created_at = lot_data.get('created_at')
         qr_data = {
-            'lot_id': self.id,
-            'traceability_code': self.traceability_code,
-            'crop_type': self.crop_type,
-            'quantity': f"{self.quantity} {self.unit}",
-            'created_at': self.created_at.isoformat(),
-            'farmer_uid': self.farmer_uid
+            'lot_id': lot_id,
+            'traceability_code': lot_data.get('traceability_code'),
+            'crop_type': lot_data.get('crop_type'),
+            'quantity': f"{lot_data.get('quantity')} {lot_data.get('unit')}",
+            'created_at': created_at.isoformat() if created_at else None,
+            'farmer_uid': lot_data.get('farmer_uid')
         }
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(json.dumps(qr_data))
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Guardar QR como base64
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        self.qr_code = img_str
-        return img_str
+        return json.dumps(qr_data)
+
+    def generate_qr(self):
+        """Generar código QR para el lote y guardarlo en el QRStore"""
+        image = qr_renderer.render(self.qr_payload())
+
+        self.qr_ref = qr_store.put(image, qr_renderer.extension)
+        self.qr_status = 'ready'
+        return self.qr_ref
     
     def to_dict(self):
         """Convertir a diccionario serializable para Firestore"""
@@ -78,81 +88,289 @@ class Lot:
             'unit': self.unit,
             'location': self.location,
             'status': self.status,
-            'qr_code': self.qr_code,
+            'qr_ref': self.qr_ref,
+            'qr_status': self.qr_status,
             'traceability_code': self.traceability_code,
             'created_at': self.created_at,
             'updated_at': self.updated_at,
             'harvest_date': self.harvest_date,
-            'events': self.events,
             'certifications': self.certifications,
             'price': self.price,
             'currency': self.currency,
-            'sustainability_metrics': self.sustainability_metrics
+            'sustainability_metrics': self.sustainability_metrics,
+            # Versión por campo para el merge de sync; vacío = created_at
+            'field_versions': {}
         }
     
-    def save(self):
-        """Guardar lote en Firestore"""
+    def to_document(self):
+        """Datos a escribir en Firestore: updated_at lo fija el servidor al hacer commit"""
+        return Lot.stamped(self.to_dict())
+    
+    @staticmethod
+    def stamped(data):
+        """Copia de data con updated_at = SERVER_TIMESTAMP
+
+        El pull delta (get_changes) recorre los lotes por updated_at; con la
+        hora del commit no dependen del reloj de cada worker. Toda escritura
+        de un lote que el cliente deba ver pasa por aquí (o por versioned).
+        """
+        from firebase_admin import firestore
+
+        return dict(data, updated_at=firestore.SERVER_TIMESTAMP)
+    
+    def save(self, batch=None):
+        """Guardar lote en Firestore
+
+        Si se pasa un WriteBatch, el lote se agrega a él y se hace commit
+        de todo junto (por ejemplo con su evento de creación).
+        """
         try:
-            if not self.qr_code:
+            render_async = not self.qr_ref and not qr_renderer.is_sync
+            if render_async:
+                # Reservar lugar en la cola antes de escribir (backpressure)
+                qr_renderer.reserve()
+                self.qr_status = 'pending'
+            elif not self.qr_ref:
                 self.generate_qr()
             
             # Guardar en Firestore
-            db.collection('lots').document(self.id).set(self.to_dict())
-            print(f"✅ Lote guardado exitosamente: {self.id}")
+            try:
+                lot_ref = db.collection('lots').document(self.id)
+                if batch is None:
+                    lot_ref.set(self.to_document())
+                else:
+                    batch.set(lot_ref, self.to_document())
+                    batch.commit()
+            except Exception:
+                if render_async:
+                    qr_renderer.release()
+                raise
+            
+            # El worker completa qr_ref y qr_status cuando termina
+            if render_async:
+                try:
+                    qr_renderer.submit_reserved(self.id, self.qr_payload(), farmer_uid=self.farmer_uid)
+                except Exception as e:
+                    # El lote ya está guardado: un 500 haría que el cliente lo duplicara
+                    log.warning('No se pudo encolar el QR, se renderiza en el hilo', lot_id=self.id, error=str(e))
+                    self._render_after_save()
+            
+            log.debug('Lote guardado', lot_id=self.id)
             return self
         except Exception as e:
-            print(f"❌ Error al guardar lote: {str(e)}")
+            log.error('Error al guardar lote', lot_id=self.id, error=str(e))
             raise e
     
+    def _render_after_save(self):
+        """Completar el QR de un lote ya guardado sin el pool (o marcarlo como fallido)"""
+        try:
+            self.generate_qr()
+            update_data = {'qr_ref': self.qr_ref, 'qr_status': 'ready'}
+        except Exception as e:
+            log.error('Error al generar QR', lot_id=self.id, error=str(e))
+            self.qr_status = 'failed'
+            update_data = {'qr_status': 'failed'}
+        try:
+            db.collection('lots').document(self.id).update(Lot.stamped(update_data))
+        except Exception as e:
+            log.error('Error al guardar el QR del lote', lot_id=self.id, error=str(e))
+        lot_cache.invalidate(lot_ids=[self.id], farmer_uids=[self.farmer_uid])
+
     def update(self, data):
         """Actualizar lote"""
         allowed_fields = ['crop_type', 'quantity', 'unit', 'location', 'status', 'harvest_date', 
                          'certifications', 'price', 'currency', 'sustainability_metrics']
         update_data = {k: v for k, v in data.items() if k in allowed_fields}
-        update_data['updated_at'] = datetime.utcnow()
         
-        db.collection('lots').document(self.id).update(update_data)
+        db.collection('lots').document(self.id).update(Lot.versioned(update_data))
+        lot_cache.invalidate(lot_ids=[self.id], farmer_uids=[self.farmer_uid])
         return self
     
     def delete(self):
         """Eliminar lote (soft delete)"""
-        db.collection('lots').document(self.id).update({
-            'status': 'deleted',
-            'updated_at': datetime.utcnow()
-        })
+        db.collection('lots').document(self.id).update(Lot.versioned({'status': 'deleted'}))
+        lot_cache.invalidate(lot_ids=[self.id], farmer_uids=[self.farmer_uid])
     
-    def add_event(self, event_type, description, metadata=None):
-        """Agregar evento de trazabilidad"""
-        event = {
+    @staticmethod
+    def new_event(event_type, description, metadata=None, lot_id=None, farmer_uid=None):
+        """Construir un evento de trazabilidad sin guardarlo
+
+        lot_id y farmer_uid permiten consultar los eventos de un agricultor
+        con una consulta de grupo de colecciones (sync delta).
+        """
+        return {
             'id': str(uuid.uuid4()),
+            'lot_id': lot_id,
+            'farmer_uid': farmer_uid,
             'type': event_type,
             'description': description,
             'metadata': metadata or {},
             'timestamp': datetime.utcnow()
         }
-        
-        # Usar ArrayUnion correctamente
-        db.collection('lots').document(self.id).update({
-            'events': firestore.ArrayUnion([event])
-        })
+    
+    @staticmethod
+    def versioned(update_data, at=None):
+        """Agregar la versión por campo (field_versions.<campo>) a un update
+
+        updated_at siempre queda como SERVER_TIMESTAMP (ver stamped).
+        """
+        at = at or update_data.get('updated_at') or datetime.utcnow()
+        data = Lot.stamped(update_data)
+        for field in update_data:
+            if field != 'updated_at':
+                data[f'field_versions.{field}'] = at
+        return data
+    
+    @staticmethod
+    def trace_code_ref(traceability_code):
+        """Entrada del índice código de trazabilidad -> lote"""
+        return db.collection('trace_codes').document(traceability_code)
+    
+    def trace_index(self):
+        """Datos de la entrada del índice de trazabilidad de este lote"""
+        return {
+            'lot_id': self.id,
+            'farmer_uid': self.farmer_uid,
+            'created_at': self.created_at
+        }
+    
+    @staticmethod
+    def event_ref(lot_id, event_id):
+        """Referencia a un evento en la subcolección lots/{id}/events"""
+        return db.collection('lots').document(lot_id).collection('events').document(event_id)
+    
+    def add_event(self, event_type, description, metadata=None):
+        """Agregar evento de trazabilidad"""
+        event = Lot.new_event(event_type, description, metadata, lot_id=self.id, farmer_uid=self.farmer_uid)
+        Lot.event_ref(self.id, event['id']).set(event)
         return event
     
+    @staticmethod
+    def get_events(lot_id, limit=50, cursor=None):
+        """Obtener una página de eventos del lote ordenada por (timestamp, id)
+
+        Devuelve (eventos, next_cursor); next_cursor es None en la última página.
+        """
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        query = (db.collection('lots').document(lot_id).collection('events')
+                 .order_by('timestamp')
+                 .order_by(FieldPath.document_id()))
+        
+        if cursor:
+            timestamp, event_id = Lot.decode_cursor(cursor)
+            query = query.start_after({'timestamp': timestamp, '__name__': event_id})
+        
+        docs = list(query.limit(limit + 1).stream())
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        
+        events = [doc.to_dict() for doc in docs]
+        next_cursor = None
+        if has_more and docs:
+            next_cursor = Lot.encode_cursor(docs[-1].get('timestamp'), docs[-1].id)
+        
+        return events, next_cursor
+    
+    @staticmethod
+    def migrate_embedded_events(batch_limit=500):
+        """Mover los eventos guardados en el arreglo 'events' a la subcolección
+
+        Es idempotente: cada evento conserva su id como id del documento.
+        Los eventos copiados llevan lot_id y farmer_uid para que el grupo
+        de colecciones de get_changes los encuentre.
+        Devuelve (lotes migrados, eventos migrados).
+        """
+        from firebase_admin import firestore
+
+        migrated_lots = 0
+        migrated_events = 0
+        batch = db.batch()
+        ops = 0
+        
+        for doc in db.collection('lots').select(['events', 'farmer_uid']).stream():
+            lot_data = doc.to_dict() or {}
+            events = lot_data.get('events')
+            if not events:
+                continue
+            
+            # El arreglo se borra después de copiar todos sus eventos
+            for event in events + [None]:
+                if ops >= batch_limit:
+                    batch.commit()
+                    batch = db.batch()
+                    ops = 0
+                if event is None:
+                    batch.update(doc.reference, {'events': firestore.DELETE_FIELD})
+                else:
+                    event_id = event.get('id') or str(uuid.uuid4())
+                    batch.set(Lot.event_ref(doc.id, event_id), dict(
+                        event, id=event_id, lot_id=doc.id, farmer_uid=lot_data.get('farmer_uid')))
+                ops += 1
+            
+            migrated_lots += 1
+            migrated_events += len(events)
+        
+        if ops:
+            batch.commit()
+        
+        return migrated_lots, migrated_events
+    
+    @staticmethod
+    def backfill_event_owners(batch_limit=500):
+        """Completar lot_id y farmer_uid en eventos ya guardados sin ellos
+
+        Cubre los eventos que migrate_embedded_events copió antes de
+        incluir esos campos. Es idempotente. Devuelve los eventos corregidos.
+        """
+        updated = 0
+        batch = db.batch()
+        ops = 0
+        for lot_doc in db.collection('lots').select(['farmer_uid']).stream():
+            farmer_uid = (lot_doc.to_dict() or {}).get('farmer_uid')
+            events = lot_doc.reference.collection('events').select(['lot_id', 'farmer_uid']).stream()
+            for event_doc in events:
+                event = event_doc.to_dict() or {}
+                if event.get('lot_id') == lot_doc.id and event.get('farmer_uid') == farmer_uid:
+                    continue
+                batch.update(event_doc.reference, {'lot_id': lot_doc.id, 'farmer_uid': farmer_uid})
+                ops += 1
+                updated += 1
+                if ops >= batch_limit:
+                    batch.commit()
+                    batch = db.batch()
+                    ops = 0
+        if ops:
+            batch.commit()
+        return updated
+    
     @staticmethod
     def get_by_id(lot_id):
-        """Obtener lote por ID"""
-        try:
+        """Obtener lote por ID (a través de la caché de lotes)"""
+        def load():
             doc = db.collection('lots').document(lot_id).get()
             if doc.exists:
                 return doc.to_dict()
             return None
+        
+        try:
+            return lot_cache.get_or_load(lot_cache.lot_key(lot_id), load)
         except Exception as e:
-            print(f"❌ Error al obtener lote: {str(e)}")
+            log.exception('Error al obtener lote', lot_id=lot_id)
             return None
     
+    @staticmethod
+    def get_snapshot(lot_id):
+        """Obtener el DocumentSnapshot del lote (incluye update_time) o None"""
+        doc = db.collection('lots').document(lot_id).get()
+        return doc if doc.exists else None
+    
     @staticmethod
     def get_by_farmer(farmer_uid, include_deleted=False):
-        """Obtener todos los lotes de un agricultor"""
-        try:
+        """Obtener todos los lotes de un agricultor (a través de la caché de lotes)"""
+        def load():
+            from firebase_admin import firestore
+
             query = db.collection('lots').where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
             
             if not include_deleted:
@@ -163,10 +381,182 @@ class Lot:
             for doc in docs:
                 lot_data = doc.to_dict()
                 lot_data['id'] = doc.id
+                # Los lotes antiguos traen el PNG en base64; se sirve por /qr
+                lot_data.pop('qr_code', None)
                 lots.append(lot_data)
-            
-            print(f"✅ Encontrados {len(lots)} lotes para farmer {farmer_uid}")
+            return lots
+        
+        try:
+            lots = lot_cache.get_or_load(lot_cache.farmer_key(farmer_uid, 'all', include_deleted), load)
+            log.debug('Lotes encontrados', farmer_uid=farmer_uid, count=len(lots))
             return lots
         except Exception as e:
-            print(f"❌ Error al obtener lotes: {str(e)}")
-            return []
\ No newline at end of file
+            log.exception('Error al obtener lotes', farmer_uid=farmer_uid)
+            return []
+    
+    # Campos que se pueden pedir con ?fields= (el QR se sirve aparte)
+    LISTABLE_FIELDS = (
+        'farmer_uid', 'crop_type', 'quantity', 'unit', 'location', 'status',
+        'qr_ref', 'qr_status', 'traceability_code', 'created_at', 'updated_at',
+        'harvest_date', 'certifications', 'price', 'currency',
+        'sustainability_metrics'
+    )
+    
+    @staticmethod
+    def encode_cursor(created_at, lot_id):
+        """Cursor opaco a partir del último lote de la página"""
+        raw = json.dumps({'c': created_at.isoformat(), 'i': lot_id})
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Obtener (created_at, lot_id) de un cursor opaco"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return datetime.fromisoformat(raw['c']), str(raw['i'])
+        except Exception:
+            raise InvalidCursorError('Cursor inválido')
+    
+    @staticmethod
+    def get_page_by_farmer(farmer_uid, include_deleted=False, limit=50, cursor=None, fields=None):
+        """Obtener una página de lotes de un agricultor (a través de la caché de lotes)
+
+        Devuelve (lotes, next_cursor); next_cursor es None en la última página.
+        """
+        key = lot_cache.farmer_key(
+            farmer_uid, 'page', include_deleted, limit, cursor, ','.join(sorted(fields or []))
+        )
+        return lot_cache.get_or_load(
+            key, lambda: Lot._query_page_by_farmer(farmer_uid, include_deleted, limit, cursor, fields)
+        )
+    
+    @staticmethod
+    def _query_page_by_farmer(farmer_uid, include_deleted, limit, cursor, fields):
+        """Consultar en Firestore una página ordenada por (created_at, id)
+
+        Requiere el índice compuesto farmer_uid + status + created_at.
+        """
+        from firebase_admin import firestore
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        query = db.collection('lots').where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
+        
+        if not include_deleted:
+            query = query.where(filter=firestore.FieldFilter('status', '==', 'active'))
+        
+        query = query.order_by('created_at').order_by(FieldPath.document_id())
+        
+        if fields:
+            # created_at siempre se proyecta porque forma parte del cursor
+            query = query.select(sorted(set(fields) | {'created_at'}))
+        
+        if cursor:
+            created_at, lot_id = Lot.decode_cursor(cursor)
+            query = query.start_after({'created_at': created_at, '__name__': lot_id})
+        
+        # Se pide un documento extra para saber si hay otra página
+        docs = list(query.limit(limit + 1).stream())
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        
+        lots = []
+        for doc in docs:
+            lot_data = doc.to_dict()
+            lot_data['id'] = doc.id
+            lot_data.pop('qr_code', None)
+            lots.append(lot_data)
+        
+        next_cursor = None
+        if has_more and docs:
+            last = docs[-1]
+            next_cursor = Lot.encode_cursor(last.get('created_at'), last.id)
+        
+        return lots, next_cursor
+    
+    @staticmethod
+    def get_qr(lot_id):
+        """Obtener (qr_ref, bytes de la imagen) de un lote, o (None, None)
+
+        Solo lee: la ruta es pública y nunca escribe el lote. Los lotes
+        eliminados no tienen QR. El formato de la imagen se deduce de qr_ref
+        (QRStore.mimetype); las imágenes que falten en este QRStore las
+        vuelve a generar `flask repair-qr`.
+        """
+        lot_data = Lot.get_by_id(lot_id)
+        if not lot_data or lot_data.get('status') == 'deleted':
+            return None, None
+        
+        qr_ref = lot_data.get('qr_ref')
+        if qr_ref:
+            image = qr_store.get(qr_ref)
+            if image is None:
+                log.warning('Imagen de QR no encontrada (flask repair-qr)', lot_id=lot_id, qr_ref=qr_ref)
+                return None, None
+            return qr_ref, image
+        
+        # Lotes antiguos con el QR dentro del documento (los migra repair-qr)
+        if lot_data.get('qr_code'):
+            image = base64.b64decode(lot_data['qr_code'])
+            return QRStore.ref_of(image), image
+        
+        return None, None
+    
+    @staticmethod
+    def repair_qr(batch_limit=500):
+        """Reparar los QR de los lotes (comando, fuera de la ruta pública)
+
+        Migra al QRStore los QR guardados dentro del documento (qr_code) y
+        vuelve a renderizar las imágenes que faltan en este QRStore y los QR
+        que quedaron 'failed'. updated_at solo cambia si cambia qr_status:
+        una referencia nueva a la misma imagen no es un cambio para el
+        cliente. Es idempotente. Devuelve {'migrated', 'rendered', 'failed'}.
+        """
+        from firebase_admin import firestore
+
+        counts = {'migrated': 0, 'rendered': 0, 'failed': 0}
+        batch = db.batch()
+        pending = []  # (lot_id, farmer_uid) del batch en curso
+        for doc in db.collection('lots').stream():
+            lot_data = doc.to_dict() or {}
+            if lot_data.get('status') == 'deleted':
+                continue
+            qr_ref = lot_data.get('qr_ref')
+            try:
+                if lot_data.get('qr_code'):
+                    update_data = {
+                        'qr_ref': qr_store.put(base64.b64decode(lot_data['qr_code'])),
+                        'qr_code': firestore.DELETE_FIELD
+                    }
+                    counts['migrated'] += 1
+                elif (qr_ref and not qr_store.exists(qr_ref)) or lot_data.get('qr_status') == 'failed':
+                    image = qr_renderer.render(Lot.qr_payload_for(doc.id, lot_data))
+                    update_data = {'qr_ref': qr_store.put(image, qr_renderer.extension)}
+                    counts['rendered'] += 1
+                else:
+                    continue
+            except Exception as e:
+                log.warning('Error al reparar QR', lot_id=doc.id, error=str(e))
+                counts['failed'] += 1
+                continue
+            
+            if lot_data.get('qr_status') != 'ready':
+                # El pull delta debe entregar el QR que pasó a estar listo
+                update_data = Lot.stamped(dict(update_data, qr_status='ready'))
+            elif update_data == {'qr_ref': qr_ref}:
+                continue
+            batch.update(doc.reference, update_data)
+            pending.append((doc.id, lot_data.get('farmer_uid')))
+            if len(pending) >= batch_limit:
+                Lot._commit_repair(batch, pending)
+                batch = db.batch()
+                pending = []
+        if pending:
+            Lot._commit_repair(batch, pending)
+        return counts
+    
+    @staticmethod
+    def _commit_repair(batch, pending):
+        batch.commit()
+        lot_cache.invalidate(lot_ids=[lot_id for lot_id, _ in pending],
+                             farmer_uids=[farmer_uid for _, farmer_uid in pending if farmer_uid])
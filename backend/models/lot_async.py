@@ -0,0 +1,164 @@
+import asyncio
+from firebase_config import get_async_db
+from models.lot import Lot
+from services.lot_cache import lot_cache
+from services.lot_writer import ConcurrentModificationError
+from services.qr_worker import QRQueueFullError, qr_renderer
+from services.qr_store import qr_store
+from services.report_service import ReportService
+from storage.aio import RebasedBatch
+from config import Config
+
+# Renderizados de QR en curso en el proceso (mismo límite que la cola síncrona)
+_render_slots = None
+
+
+def _slots():
+    global _render_slots
+    if _render_slots is None:
+        _render_slots = asyncio.Semaphore(Config.QR_MAX_PENDING)
+    return _render_slots
+
+
+class AsyncLot:
+    """Operaciones de Lot para el modo ASGI (firestore.AsyncClient)
+
+    La construcción de lotes, eventos, cursores y payloads es la de Lot;
+    aquí solo cambia la E/S, que no bloquea el loop.
+    """
+
+    @staticmethod
+    def ref(lot_id):
+        return get_async_db().collection('lots').document(lot_id)
+
+    @staticmethod
+    async def get_snapshot(lot_id):
+        """DocumentSnapshot del lote (incluye update_time) o None"""
+        doc = await AsyncLot.ref(lot_id).get()
+        return doc if doc.exists else None
+
+    @staticmethod
+    async def get_by_id(lot_id):
+        """Obtener lote por ID (a través de la caché de lotes)"""
+        async def load():
+            doc = await AsyncLot.ref(lot_id).get()
+            return doc.to_dict() if doc.exists else None
+
+        return await lot_cache.aget_or_load(lot_cache.lot_key(lot_id), load)
+
+    @staticmethod
+    async def get_page_by_farmer(farmer_uid, include_deleted=False, limit=50, cursor=None, fields=None):
+        """Página de lotes del agricultor; misma clave de caché que Lot.get_page_by_farmer"""
+        key = lot_cache.farmer_key(
+            farmer_uid, 'page', include_deleted, limit, cursor, ','.join(sorted(fields or []))
+        )
+        return await lot_cache.aget_or_load(
+            key, lambda: AsyncLot._query_page_by_farmer(farmer_uid, include_deleted, limit, cursor, fields)
+        )
+
+    @staticmethod
+    async def _query_page_by_farmer(farmer_uid, include_deleted, limit, cursor, fields):
+        from firebase_admin import firestore
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        query = get_async_db().collection('lots').where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
+        if not include_deleted:
+            query = query.where(filter=firestore.FieldFilter('status', '==', 'active'))
+        query = query.order_by('created_at').order_by(FieldPath.document_id())
+        if fields:
+            query = query.select(sorted(set(fields) | {'created_at'}))
+        if cursor:
+            created_at, lot_id = Lot.decode_cursor(cursor)
+            query = query.start_after({'created_at': created_at, '__name__': lot_id})
+
+        docs = [doc async for doc in query.limit(limit + 1).stream()]
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+
+        lots = []
+        for doc in docs:
+            lot_data = doc.to_dict()
+            lot_data['id'] = doc.id
+            lot_data.pop('qr_code', None)
+            lots.append(lot_data)
+
+        next_cursor = None
+        if has_more and docs:
+            next_cursor = Lot.encode_cursor(docs[-1].get('created_at'), docs[-1].id)
+        return lots, next_cursor
+
+    @staticmethod
+    async def get_events(lot_id, limit=50, cursor=None):
+        """Página de eventos del lote ordenada por (timestamp, id)"""
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        query = (AsyncLot.ref(lot_id).collection('events')
+                 .order_by('timestamp')
+                 .order_by(FieldPath.document_id()))
+        if cursor:
+            timestamp, event_id = Lot.decode_cursor(cursor)
+            query = query.start_after({'timestamp': timestamp, '__name__': event_id})
+
+        docs = [doc async for doc in query.limit(limit + 1).stream()]
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = None
+        if has_more and docs:
+            next_cursor = Lot.encode_cursor(docs[-1].get('timestamp'), docs[-1].id)
+        return [doc.to_dict() for doc in docs], next_cursor
+
+    @staticmethod
+    async def generate_qr(lot):
+        """Renderizar el QR fuera del loop y guardarlo en el QRStore
+
+        A diferencia del modo síncrono no hace falta diferirlo a un worker
+        con una segunda escritura: esperar no bloquea a otras peticiones.
+        """
+        try:
+            await asyncio.wait_for(_slots().acquire(), timeout=Config.QR_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            qr_renderer.count('rejected')
+            raise QRQueueFullError('Demasiados códigos QR pendientes, intenta de nuevo en unos segundos')
+        try:
+            image = await qr_renderer.render_async(lot.qr_payload())
+        finally:
+            _slots().release()
+        lot.qr_ref = await asyncio.to_thread(qr_store.put, image, qr_renderer.extension)
+        lot.qr_status = 'ready'
+        return lot.qr_ref
+
+    @staticmethod
+    def add_create(batch, lot, event):
+        """Agregar a un RebasedBatch el lote, su evento y su entrada de trazabilidad"""
+        batch.set(Lot.event_ref(lot.id, event['id']), event)
+        batch.set(Lot.trace_code_ref(lot.traceability_code), lot.trace_index())
+        batch.set(get_async_db().collection('lots').document(lot.id), lot.to_document())
+
+    @staticmethod
+    async def create(lot, event, stats_delta=None):
+        """Guardar un lote nuevo con su evento en un solo commit (QR incluido)"""
+        if not lot.qr_ref:
+            await AsyncLot.generate_qr(lot)
+        batch = RebasedBatch(get_async_db())
+        AsyncLot.add_create(batch, lot, event)
+        if stats_delta:
+            ReportService.apply_delta(batch, lot.farmer_uid, stats_delta)
+        await batch.commit()
+        return lot
+
+    @staticmethod
+    async def update_if_unchanged(snapshot, update_data, event, stats_delta=None):
+        """Equivalente async de LotWriter.update_if_unchanged"""
+        from google.api_core.exceptions import FailedPrecondition
+
+        client = get_async_db()
+        batch = RebasedBatch(client)
+        batch.update(snapshot.reference, update_data,
+                     option=client.write_option(last_update_time=snapshot.update_time))
+        batch.set(Lot.event_ref(snapshot.id, event['id']), event)
+        if stats_delta:
+            ReportService.apply_delta(batch, snapshot.get('farmer_uid'), stats_delta)
+        try:
+            await batch.commit()
+        except FailedPrecondition as e:
+            raise ConcurrentModificationError(str(e))
@@ -1,5 +1,6 @@
 from datetime import datetime
 from firebase_config import db
+from services.user_cache import user_cache
 
 class User:
     def __init__(self, uid, email, name=None, phone=None, farm_name=None):
@@ -26,10 +27,13 @@ class User:
     def save(self):
         """Guardar usuario en Firestore"""
         db.collection('users').document(self.uid).set(self.to_dict())
+        user_cache.invalidate_user(self.uid)
         return self
     
     @staticmethod
     def get_by_uid(uid):
         """Obtener usuario por UID"""
-        doc = db.collection('users').document(uid).get()
-        return doc.to_dict() if doc.exists else None
\ No newline at end of file
+        def load():
+            doc = db.collection('users').document(uid).get()
+            return doc.to_dict() if doc.exists else None
+        return user_cache.get_or_load(user_cache.user_key(uid), load)
@@ -0,0 +1,21 @@
+from firebase_config import get_async_db
+from services.user_cache import user_cache
+
+
+class AsyncUser:
+    """Operaciones de User para el modo ASGI"""
+
+    @staticmethod
+    async def save(user):
+        """Guardar un User en Firestore"""
+        await get_async_db().collection('users').document(user.uid).set(user.to_dict())
+        user_cache.invalidate_user(user.uid)
+        return user
+
+    @staticmethod
+    async def get_by_uid(uid):
+        """Obtener usuario por UID"""
+        async def load():
+            doc = await get_async_db().collection('users').document(uid).get()
+            return doc.to_dict() if doc.exists else None
+        return await user_cache.aget_or_load(user_cache.user_key(uid), load)
@@ -1,6 +1,32 @@
-from firebase_admin import auth
+from firebase_config import get_auth
 from models.user import User
+from services.token_cache import token_cache
+from services.user_cache import user_cache
+from services.metrics import LOGIN_STEP_LATENCY
+from services.structured_log import get_logger
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
 import re
+import threading
+import time
+
+log = get_logger('auth_service')
+
+# Hilos para leer el perfil mientras Firebase Auth responde. Se crean en el
+# primer login, ya dentro del worker (los hilos no sobreviven a un fork)
+_lookups = None
+_lookups_lock = threading.Lock()
+
+
+def _lookup_pool():
+    global _lookups
+    if _lookups is None:
+        with _lookups_lock:
+            if _lookups is None:
+                _lookups = ThreadPoolExecutor(max_workers=Config.AUTH_LOGIN_THREADS,
+                                              thread_name_prefix='auth-lookup')
+    return _lookups
+
 
 class AuthService:
     @staticmethod
@@ -19,6 +45,7 @@ class AuthService:
     @staticmethod
     def register_user(email, password, name=None, phone=None, farm_name=None):
         """Registrar nuevo usuario"""
+        auth = get_auth()
         try:
             # Validaciones
             if not AuthService.validate_email(email):
@@ -44,6 +71,7 @@ class AuthService:
                 farm_name=farm_name
             )
             user.save()
+            user_cache.remember_email(email, user_record.uid)
             
             # Generar token personalizado
             custom_token = auth.create_custom_token(user_record.uid)
@@ -62,16 +90,57 @@ class AuthService:
     
     @staticmethod
     def login_user(email, password):
-        """Login de usuario"""
+        """Login de usuario
+
+        Si el uid del email ya está en caché, el perfil se lee mientras
+        Firebase Auth confirma la cuenta; el custom token se firma en local
+        mientras tanto. Los tiempos de cada paso van a /metrics y al log.
+        """
+        auth = get_auth()
+        timings = {}
+
+        def timed(name, fn, *args):
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                timings[name] = round(elapsed * 1000, 2)
+                LOGIN_STEP_LATENCY.observe(elapsed, step=name)
+
+        def profile(uid):
+            return _lookup_pool().submit(timed, 'profile', User.get_by_uid, uid)
+
+        start = time.perf_counter()
         try:
+            hinted_uid = user_cache.uid_for_email(email)
+            user_data = profile(hinted_uid) if hinted_uid else None
+
             # Verificar credenciales con Firebase Auth
-            user = auth.get_user_by_email(email)
-            
+            try:
+                user = timed('lookup', auth.get_user_by_email, email)
+            except auth.UserNotFoundError:
+                if hinted_uid:
+                    user_cache.forget_email(email)
+                raise
+
+            # La pista del caché era de otra cuenta (o no había): leer el perfil correcto
+            if hinted_uid != user.uid:
+                if user_data is not None:
+                    user_data.cancel()
+                user_cache.remember_email(email, user.uid)
+                user_data = profile(user.uid)
+
             # Generar token personalizado
-            custom_token = auth.create_custom_token(user.uid)
-            
+            custom_token = timed('token', auth.create_custom_token, user.uid)
+
             # Obtener información adicional del usuario
-            user_data = User.get_by_uid(user.uid)
+            user_data = user_data.result()
+
+            elapsed = time.perf_counter() - start
+            LOGIN_STEP_LATENCY.observe(elapsed, step='total')
+            log.info('login', uid=user.uid, profile_hint=hinted_uid == user.uid,
+                     total_ms=round(elapsed * 1000, 2), **{f"{name}_ms": ms for name, ms in timings.items()})
             
             return {
                 'uid': user.uid,
@@ -89,6 +158,7 @@ class AuthService:
     @staticmethod
     def reset_password(email):
         """Enviar email para resetear contraseña"""
+        auth = get_auth()
         try:
             if not AuthService.validate_email(email):
                 return {'error': 'Email inválido'}, 400
@@ -112,7 +182,7 @@ class AuthService:
     def verify_token(token):
         """Verificar token de Firebase"""
         try:
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = token_cache.verify(token)
             return decoded_token
         except:
             return None
\ No newline at end of file
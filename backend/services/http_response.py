@@ -0,0 +1,174 @@
+import gzip
+import hashlib
+import json
+from datetime import date, datetime, timezone
+from flask import Response, jsonify, request
+from flask.json.provider import JSONProvider
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - se usa json de la librería estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - solo se negocia gzip
+    brotli = None
+
+# Tipos que vale la pena comprimir (los PNG y ZIP ya vienen comprimidos)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'image/svg+xml', 'text/plain', 'text/html', 'text/csv'}
+
+
+def _iso(value):
+    # Las fechas sin zona se guardan en UTC (datetime.utcnow)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat().replace('+00:00', 'Z')
+
+
+def _default(value):
+    """Tipos que el serializador no conoce de forma nativa
+
+    Incluye DatetimeWithNanoseconds de Firestore (subclase de datetime),
+    GeoPoint y referencias a documentos.
+    """
+    if isinstance(value, datetime):
+        return _iso(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return {'latitude': value.latitude, 'longitude': value.longitude}
+    if hasattr(value, 'path') and hasattr(value, 'id'):
+        return value.path
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(value):
+    """Serializar a bytes JSON (orjson si está disponible)"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default,
+                            option=orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(JSONProvider):
+    """Proveedor JSON de Flask: jsonify y request.get_json pasan por aquí"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype='application/json')
+
+
+def weak_etag(*parts):
+    """ETag débil a partir de valores pequeños (ids, fechas de actualización)"""
+    digest = hashlib.blake2b(dumps(parts), digest_size=16).hexdigest()
+    return f'W/"{digest}"'
+
+
+def docs_etag(docs, *extra):
+    """ETag de una lista de documentos según sus fechas de actualización
+
+    Devuelve None si algún documento no trae updated_at (por ejemplo por
+    una proyección ?fields=); en ese caso la ETag se calcula del cuerpo.
+    """
+    versions = []
+    for doc in docs:
+        if 'updated_at' not in doc:
+            return None
+        versions.append((doc.get('id'), doc.get('updated_at'), doc.get('status'), doc.get('qr_status')))
+    return weak_etag(request.full_path, *extra, versions)
+
+
+def is_fresh(etag):
+    """¿El cliente ya tiene esta versión? (If-None-Match, comparación débil)"""
+    if not etag:
+        return False
+    tag = etag[2:] if etag.startswith('W/') else etag
+    return request.if_none_match.contains_weak(tag.strip('"'))
+
+
+def not_modified(etag, headers=None):
+    """Respuesta 304 sin cuerpo (conserva Cache-Control y Vary)"""
+    response = Response(status=304, headers={'ETag': etag})
+    for name in ('Cache-Control', 'Vary'):
+        if headers is not None and name in headers:
+            response.headers[name] = headers[name]
+    return response
+
+
+def json_response(result, status_code=200, etag=None):
+    """jsonify con una ETag calculada antes de serializar
+
+    Si el cliente ya tiene esa versión se responde 304 sin serializar
+    ni comprimir el cuerpo.
+    """
+    if status_code == 200 and is_fresh(etag):
+        return not_modified(etag)
+    response = jsonify(result)
+    response.status_code = status_code
+    if etag and status_code == 200:
+        response.headers['ETag'] = etag
+    return response
+
+
+def choose_encoding(accepted):
+    """Codificación preferida según un Accept-Encoding ya parseado"""
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    """Comprimir el cuerpo con 'br' o 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=Config.BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=Config.GZIP_LEVEL)
+
+
+def finalize_response(response):
+    """after_request: ETag débil, 304 condicional y compresión negociada"""
+    if response.direct_passthrough or response.is_streamed:
+        return response
+
+    is_json = response.mimetype == 'application/json'
+    if (is_json and response.status_code == 200 and request.method in ('GET', 'HEAD')
+            and 'ETag' not in response.headers):
+        response.add_etag(weak=True)
+        if is_fresh(response.headers['ETag']):
+            return not_modified(response.headers['ETag'], response.headers)
+
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < Config.COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,297 @@
+import zipfile
+import zlib
+from datetime import datetime
+from functools import partial
+from io import BytesIO
+from firebase_config import db
+from models.lot import Lot
+from services.qr_worker import qr_matrix, matrix_to_image, qr_renderer
+from config import Config
+
+# Campos del lote que se imprimen en la etiqueta (o que necesita su QR)
+LABEL_FIELDS = ['traceability_code', 'crop_type', 'quantity', 'unit', 'harvest_date',
+                'farmer_uid', 'created_at', 'status']
+
+SHEET_FORMATS = {'png': 'application/zip', 'pdf': 'application/pdf'}
+
+# A4 en pulgadas y en puntos PDF
+PAGE_INCHES = (8.27, 11.69)
+PAGE_POINTS = (595, 842)
+
+
+def _font(size):
+    from PIL import ImageFont
+
+    # La fuente por defecto de Pillow no trae tildes ni eñes
+    for name in (Config.LABELS_FONT, 'DejaVuSans.ttf'):
+        try:
+            return ImageFont.truetype(name, size)
+        except (OSError, TypeError, AttributeError):
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow sin FreeType: fuente bitmap de tamaño fijo
+        return ImageFont.load_default()
+
+
+def render_label_page(labels, fmt='png', columns=3, rows=8, dpi=150):
+    """Componer una hoja con varias etiquetas (QR, código y cultivo)
+
+    Función de módulo para poder ejecutarse en un proceso hijo. Devuelve
+    los bytes del PNG, o (ancho, alto, bits comprimidos) para el PDF.
+    """
+    from PIL import Image, ImageDraw
+
+    width, height = round(PAGE_INCHES[0] * dpi), round(PAGE_INCHES[1] * dpi)
+    margin = round(dpi * 0.3)
+    cell_w = (width - 2 * margin) // columns
+    cell_h = (height - 2 * margin) // rows
+    pad = max(2, cell_h // 16)
+    code_font = _font(max(8, cell_h // 12))
+    title_font = _font(max(10, cell_h // 8))
+    text_font = _font(max(8, cell_h // 10))
+
+    page = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(page)
+
+    for position, label in enumerate(labels):
+        x = margin + (position % columns) * cell_w
+        y = margin + (position // columns) * cell_h
+
+        # El QR ocupa la parte izquierda; el código va debajo a todo lo ancho
+        code_h = code_font.getbbox('Ag')[3] + pad
+        qr_side = min(cell_h - code_h - 2 * pad, cell_w // 2)
+        _, matrix = qr_matrix(label['payload'], border=2)
+        box_size = max(1, qr_side // len(matrix))
+        qr_img = matrix_to_image(matrix, box_size)
+        page.paste(qr_img, (x + pad, y + pad))
+
+        text_x = x + 2 * pad + qr_img.width
+        draw.text((text_x, y + 2 * pad), label['title'], fill=0, font=title_font)
+        line_y = y + 2 * pad + cell_h // 5
+        for line in label['lines']:
+            draw.text((text_x, line_y), line, fill=0, font=text_font)
+            line_y += cell_h // 6
+        draw.text((x + pad, y + pad + qr_img.height + pad // 2), label['code'], fill=0, font=code_font)
+
+    # 1 bit por píxel: las etiquetas son blanco y negro
+    page = page.point(lambda value: 255 if value > 127 else 0).convert('1', dither=Image.NONE)
+    if fmt == 'pdf':
+        return page.width, page.height, zlib.compress(page.tobytes(), 6)
+
+    buffered = BytesIO()
+    page.save(buffered, format='PNG', optimize=True)
+    return buffered.getvalue()
+
+
+class PdfPageWriter:
+    """PDF escrito página a página para transmitirlo sin tenerlo entero en memoria
+
+    El catálogo (objeto 1) y el árbol de páginas (objeto 2) se escriben al
+    final, cuando ya se conocen todas las páginas.
+    """
+
+    def __init__(self, page_size=PAGE_POINTS):
+        self.page_size = page_size
+        self.offsets = {}
+        self.position = 0
+        self.next_id = 3
+        self.page_ids = []
+
+    def _emit(self, data):
+        self.position += len(data)
+        return data
+
+    def _object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.position
+        data = f"{obj_id} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return self._emit(data + b"\nendobj\n")
+
+    def header(self):
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def page(self, width, height, bits):
+        """Objetos de una página con una imagen de 1 bit a página completa"""
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        self.page_ids.append(page_id)
+        page_w, page_h = self.page_size
+
+        content = f"q {page_w} 0 0 {page_h} 0 0 cm /Im0 Do Q".encode()
+        return b''.join([
+            self._object(image_id, (
+                f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode "
+                f"/Length {len(bits)} >>"
+            ).encode(), bits),
+            self._object(content_id, f"<< /Length {len(content)} >>".encode(), content),
+            self._object(page_id, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w} {page_h}] "
+                f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode())
+        ])
+
+    def trailer(self):
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self.page_ids)
+        data = self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode())
+        data += self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self.position
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets.get(obj_id, 0):010d} 00000 n \n" for obj_id in range(1, self.next_id)]
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        return data + self._emit(''.join(lines).encode())
+
+
+class _ZipSink:
+    """Destino no buscable para zipfile: acumula lo escrito hasta vaciarlo"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class LabelService:
+    @staticmethod
+    def _label(lot_id, lot_data):
+        """Textos y payload de la etiqueta de un lote"""
+        harvest_date = lot_data.get('harvest_date')
+        lines = [f"{lot_data.get('quantity')} {lot_data.get('unit') or ''}".strip()]
+        if harvest_date:
+            lines.append(f"Cosecha: {str(harvest_date)[:10]}")
+        return {
+            'payload': Lot.qr_payload_for(lot_id, lot_data),
+            'code': lot_data.get('traceability_code') or lot_id,
+            'title': str(lot_data.get('crop_type') or ''),
+            'lines': lines
+        }
+
+    @staticmethod
+    def _lots_by_ids(farmer_uid, lot_ids):
+        """Lotes del agricultor por id, en el orden pedido, leídos en bloques"""
+        for start in range(0, len(lot_ids), 100):
+            chunk = lot_ids[start:start + 100]
+            refs = [db.collection('lots').document(lot_id) for lot_id in chunk]
+            found = {}
+            for snapshot in db.get_all(refs, field_paths=LABEL_FIELDS):
+                if snapshot.exists:
+                    found[snapshot.id] = snapshot.to_dict()
+            for lot_id in chunk:
+                lot_data = found.get(lot_id)
+                if lot_data and lot_data.get('farmer_uid') == farmer_uid and lot_data.get('status') != 'deleted':
+                    yield lot_id, lot_data
+
+    @staticmethod
+    def _lots_by_filter(farmer_uid, filters):
+        """Lotes del agricultor que cumplen el filtro (estado y cultivo)"""
+        from firebase_admin import firestore
+
+        query = (db.collection('lots')
+                 .where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
+                 .where(filter=firestore.FieldFilter('status', '==', filters.get('status') or 'active')))
+        if filters.get('crop_type'):
+            query = query.where(filter=firestore.FieldFilter('crop_type', '==', filters['crop_type']))
+        for doc in query.select(LABEL_FIELDS).stream():
+            yield doc.id, doc.to_dict()
+
+    @staticmethod
+    def prepare_job(farmer_uid, data):
+        """Validar la petición y preparar la generación de hojas
+
+        Acepta {'lot_ids': [...]} o {'filter': {'status', 'crop_type'}},
+        además de 'format' ('png' o 'pdf'), 'columns' y 'rows'.
+        """
+        fmt = data.get('format', 'pdf')
+        if fmt not in SHEET_FORMATS:
+            return {'error': 'format debe ser "png" o "pdf"'}, 400
+
+        try:
+            columns = int(data.get('columns') or Config.LABELS_COLUMNS)
+            rows = int(data.get('rows') or Config.LABELS_ROWS)
+        except (TypeError, ValueError):
+            return {'error': 'columns y rows deben ser enteros'}, 400
+        if not (1 <= columns <= 6 and 1 <= rows <= 14):
+            return {'error': 'columns debe estar entre 1 y 6 y rows entre 1 y 14'}, 400
+
+        lot_ids = data.get('lot_ids')
+        filters = data.get('filter')
+        if lot_ids is not None:
+            if not isinstance(lot_ids, list) or not all(isinstance(i, str) and i for i in lot_ids):
+                return {'error': 'lot_ids debe ser una lista de ids'}, 400
+            if len(lot_ids) > Config.LABELS_MAX_LOTS:
+                return {'error': f'Máximo {Config.LABELS_MAX_LOTS} lotes por solicitud'}, 400
+            lots = LabelService._lots_by_ids(farmer_uid, list(dict.fromkeys(lot_ids)))
+        elif isinstance(filters, dict):
+            lots = LabelService._lots_by_filter(farmer_uid, filters)
+        else:
+            return {'error': 'Se requiere lot_ids o filter'}, 400
+
+        # Leer el primer lote ahora para responder 404 antes de empezar a transmitir
+        first = next(lots, None)
+        if first is None:
+            return {'error': 'No hay lotes para imprimir'}, 404
+
+        def all_lots():
+            yield first
+            yield from lots
+
+        return {
+            'format': fmt,
+            'columns': columns,
+            'rows': rows,
+            'lots': all_lots(),
+            'mimetype': SHEET_FORMATS[fmt],
+            'filename': f"etiquetas-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{'zip' if fmt == 'png' else 'pdf'}"
+        }, 200
+
+    @staticmethod
+    def _pages(job):
+        """Etiquetas agrupadas por página (como mucho LABELS_MAX_LOTS)"""
+        per_page = job['columns'] * job['rows']
+        page = []
+        for count, (lot_id, lot_data) in enumerate(job['lots']):
+            if count >= Config.LABELS_MAX_LOTS:
+                break
+            page.append(LabelService._label(lot_id, lot_data))
+            if len(page) == per_page:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    @staticmethod
+    def stream_sheets(job):
+        """Renderizar las páginas en el pool de procesos y transmitirlas en orden"""
+        render = partial(render_label_page, fmt=job['format'], columns=job['columns'],
+                         rows=job['rows'], dpi=Config.LABELS_DPI)
+        pages = qr_renderer.imap(render, LabelService._pages(job))
+
+        if job['format'] == 'pdf':
+            writer = PdfPageWriter()
+            yield writer.header()
+            for width, height, bits in pages:
+                yield writer.page(width, height, bits)
+            yield writer.trailer()
+            return
+
+        # PNG: un ZIP sin compresión (los PNG ya van comprimidos) escrito al vuelo
+        sink = _ZipSink()
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+            for number, png_bytes in enumerate(pages, start=1):
+                archive.writestr(f"etiquetas-{number:04d}.png", png_bytes)
+                yield sink.drain()
+        yield sink.drain()
@@ -0,0 +1,257 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from config import Config
+
+
+class MemoryBackend:
+    """Backend en memoria del proceso con expulsión LRU y TTL"""
+
+    name = 'memory'
+
+    def __init__(self, max_items=2048):
+        self.max_items = max_items
+        self._entries = OrderedDict()  # clave -> (expira, bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteBackend:
+    """Backend compartido entre workers del mismo host (archivo SQLite)
+
+    Las invalidaciones de un worker son visibles para todos los demás,
+    cosa que el backend en memoria no puede garantizar.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_items=2048):
+        self.path = path
+        self.max_items = max_items
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)')
+        conn.commit()
+
+    def _conn(self):
+        # Una conexión por hilo; sqlite3 no comparte conexiones entre hilos
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        row = self._conn().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self.delete(key)
+            return None
+        self._conn().execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+            (key, sqlite3.Binary(value), now + ttl, now)
+        )
+        # La poda LRU se hace cada cierto número de escrituras
+        self._writes += 1
+        if self._writes % 100 == 0:
+            conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_items,)
+            )
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def size(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class LotCache:
+    """Caché read-through delante de Lot.get_by_id y las listas por agricultor
+
+    Las páginas de un agricultor se guardan bajo una "generación": invalidar
+    al agricultor le asigna una generación nueva y las páginas viejas dejan
+    de ser alcanzables hasta que expiran.
+    """
+
+    def __init__(self, backend=None, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_or_load(self, key, loader):
+        """Devolver el valor cacheado o cargarlo con loader() y guardarlo"""
+        if not self.enabled:
+            return loader()
+
+        raw = self.backend.get(key)
+        if raw is not None:
+            self._count(True)
+            # Cada lectura devuelve una copia nueva: nadie muta la caché
+            return pickle.loads(raw)
+
+        self._count(False)
+        value = loader()
+        if value is not None:
+            self.backend.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), self.ttl)
+        return value
+
+    async def aget_or_load(self, key, loader):
+        """Como get_or_load, pero loader() es una corrutina (modo ASGI)"""
+        if not self.enabled:
+            return await loader()
+
+        raw = self.backend.get(key)
+        if raw is not None:
+            self._count(True)
+            return pickle.loads(raw)
+
+        self._count(False)
+        value = await loader()
+        if value is not None:
+            self.backend.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), self.ttl)
+        return value
+
+    def lot_key(self, lot_id):
+        return f"lot:{lot_id}"
+
+    def farmer_key(self, farmer_uid, *params):
+        generation = self._generation(farmer_uid)
+        suffix = ':'.join('' if p is None else str(p) for p in params)
+        return f"farmer:{farmer_uid}:{generation}:{suffix}"
+
+    def _generation(self, farmer_uid):
+        if not self.enabled:
+            return 0
+        raw = self.backend.get(f"gen:{farmer_uid}")
+        if raw is not None:
+            return raw.decode()
+        return self._new_generation(farmer_uid)
+
+    def _new_generation(self, farmer_uid):
+        # Token único y no un contador: si la clave expira o se expulsa,
+        # nunca se vuelve a una generación cuyas páginas sigan en caché
+        generation = uuid.uuid4().hex[:16]
+        self.backend.set(f"gen:{farmer_uid}", generation.encode(), self.ttl * 10)
+        return generation
+
+    def _forget(self, key):
+        if self.enabled:
+            self.backend.delete(key)
+            with self._lock:
+                self.invalidations += 1
+
+    def invalidate_lot(self, lot_id):
+        """Olvidar un lote concreto"""
+        self._forget(self.lot_key(lot_id))
+
+    def invalidate_farmer(self, farmer_uid):
+        """Olvidar todas las páginas de lotes de un agricultor"""
+        if self.enabled:
+            self._new_generation(farmer_uid)
+            with self._lock:
+                self.invalidations += 1
+
+    def invalidate(self, lot_ids=(), farmer_uids=()):
+        """Invalidar varios lotes y agricultores de una vez"""
+        for lot_id in set(lot_ids):
+            self.invalidate_lot(lot_id)
+        for farmer_uid in set(farmer_uids):
+            self.invalidate_farmer(farmer_uid)
+
+    def stats(self):
+        """Aciertos, fallos, hit ratio y tamaño de la caché"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'backend': self.backend.name if self.enabled else 'none',
+                'size': self.backend.size() if self.enabled else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+def create_backend(name, path=Config.LOT_CACHE_PATH, max_items=Config.LOT_CACHE_MAX_ITEMS):
+    """Crear el backend configurado en Config.LOT_CACHE_BACKEND"""
+    if name == 'memory':
+        return MemoryBackend(max_items=max_items)
+    if name == 'sqlite':
+        return SQLiteBackend(path, max_items=max_items)
+    if name in ('none', '', None):
+        return None
+    raise ValueError(f"Backend de caché desconocido: {name}")
+
+
+lot_cache = LotCache(
+    backend=create_backend(Config.LOT_CACHE_BACKEND),
+    ttl=Config.LOT_CACHE_TTL
+)
@@ -1,8 +1,18 @@
-from models.lot import Lot
-from firebase_admin import firestore
+from models.lot import Lot, InvalidCursorError
+from models.user import User
+from services.qr_worker import QRQueueFullError, qr_renderer
+from services.qr_store import qr_store
+from services.lot_writer import lot_writer, ConcurrentModificationError
+from services.lot_cache import lot_cache
+from services.report_service import ReportService
+from services.structured_log import get_logger
 from firebase_config import db
+from config import Config
 from datetime import datetime
-import uuid
+import csv
+import io
+
+log = get_logger('lot_service')
 
 class LotService:
     @staticmethod
@@ -27,169 +37,293 @@ class LotService:
         
         return errors
     
+    @staticmethod
+    def build_lot(farmer_uid, data):
+        """Construir un Lot (sin guardar) a partir de datos ya validados"""
+        # Crear lote con TODOS los campos
+        lot = Lot(
+            farmer_uid=farmer_uid,
+            crop_type=data['crop_type'],
+            quantity=float(data['quantity']),
+            unit=data.get('unit', 'kg'),
+            location=data.get('location'),
+            certifications=data.get('certifications', []),
+            price=data.get('price', 0),
+            currency=data.get('currency', 'COP'),
+            sustainability_metrics=data.get('sustainability_metrics', {})
+        )
+        
+        # Agregar fecha de cosecha si se proporciona
+        if 'harvest_date' in data and data['harvest_date']:
+            try:
+                lot.harvest_date = datetime.fromisoformat(data['harvest_date'].replace('Z', '+00:00'))
+            except:
+                lot.harvest_date = datetime.utcnow()
+        
+        return lot
+    
     @staticmethod
     def create_lot(farmer_uid, data):
         """Crear nuevo lote"""
         try:
-            print(f"📦 Creando lote para farmer: {farmer_uid}")
-            print(f"📦 Datos recibidos: {data}")
-            
             # Validar datos
             errors = LotService.validate_lot_data(data)
             if errors:
-                print(f"❌ Errores de validación: {errors}")
+                log.info('Lote rechazado por validación', farmer_uid=farmer_uid, errors=len(errors))
                 return {'errors': errors}, 400
             
-            # Crear lote con TODOS los campos
-            lot = Lot(
-                farmer_uid=farmer_uid,
-                crop_type=data['crop_type'],
-                quantity=float(data['quantity']),
-                unit=data.get('unit', 'kg'),
-                location=data.get('location'),
-                # ⬇️ AGREGAR ESTOS:
-                certifications=data.get('certifications', []),
-                price=data.get('price', 0),
-                currency=data.get('currency', 'COP'),
-                sustainability_metrics=data.get('sustainability_metrics', {})
-            )
-            
-            # Agregar fecha de cosecha si se proporciona
-            if 'harvest_date' in data and data['harvest_date']:
-                try:
-                    lot.harvest_date = datetime.fromisoformat(data['harvest_date'].replace('Z', '+00:00'))
-                except:
-                    lot.harvest_date = datetime.utcnow()
-            
-            # Guardar lote
-            lot.save()
-            print(f"✅ Lote guardado: {lot.id}")
+            lot = LotService.build_lot(farmer_uid, data)
             
-            # Agregar evento inicial
-            try:
-                lot.add_event(
-                    event_type='creation',
-                    description='Lote creado',
-                    metadata={'initial_quantity': lot.quantity}
-                )
-                print(f"✅ Evento inicial agregado")
-            except Exception as e:
-                print(f"⚠️ Error al agregar evento inicial: {str(e)}")
+            # Guardar lote junto con su evento inicial en una sola escritura
+            lot_writer.create(lot, Lot.new_event(
+                event_type='creation',
+                description='Lote creado',
+                metadata={'initial_quantity': lot.quantity},
+                lot_id=lot.id,
+                farmer_uid=farmer_uid
+            ), stats_delta=ReportService.delta(None, lot.to_dict(), created=1))
+            lot_cache.invalidate_farmer(farmer_uid)
+            log.info('Lote creado', farmer_uid=farmer_uid, lot_id=lot.id)
             
             return {
                 'message': 'Lote creado exitosamente',
                 'lot': lot.to_dict()
             }, 201
             
+        except QRQueueFullError as e:
+            log.warning('Cola de QR llena', farmer_uid=farmer_uid)
+            return {'error': str(e)}, 503
         except Exception as e:
-            print(f"❌ Error al crear lote: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception('Error al crear lote', farmer_uid=farmer_uid)
             return {'error': f'Error al crear lote: {str(e)}'}, 500
     
+    @staticmethod
+    def parse_csv(text):
+        """Convertir un CSV de lotes en una lista de diccionarios
+
+        Las certificaciones van separadas por ';' dentro de su columna.
+        """
+        rows = []
+        for row in csv.DictReader(io.StringIO(text)):
+            data = {k.strip(): (v.strip() if isinstance(v, str) else v)
+                    for k, v in row.items() if k and v not in (None, '')}
+            if 'certifications' in data:
+                data['certifications'] = [c.strip() for c in data['certifications'].split(';') if c.strip()]
+            if 'price' in data:
+                try:
+                    data['price'] = float(data['price'])
+                except ValueError:
+                    pass
+            rows.append(data)
+        return rows
+    
+    @staticmethod
+    def bulk_create_lots(farmer_uid, rows):
+        """Crear muchos lotes en una sola petición
+
+        Valida todas las filas, renderiza los QR en paralelo y escribe con
+        WriteBatch en bloques de hasta 500 operaciones (límite de Firestore).
+        Cada lote ocupa tres operaciones: el documento, su evento de creación
+        y su entrada en el índice de trazabilidad.
+        """
+        if not isinstance(rows, list) or not rows:
+            return {'error': 'Se esperaba una lista de lotes'}, 400
+        if len(rows) > Config.BULK_MAX_ROWS:
+            return {'error': f'Máximo {Config.BULK_MAX_ROWS} lotes por petición'}, 413
+        
+        results = [None] * len(rows)
+        pending = []  # (índice de fila, lote, evento de creación)
+        
+        for index, data in enumerate(rows):
+            if not isinstance(data, dict):
+                results[index] = {'row': index, 'status': 'error', 'errors': ['Fila inválida']}
+                continue
+            errors = LotService.validate_lot_data(data)
+            if errors:
+                results[index] = {'row': index, 'status': 'error', 'errors': errors}
+                continue
+            lot = LotService.build_lot(farmer_uid, data)
+            event = Lot.new_event('creation', 'Lote creado', {'initial_quantity': lot.quantity},
+                                  lot_id=lot.id, farmer_uid=farmer_uid)
+            pending.append((index, lot, event))
+        
+        # Renderizar todos los QR en paralelo en el pool de procesos
+        payloads = [lot.qr_payload() for _, lot, _ in pending]
+        try:
+            images = qr_renderer.render_many(payloads)
+        except Exception as e:
+            log.warning('Error en el pool de QR, renderizando en el hilo actual', error=str(e))
+            images = [qr_renderer.render(payload) for payload in payloads]
+        
+        for (_, lot, _), image in zip(pending, images):
+            lot.qr_ref = qr_store.put(image, qr_renderer.extension)
+            lot.qr_status = 'ready'
+        
+        created = 0
+        # Tres operaciones por lote (documento, evento e índice de trazabilidad)
+        # más el incremento de agregados del bloque
+        chunk_size = (Config.FIRESTORE_BATCH_LIMIT - 1) // 3
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            batch = db.batch()
+            for _, lot, event in chunk:
+                batch.set(db.collection('lots').document(lot.id), lot.to_document())
+                batch.set(Lot.event_ref(lot.id, event['id']), event)
+                batch.set(Lot.trace_code_ref(lot.traceability_code), lot.trace_index())
+            ReportService.apply_delta(batch, farmer_uid, ReportService.combine(
+                ReportService.delta(None, lot.to_dict(), created=1) for _, lot, _ in chunk
+            ))
+            try:
+                batch.commit()
+            except Exception as e:
+                log.error('Error al guardar bloque de lotes', farmer_uid=farmer_uid, lots=len(chunk), error=str(e))
+                for index, _, _ in chunk:
+                    results[index] = {'row': index, 'status': 'error', 'errors': [str(e)]}
+                continue
+            
+            for index, lot, _ in chunk:
+                results[index] = {
+                    'row': index,
+                    'status': 'created',
+                    'id': lot.id,
+                    'traceability_code': lot.traceability_code
+                }
+            created += len(chunk)
+        
+        if created:
+            lot_cache.invalidate_farmer(farmer_uid)
+        
+        failed = len(rows) - created
+        if failed == 0:
+            status_code = 201
+        elif created == 0:
+            status_code = 400
+        else:
+            status_code = 207
+        
+        log.info('Importación masiva', farmer_uid=farmer_uid, created=created, failed=failed)
+        return {
+            'created': created,
+            'failed': failed,
+            'results': results
+        }, status_code
+    
+    @staticmethod
+    def prepare_update(lot_data, data):
+        """Validar un cambio sobre lot_data y construir los campos a escribir
+
+        Devuelve (errores, update_data).
+        """
+        # Validar datos si se están actualizando campos críticos
+        if 'crop_type' in data or 'quantity' in data:
+            errors = LotService.validate_lot_data({
+                'crop_type': data.get('crop_type', lot_data['crop_type']),
+                'quantity': data.get('quantity', lot_data['quantity'])
+            })
+            if errors:
+                return errors, None
+        
+        # Actualizar lote
+        update_data = {}
+        allowed_fields = ['crop_type', 'quantity', 'unit', 'location', 'status', 'harvest_date']
+        
+        for field in allowed_fields:
+            if field in data:
+                if field == 'harvest_date':
+                    try:
+                        update_data[field] = datetime.fromisoformat(data[field].replace('Z', '+00:00'))
+                    except:
+                        update_data[field] = datetime.utcnow()
+                elif field == 'quantity':
+                    update_data[field] = float(data[field])
+                else:
+                    update_data[field] = data[field]
+        
+        update_data['updated_at'] = datetime.utcnow()
+        return [], update_data
+    
     @staticmethod
     def update_lot(lot_id, farmer_uid, data):
         """Actualizar lote"""
         try:
-            print(f"📝 Actualizando lote: {lot_id}")
-            
-            # Verificar que el lote existe y pertenece al agricultor
-            lot_data = Lot.get_by_id(lot_id)
-            if not lot_data:
-                return {'error': 'Lote no encontrado'}, 404
-            
-            if lot_data['farmer_uid'] != farmer_uid:
-                return {'error': 'No autorizado'}, 403
-            
-            # Validar datos si se están actualizando campos críticos
-            if 'crop_type' in data or 'quantity' in data:
-                errors = LotService.validate_lot_data({
-                    'crop_type': data.get('crop_type', lot_data['crop_type']),
-                    'quantity': data.get('quantity', lot_data['quantity'])
-                })
+            for attempt in range(Config.WRITE_CONFLICT_RETRIES):
+                # Verificar que el lote existe y pertenece al agricultor
+                snapshot = Lot.get_snapshot(lot_id)
+                if not snapshot:
+                    return {'error': 'Lote no encontrado'}, 404
+                lot_data = snapshot.to_dict()
+                
+                if lot_data['farmer_uid'] != farmer_uid:
+                    return {'error': 'No autorizado'}, 403
+                
+                errors, update_data = LotService.prepare_update(lot_data, data)
                 if errors:
                     return {'errors': errors}, 400
+                
+                # Cambio y evento de actualización en una sola escritura
+                event = Lot.new_event(
+                    event_type='update',
+                    description='Lote actualizado',
+                    metadata={'updated_fields': list(update_data.keys())},
+                    lot_id=lot_id,
+                    farmer_uid=farmer_uid
+                )
+                try:
+                    lot_writer.update_if_unchanged(
+                        snapshot, Lot.versioned(update_data), event,
+                        stats_delta=ReportService.delta(lot_data, dict(lot_data, **update_data))
+                    )
+                    break
+                except ConcurrentModificationError:
+                    log.warning('Conflicto al actualizar lote', lot_id=lot_id, attempt=attempt + 1)
+            else:
+                return {'error': 'El lote fue modificado por otra operación, intenta de nuevo'}, 409
             
-            # Actualizar lote
-            update_data = {}
-            allowed_fields = ['crop_type', 'quantity', 'unit', 'location', 'status', 'harvest_date']
-            
-            for field in allowed_fields:
-                if field in data:
-                    if field == 'harvest_date':
-                        try:
-                            update_data[field] = datetime.fromisoformat(data[field].replace('Z', '+00:00'))
-                        except:
-                            update_data[field] = datetime.utcnow()
-                    elif field == 'quantity':
-                        update_data[field] = float(data[field])
-                    else:
-                        update_data[field] = data[field]
-            
-            update_data['updated_at'] = datetime.utcnow()
-            
-            db.collection('lots').document(lot_id).update(update_data)
-            
-            # Agregar evento de actualización
-            try:
-                db.collection('lots').document(lot_id).update({
-                    'events': firestore.ArrayUnion([{
-                        'id': str(uuid.uuid4()),
-                        'type': 'update',
-                        'description': 'Lote actualizado',
-                        'metadata': {'updated_fields': list(update_data.keys())},
-                        'timestamp': datetime.utcnow()
-                    }])
-                })
-            except Exception as e:
-                print(f"⚠️ Error al agregar evento de actualización: {str(e)}")
-            
-            print(f"✅ Lote actualizado: {lot_id}")
+            lot_cache.invalidate(lot_ids=[lot_id], farmer_uids=[farmer_uid])
+            log.info('Lote actualizado', lot_id=lot_id)
             return {
                 'message': 'Lote actualizado exitosamente',
                 'lot_id': lot_id
             }, 200
             
         except Exception as e:
-            print(f"❌ Error al actualizar lote: {str(e)}")
+            log.exception('Error al actualizar lote', lot_id=lot_id)
             return {'error': f'Error al actualizar lote: {str(e)}'}, 500
     
     @staticmethod
     def delete_lot(lot_id, farmer_uid):
         """Eliminar lote (soft delete)"""
         try:
-            # Verificar que el lote existe y pertenece al agricultor
-            lot_data = Lot.get_by_id(lot_id)
-            if not lot_data:
-                return {'error': 'Lote no encontrado'}, 404
-            
-            if lot_data['farmer_uid'] != farmer_uid:
-                return {'error': 'No autorizado'}, 403
-            
-            # Soft delete
-            db.collection('lots').document(lot_id).update({
-                'status': 'deleted',
-                'updated_at': datetime.utcnow()
-            })
-            
-            # Agregar evento de eliminación
-            try:
-                db.collection('lots').document(lot_id).update({
-                    'events': firestore.ArrayUnion([{
-                        'id': str(uuid.uuid4()),
-                        'type': 'deletion',
-                        'description': 'Lote eliminado',
-                        'timestamp': datetime.utcnow()
-                    }])
-                })
-            except Exception as e:
-                print(f"⚠️ Error al agregar evento de eliminación: {str(e)}")
+            for attempt in range(Config.WRITE_CONFLICT_RETRIES):
+                # Verificar que el lote existe y pertenece al agricultor
+                snapshot = Lot.get_snapshot(lot_id)
+                if not snapshot:
+                    return {'error': 'Lote no encontrado'}, 404
+                lot_data = snapshot.to_dict()
+                
+                if lot_data['farmer_uid'] != farmer_uid:
+                    return {'error': 'No autorizado'}, 403
+                
+                # Soft delete y evento de eliminación en una sola escritura
+                event = Lot.new_event(event_type='deletion', description='Lote eliminado',
+                                      lot_id=lot_id, farmer_uid=farmer_uid)
+                try:
+                    lot_writer.update_if_unchanged(snapshot, Lot.versioned({
+                        'status': 'deleted',
+                        'updated_at': datetime.utcnow()
+                    }), event, operation='delete', stats_delta=ReportService.delta(lot_data, None))
+                    break
+                except ConcurrentModificationError:
+                    log.warning('Conflicto al eliminar lote', lot_id=lot_id, attempt=attempt + 1)
+            else:
+                return {'error': 'El lote fue modificado por otra operación, intenta de nuevo'}, 409
             
-            print(f"✅ Lote eliminado: {lot_id}")
+            lot_cache.invalidate(lot_ids=[lot_id], farmer_uids=[farmer_uid])
+            log.info('Lote eliminado', lot_id=lot_id)
             return {'message': 'Lote eliminado exitosamente'}, 200
             
         except Exception as e:
-            print(f"❌ Error al eliminar lote: {str(e)}")
+            log.exception('Error al eliminar lote', lot_id=lot_id)
             return {'error': f'Error al eliminar lote: {str(e)}'}, 500
     
     @staticmethod
@@ -207,21 +341,96 @@ class LotService:
             return {'lot': lot_data}, 200
             
         except Exception as e:
-            print(f"❌ Error al obtener lote: {str(e)}")
+            log.exception('Error al obtener lote', lot_id=lot_id)
             return {'error': f'Error al obtener lote: {str(e)}'}, 500
     
     @staticmethod
-    def get_farmer_lots(farmer_uid, include_deleted=False):
-        """Obtener todos los lotes de un agricultor"""
+    def parse_limit(limit):
+        """Tamaño de página pedido, acotado a LOTS_MAX_PAGE_SIZE
+
+        Devuelve (limit, None) o (None, respuesta de error).
+        """
+        try:
+            limit = min(int(limit or Config.LOTS_PAGE_SIZE), Config.LOTS_MAX_PAGE_SIZE)
+            if limit <= 0:
+                return None, ({'error': 'El parámetro limit debe ser mayor a 0'}, 400)
+        except (TypeError, ValueError):
+            return None, ({'error': 'El parámetro limit debe ser un número entero'}, 400)
+        return limit, None
+    
+    @staticmethod
+    def get_lot_events(lot_id, farmer_uid, limit=None, cursor=None):
+        """Obtener una página del historial de trazabilidad de un lote"""
+        limit, error = LotService.parse_limit(limit)
+        if error:
+            return error
+        
+        try:
+            lot_data = Lot.get_by_id(lot_id)
+            if not lot_data:
+                return {'error': 'Lote no encontrado'}, 404
+            
+            if lot_data['farmer_uid'] != farmer_uid:
+                return {'error': 'No autorizado'}, 403
+            
+            events, next_cursor = Lot.get_events(lot_id, limit=limit, cursor=cursor)
+            return {
+                'events': events,
+                'total': len(events),
+                'next_cursor': next_cursor
+            }, 200
+            
+        except InvalidCursorError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            log.exception('Error al obtener eventos', lot_id=lot_id)
+            return {'error': f'Error al obtener eventos: {str(e)}'}, 500
+    
+    @staticmethod
+    def get_farmer_lots(farmer_uid, include_deleted=False, limit=None, cursor=None, fields=None):
+        """Obtener una página de lotes de un agricultor"""
+        limit, error = LotService.parse_limit(limit)
+        if error:
+            return error
+        
+        if fields:
+            invalid = [f for f in fields if f not in Lot.LISTABLE_FIELDS]
+            if invalid:
+                return {'error': f"Campos no permitidos: {', '.join(invalid)}"}, 400
+        
         try:
-            print(f"🔍 Buscando lotes para farmer: {farmer_uid}")
-            lots = Lot.get_by_farmer(farmer_uid, include_deleted)
-            print(f"✅ Encontrados {len(lots)} lotes")
+            lots, next_cursor = Lot.get_page_by_farmer(
+                farmer_uid, include_deleted, limit=limit, cursor=cursor, fields=fields
+            )
+            log.debug('Lotes encontrados', farmer_uid=farmer_uid, count=len(lots))
             return {
                 'lots': lots,
-                'total': len(lots)
+                'total': len(lots),
+                'next_cursor': next_cursor
             }, 200
             
+        except InvalidCursorError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            log.exception('Error al obtener lotes', farmer_uid=farmer_uid)
+            return {'error': f'Error al obtener lotes: {str(e)}'}, 500
+
+    @staticmethod
+    def get_overview(farmer_uid, limit=None):
+        """Perfil, primera página de lotes y reporte en un solo viaje del cliente"""
+        limit, error = LotService.parse_limit(limit)
+        if error:
+            return error
+
+        try:
+            lots, next_cursor = Lot.get_page_by_farmer(farmer_uid, limit=limit)
+            stats = ReportService.stats_ref(farmer_uid).get()
+            return {
+                'user': User.get_by_uid(farmer_uid),
+                'lots': lots,
+                'next_cursor': next_cursor,
+                'report': ReportService.build_report(stats.to_dict() if stats.exists else {})
+            }, 200
         except Exception as e:
-            print(f"❌ Error al obtener lotes: {str(e)}")
-            return {'error': f'Error al obtener lotes: {str(e)}'}, 500
\ No newline at end of file
+            log.exception('Error al obtener resumen', farmer_uid=farmer_uid)
+            return {'error': f'Error al obtener resumen: {str(e)}'}, 500
@@ -0,0 +1,297 @@
+import asyncio
+from datetime import datetime
+from firebase_config import get_async_db
+from models.lot import Lot, InvalidCursorError
+from models.lot_async import AsyncLot
+from models.user_async import AsyncUser
+from services.lot_service import LotService
+from services.lot_writer import ConcurrentModificationError
+from services.lot_cache import lot_cache
+from services.qr_worker import QRQueueFullError, qr_renderer
+from services.qr_store import qr_store
+from services.report_service import ReportService
+from storage.aio import RebasedBatch
+from config import Config
+from services.structured_log import get_logger
+
+log = get_logger('lot_service_async')
+
+
+class AsyncLotService:
+    """Variantes async de LotService para el modo ASGI
+
+    Mismas validaciones, respuestas y códigos de estado que LotService;
+    las lecturas independientes se hacen a la vez con asyncio.gather.
+    """
+
+    @staticmethod
+    async def create_lot(farmer_uid, data):
+        """Crear nuevo lote"""
+        try:
+            errors = LotService.validate_lot_data(data)
+            if errors:
+                log.info('Lote rechazado por validación', farmer_uid=farmer_uid, errors=len(errors))
+                return {'errors': errors}, 400
+
+            lot = LotService.build_lot(farmer_uid, data)
+            event = Lot.new_event('creation', 'Lote creado', {'initial_quantity': lot.quantity},
+                                  lot_id=lot.id, farmer_uid=farmer_uid)
+            await AsyncLot.create(lot, event, stats_delta=ReportService.delta(None, lot.to_dict(), created=1))
+            lot_cache.invalidate_farmer(farmer_uid)
+            log.info('Lote creado', farmer_uid=farmer_uid, lot_id=lot.id)
+
+            return {
+                'message': 'Lote creado exitosamente',
+                'lot': lot.to_dict()
+            }, 201
+
+        except QRQueueFullError as e:
+            log.warning('Cola de QR llena', farmer_uid=farmer_uid)
+            return {'error': str(e)}, 503
+        except Exception as e:
+            log.exception('Error al crear lote', farmer_uid=farmer_uid)
+            return {'error': f'Error al crear lote: {str(e)}'}, 500
+
+    @staticmethod
+    async def bulk_create_lots(farmer_uid, rows):
+        """Crear muchos lotes; los bloques de WriteBatch se confirman a la vez"""
+        if not isinstance(rows, list) or not rows:
+            return {'error': 'Se esperaba una lista de lotes'}, 400
+        if len(rows) > Config.BULK_MAX_ROWS:
+            return {'error': f'Máximo {Config.BULK_MAX_ROWS} lotes por petición'}, 413
+
+        results = [None] * len(rows)
+        pending = []
+        for index, data in enumerate(rows):
+            if not isinstance(data, dict):
+                results[index] = {'row': index, 'status': 'error', 'errors': ['Fila inválida']}
+                continue
+            errors = LotService.validate_lot_data(data)
+            if errors:
+                results[index] = {'row': index, 'status': 'error', 'errors': errors}
+                continue
+            lot = LotService.build_lot(farmer_uid, data)
+            event = Lot.new_event('creation', 'Lote creado', {'initial_quantity': lot.quantity},
+                                  lot_id=lot.id, farmer_uid=farmer_uid)
+            pending.append((index, lot, event))
+
+        payloads = [lot.qr_payload() for _, lot, _ in pending]
+        try:
+            images = await qr_renderer.render_many_async(payloads)
+        except Exception as e:
+            log.warning('Error en el pool de QR, renderizando en el executor', error=str(e))
+            images = await asyncio.to_thread(lambda: [qr_renderer.render(payload) for payload in payloads])
+        try:
+            refs = await asyncio.to_thread(
+                lambda: [qr_store.put(image, qr_renderer.extension) for image in images]
+            )
+        except Exception as e:
+            log.exception('Error al guardar QR de la importación', farmer_uid=farmer_uid)
+            return {'error': f'Error al guardar los códigos QR: {str(e)}'}, 500
+        for (_, lot, _), qr_ref in zip(pending, refs):
+            lot.qr_ref = qr_ref
+            lot.qr_status = 'ready'
+
+        # Tres operaciones por lote más el incremento de agregados del bloque
+        chunk_size = (Config.FIRESTORE_BATCH_LIMIT - 1) // 3
+        chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+
+        async def commit(chunk):
+            batch = RebasedBatch(get_async_db())
+            for _, lot, event in chunk:
+                AsyncLot.add_create(batch, lot, event)
+            ReportService.apply_delta(batch, farmer_uid, ReportService.combine(
+                ReportService.delta(None, lot.to_dict(), created=1) for _, lot, _ in chunk
+            ))
+            await batch.commit()
+
+        outcomes = await asyncio.gather(*(commit(chunk) for chunk in chunks), return_exceptions=True)
+
+        created = 0
+        for chunk, outcome in zip(chunks, outcomes):
+            if isinstance(outcome, Exception):
+                log.error('Error al guardar bloque de lotes', farmer_uid=farmer_uid, lots=len(chunk),
+                          error=str(outcome))
+                for index, _, _ in chunk:
+                    results[index] = {'row': index, 'status': 'error', 'errors': [str(outcome)]}
+                continue
+            for index, lot, _ in chunk:
+                results[index] = {
+                    'row': index,
+                    'status': 'created',
+                    'id': lot.id,
+                    'traceability_code': lot.traceability_code
+                }
+            created += len(chunk)
+
+        if created:
+            lot_cache.invalidate_farmer(farmer_uid)
+
+        failed = len(rows) - created
+        if failed == 0:
+            status_code = 201
+        elif created == 0:
+            status_code = 400
+        else:
+            status_code = 207
+
+        log.info('Importación masiva', farmer_uid=farmer_uid, created=created, failed=failed)
+        return {'created': created, 'failed': failed, 'results': results}, status_code
+
+    @staticmethod
+    async def _mutate(lot_id, farmer_uid, build, operation):
+        """Leer, validar y escribir con precondición, reintentando si hay conflicto
+
+        build(lot_data) devuelve (respuesta de error o None, update_data, evento, delta).
+        """
+        for attempt in range(Config.WRITE_CONFLICT_RETRIES):
+            snapshot = await AsyncLot.get_snapshot(lot_id)
+            if not snapshot:
+                return {'error': 'Lote no encontrado'}, 404
+            lot_data = snapshot.to_dict()
+            if lot_data['farmer_uid'] != farmer_uid:
+                return {'error': 'No autorizado'}, 403
+
+            error, update_data, event, delta = build(lot_data)
+            if error:
+                return error
+            try:
+                await AsyncLot.update_if_unchanged(snapshot, update_data, event, stats_delta=delta)
+                break
+            except ConcurrentModificationError:
+                log.warning(f'Conflicto al {operation} lote', lot_id=lot_id, attempt=attempt + 1)
+        else:
+            return {'error': 'El lote fue modificado por otra operación, intenta de nuevo'}, 409
+
+        lot_cache.invalidate(lot_ids=[lot_id], farmer_uids=[farmer_uid])
+        return None
+
+    @staticmethod
+    async def update_lot(lot_id, farmer_uid, data):
+        """Actualizar lote"""
+        def build(lot_data):
+            errors, update_data = LotService.prepare_update(lot_data, data)
+            if errors:
+                return ({'errors': errors}, 400), None, None, None
+            event = Lot.new_event('update', 'Lote actualizado', {'updated_fields': list(update_data.keys())},
+                                  lot_id=lot_id, farmer_uid=farmer_uid)
+            delta = ReportService.delta(lot_data, dict(lot_data, **update_data))
+            return None, Lot.versioned(update_data), event, delta
+
+        try:
+            error = await AsyncLotService._mutate(lot_id, farmer_uid, build, 'actualizar')
+            if error:
+                return error
+            log.info('Lote actualizado', lot_id=lot_id)
+            return {'message': 'Lote actualizado exitosamente', 'lot_id': lot_id}, 200
+        except Exception as e:
+            log.exception('Error al actualizar lote', lot_id=lot_id)
+            return {'error': f'Error al actualizar lote: {str(e)}'}, 500
+
+    @staticmethod
+    async def delete_lot(lot_id, farmer_uid):
+        """Eliminar lote (soft delete)"""
+        def build(lot_data):
+            event = Lot.new_event('deletion', 'Lote eliminado', lot_id=lot_id, farmer_uid=farmer_uid)
+            update_data = Lot.versioned({'status': 'deleted', 'updated_at': datetime.utcnow()})
+            return None, update_data, event, ReportService.delta(lot_data, None)
+
+        try:
+            error = await AsyncLotService._mutate(lot_id, farmer_uid, build, 'eliminar')
+            if error:
+                return error
+            log.info('Lote eliminado', lot_id=lot_id)
+            return {'message': 'Lote eliminado exitosamente'}, 200
+        except Exception as e:
+            log.exception('Error al eliminar lote', lot_id=lot_id)
+            return {'error': f'Error al eliminar lote: {str(e)}'}, 500
+
+    @staticmethod
+    async def get_lot(lot_id, farmer_uid=None):
+        """Obtener un lote específico"""
+        try:
+            lot_data = await AsyncLot.get_by_id(lot_id)
+            if not lot_data:
+                return {'error': 'Lote no encontrado'}, 404
+            if farmer_uid and lot_data['farmer_uid'] != farmer_uid:
+                return {'error': 'No autorizado'}, 403
+            return {'lot': lot_data}, 200
+        except Exception as e:
+            log.exception('Error al obtener lote', lot_id=lot_id)
+            return {'error': f'Error al obtener lote: {str(e)}'}, 500
+
+    @staticmethod
+    async def get_lot_events(lot_id, farmer_uid, limit=None, cursor=None):
+        """Historial del lote; el permiso y la página se leen a la vez
+
+        Los eventos solo se devuelven si el lote es del agricultor, así que
+        leerlos en paralelo no expone nada.
+        """
+        limit, error = LotService.parse_limit(limit)
+        if error:
+            return error
+
+        try:
+            lot_data, (events, next_cursor) = await asyncio.gather(
+                AsyncLot.get_by_id(lot_id),
+                AsyncLot.get_events(lot_id, limit=limit, cursor=cursor)
+            )
+            if not lot_data:
+                return {'error': 'Lote no encontrado'}, 404
+            if lot_data['farmer_uid'] != farmer_uid:
+                return {'error': 'No autorizado'}, 403
+            return {'events': events, 'total': len(events), 'next_cursor': next_cursor}, 200
+        except InvalidCursorError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            log.exception('Error al obtener eventos', lot_id=lot_id)
+            return {'error': f'Error al obtener eventos: {str(e)}'}, 500
+
+    @staticmethod
+    async def get_farmer_lots(farmer_uid, include_deleted=False, limit=None, cursor=None, fields=None):
+        """Obtener una página de lotes de un agricultor"""
+        limit, error = LotService.parse_limit(limit)
+        if error:
+            return error
+        if fields:
+            invalid = [f for f in fields if f not in Lot.LISTABLE_FIELDS]
+            if invalid:
+                return {'error': f"Campos no permitidos: {', '.join(invalid)}"}, 400
+
+        try:
+            lots, next_cursor = await AsyncLot.get_page_by_farmer(
+                farmer_uid, include_deleted, limit=limit, cursor=cursor, fields=fields
+            )
+            return {'lots': lots, 'total': len(lots), 'next_cursor': next_cursor}, 200
+        except InvalidCursorError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            log.exception('Error al obtener lotes', farmer_uid=farmer_uid)
+            return {'error': f'Error al obtener lotes: {str(e)}'}, 500
+
+    @staticmethod
+    async def get_overview(farmer_uid, limit=None):
+        """Como LotService.get_overview; las tres lecturas se hacen a la vez"""
+        limit, error = LotService.parse_limit(limit)
+        if error:
+            return error
+
+        async def report():
+            doc = await get_async_db().collection('farmer_stats').document(farmer_uid).get()
+            return ReportService.build_report(doc.to_dict() if doc.exists else {})
+
+        try:
+            user, (lots, next_cursor), stats = await asyncio.gather(
+                AsyncUser.get_by_uid(farmer_uid),
+                AsyncLot.get_page_by_farmer(farmer_uid, limit=limit),
+                report()
+            )
+            return {
+                'user': user,
+                'lots': lots,
+                'next_cursor': next_cursor,
+                'report': stats
+            }, 200
+        except Exception as e:
+            log.exception('Error al obtener resumen', farmer_uid=farmer_uid)
+            return {'error': f'Error al obtener resumen: {str(e)}'}, 500
@@ -0,0 +1,195 @@
+import queue
+import threading
+import time
+from firebase_config import db
+from config import Config
+from services.structured_log import get_logger
+
+log = get_logger('lot_stream')
+
+
+class Subscription:
+    """Cola de eventos de un cliente SSE conectado"""
+
+    def __init__(self, farmer_uid, max_queue):
+        self.farmer_uid = farmer_uid
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def push(self, event):
+        """Encolar sin bloquear el hilo del listener
+
+        Si el cliente es lento y su cola se llena, se descarta lo pendiente
+        y se le pide que vuelva a cargar la lista completa.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait({'type': 'resync'})
+
+    def get(self, timeout):
+        """Siguiente evento o None si se cumple el timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class FarmerFeed:
+    """Un único listener on_snapshot compartido por todos los clientes de un agricultor"""
+
+    def __init__(self, farmer_uid):
+        self.farmer_uid = farmer_uid
+        self.subscribers = set()
+        self.idle_since = None
+        self._state = {}  # id del lote -> último dict conocido
+        self._lock = threading.Lock()
+        self._watch = None
+
+    def start(self):
+        from firebase_admin import firestore
+
+        query = (db.collection('lots')
+                 .where(filter=firestore.FieldFilter('farmer_uid', '==', self.farmer_uid))
+                 .where(filter=firestore.FieldFilter('status', '==', 'active')))
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def current_ids(self):
+        with self._lock:
+            return list(self._state.keys())
+
+    def _on_snapshot(self, docs, changes, read_time):
+        """Convertir los cambios de Firestore en diffs mínimos y repartirlos"""
+        added, modified, removed = [], [], []
+        with self._lock:
+            for change in changes:
+                lot_id = change.document.id
+                kind = change.type.name
+                if kind == 'REMOVED':
+                    self._state.pop(lot_id, None)
+                    removed.append(lot_id)
+                    continue
+
+                data = change.document.to_dict()
+                data.pop('qr_code', None)
+                previous = self._state.get(lot_id)
+                self._state[lot_id] = data
+
+                if kind == 'ADDED' or previous is None:
+                    added.append(dict(data, id=lot_id))
+                else:
+                    changed = {k: v for k, v in data.items() if previous.get(k) != v}
+                    changed.update({k: None for k in previous if k not in data})
+                    if changed:
+                        modified.append({'id': lot_id, 'changes': changed})
+
+            subscribers = list(self.subscribers)
+
+        if not (added or modified or removed):
+            return
+        event = {'type': 'changes', 'added': added, 'modified': modified, 'removed': removed}
+        for subscription in subscribers:
+            subscription.push(event)
+
+
+class LotStreamHub:
+    """Listeners por agricultor con conteo de referencias y expulsión por inactividad"""
+
+    def __init__(self, idle_seconds=60, max_queue=100):
+        self.idle_seconds = idle_seconds
+        self.max_queue = max_queue
+        self._feeds = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def subscribe(self, farmer_uid):
+        """Registrar un cliente; el listener se crea solo para el primero"""
+        self._ensure_reaper()
+        subscription = Subscription(farmer_uid, self.max_queue)
+        with self._lock:
+            feed = self._feeds.get(farmer_uid)
+            if feed is None:
+                feed = FarmerFeed(farmer_uid)
+                feed.start()
+                self._feeds[farmer_uid] = feed
+            feed.subscribers.add(subscription)
+            feed.idle_since = None
+
+        # Los lotes ya conocidos se anuncian para que el cliente sepa que está al día
+        subscription.push({'type': 'ready', 'ids': feed.current_ids()})
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Quitar un cliente; el listener queda inactivo hasta que lo expulse el reaper"""
+        with self._lock:
+            feed = self._feeds.get(subscription.farmer_uid)
+            if feed is None:
+                return
+            feed.subscribers.discard(subscription)
+            if not feed.subscribers:
+                feed.idle_since = time.time()
+
+    def evict_idle(self):
+        """Cerrar los listeners sin clientes durante más de idle_seconds"""
+        now = time.time()
+        with self._lock:
+            idle = [uid for uid, feed in self._feeds.items()
+                    if feed.idle_since is not None and now - feed.idle_since >= self.idle_seconds]
+            feeds = [self._feeds.pop(uid) for uid in idle]
+        for feed in feeds:
+            try:
+                feed.stop()
+            except Exception as e:
+                log.warning('Error al cerrar listener', farmer_uid=feed.farmer_uid, error=str(e))
+        return len(feeds)
+
+    def close(self):
+        """Cerrar todos los listeners al apagar el worker
+
+        Cada cliente recibe 'reconnect' y su stream termina, así el apagado
+        no espera a las conexiones SSE y el EventSource se reconecta a otro
+        worker.
+        """
+        with self._lock:
+            feeds = list(self._feeds.values())
+            self._feeds.clear()
+        for feed in feeds:
+            for subscription in list(feed.subscribers):
+                subscription.push({'type': 'reconnect'})
+            try:
+                feed.stop()
+            except Exception as e:
+                log.warning('Error al cerrar listener', farmer_uid=feed.farmer_uid, error=str(e))
+        return len(feeds)
+
+    def _ensure_reaper(self):
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name='lot-stream-reaper', daemon=True)
+                self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1, self.idle_seconds / 2))
+            self.evict_idle()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'listeners': len(self._feeds),
+                'clients': sum(len(feed.subscribers) for feed in self._feeds.values())
+            }
+
+
+lot_stream_hub = LotStreamHub(
+    idle_seconds=Config.LOT_STREAM_IDLE_SECONDS,
+    max_queue=Config.LOT_STREAM_MAX_QUEUE
+)
@@ -0,0 +1,247 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Buckets de latencia en segundos (de 1 ms a 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Contador monótono con etiquetas"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histograma de latencias con buckets acumulados (formato Prometheus)"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # etiquetas -> [conteo por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.label_names, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Métricas del proceso y colectores de estadísticas existentes"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, label_names=()):
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, prefix, stats_fn):
+        """Exponer como gauges los valores numéricos de un stats() existente"""
+        self._collectors.append((prefix, stats_fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._collectors:
+            try:
+                stats = stats_fn()
+            except Exception:
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'Latencia de las peticiones HTTP por ruta',
+    ('method', 'route', 'status'))
+FIRESTORE_LATENCY = registry.histogram(
+    'firestore_operation_duration_seconds', 'Latencia de las llamadas a Firestore por operación',
+    ('operation', 'collection'))
+FIRESTORE_ERRORS = registry.counter(
+    'firestore_errors_total', 'Llamadas a Firestore que lanzaron una excepción',
+    ('operation', 'collection'))
+QR_RENDER_LATENCY = registry.histogram(
+    'qr_render_duration_seconds', 'Tiempo de renderizado de un QR (async incluye la espera en cola)',
+    ('format', 'path'))
+LOGIN_STEP_LATENCY = registry.histogram(
+    'auth_login_step_duration_seconds', 'Tiempo de cada paso del login (lookup, token, profile, total)',
+    ('step',))
+
+
+# ===================== INSTRUMENTACIÓN DE FIRESTORE =====================
+
+_state = threading.local()
+
+
+def _depth():
+    return getattr(_state, 'depth', 0)
+
+
+def _observe_firestore(operation, collection, start, failed):
+    labels = {'operation': operation, 'collection': collection}
+    FIRESTORE_LATENCY.observe(time.perf_counter() - start, **labels)
+    if failed:
+        FIRESTORE_ERRORS.inc(**labels)
+
+
+def _timed_call(original, operation, collection_of):
+    """Medir una llamada; las llamadas internas del SDK no se cuentan dos veces"""
+    @wraps(original)
+    def wrapper(self, *args, **kwargs):
+        if _depth():
+            return original(self, *args, **kwargs)
+        _state.depth = 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            return original(self, *args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            _state.depth = 0
+            _observe_firestore(operation, collection_of(self), start, failed)
+    return wrapper
+
+
+def _timed_stream(original, operation, collection_of):
+    """Medir un stream desde la primera lectura hasta que se agota o se cierra"""
+    @wraps(original)
+    def wrapper(self, *args, **kwargs):
+        iterator = original(self, *args, **kwargs)
+        collection = collection_of(self)
+
+        def generate():
+            if _depth():
+                yield from iterator
+                return
+            start = time.perf_counter()
+            failed = False
+            try:
+                while True:
+                    # Solo se marca como anidado lo que ocurre dentro del SDK,
+                    # no el código que consume el stream entre elementos
+                    _state.depth = 1
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        _state.depth = 0
+                    yield item
+            except Exception:
+                failed = True
+                raise
+            finally:
+                _observe_firestore(operation, collection, start, failed)
+
+        return generate()
+    return wrapper
+
+
+def _document_collection(ref):
+    path = getattr(ref, '_path', ())
+    return path[-2] if len(path) >= 2 else '-'
+
+
+def _query_collection(query):
+    parent = getattr(query, '_parent', None)
+    return getattr(parent, 'id', None) or '-'
+
+
+def instrument_firestore():
+    """Envolver las llamadas de red del SDK de Firestore (una sola vez)"""
+    from google.cloud.firestore_v1 import batch, client, collection, document, query
+
+    if getattr(document.DocumentReference, '_instrumented', False):
+        return
+
+    for name in ('get', 'set', 'update', 'delete', 'create'):
+        setattr(document.DocumentReference, name,
+                _timed_call(getattr(document.DocumentReference, name), f'document.{name}', _document_collection))
+    for name in ('get', 'add'):
+        setattr(collection.CollectionReference, name,
+                _timed_call(getattr(collection.CollectionReference, name), f'collection.{name}', lambda c: c.id))
+    collection.CollectionReference.stream = _timed_stream(
+        collection.CollectionReference.stream, 'collection.stream', lambda c: c.id)
+    query.Query.get = _timed_call(query.Query.get, 'query.get', _query_collection)
+    query.Query.stream = _timed_stream(query.Query.stream, 'query.stream', _query_collection)
+    batch.WriteBatch.commit = _timed_call(batch.WriteBatch.commit, 'batch.commit', lambda b: '-')
+    client.Client.get_all = _timed_stream(client.Client.get_all, 'get_all', lambda c: '-')
+    document.DocumentReference._instrumented = True
@@ -1,8 +1,45 @@
+import base64
+import hashlib
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from firebase_config import db
+from models.lot import Lot, InvalidCursorError
+from services.qr_worker import qr_renderer
+from services.qr_store import qr_store
+from services.lot_cache import lot_cache
+from services.lot_writer import lot_writer, ConcurrentModificationError
+from services.report_service import ReportService
+from config import Config
+from services.structured_log import get_logger
+
+log = get_logger('offline_sync')
 
 class OfflineSyncService:
+    # Campos que un dispositivo puede modificar al sincronizar
+    UPDATABLE_FIELDS = ['crop_type', 'quantity', 'unit', 'location', 'status', 'harvest_date',
+                        'certifications', 'price', 'currency', 'sustainability_metrics']
+
+    @staticmethod
+    def _parse_timestamp(value):
+        """Convertir un timestamp ISO del cliente a datetime con zona UTC"""
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed
+
+    @staticmethod
+    def _as_utc(value):
+        """Normalizar datetimes de Firestore (con zona) y antiguos (sin zona)"""
+        if isinstance(value, datetime) and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+    @staticmethod
+    def _receipt_ref(farmer_uid, offline_id):
+        """Recibo de un item ya sincronizado (para reintentos idempotentes)"""
+        key = hashlib.sha256(f"{farmer_uid}:{offline_id}".encode('utf-8')).hexdigest()
+        return db.collection('sync_receipts').document(key)
+
     @staticmethod
     def sync_offline_data(farmer_uid, offline_data):
         """Sincronizar datos offline con Firebase"""
@@ -12,86 +49,652 @@ class OfflineSyncService:
                 'failed': [],
                 'conflicts': []
             }
-            
-            for item in offline_data:
-                try:
-                    if item['type'] == 'lot_creation':
-                        # Crear lote desde datos offline
-                        lot_data = item['data']
-                        lot = Lot(
-                            farmer_uid=farmer_uid,
-                            crop_type=lot_data['crop_type'],
-                            quantity=float(lot_data['quantity']),
-                            unit=lot_data.get('unit', 'kg'),
-                            location=lot_data.get('location')
-                        )
-                        lot.created_at = datetime.fromisoformat(item['timestamp'])
-                        lot.save()
-                        results['synced'].append({
-                            'type': 'lot_creation',
-                            'id': lot.id,
-                            'offline_id': item.get('offline_id')
-                        })
-                    
-                    elif item['type'] == 'lot_update':
-                        # Actualizar lote
-                        lot_id = item['lot_id']
-                        update_data = item['data']
-                        
-                        # Verificar si hay conflictos
-                        current_lot = Lot.get_by_id(lot_id)
-                        if current_lot:
-                            server_updated = current_lot['updated_at']
-                            client_updated = datetime.fromisoformat(item['timestamp'])
-                            
-                            if server_updated > client_updated:
-                                # Conflicto: el servidor tiene una versión más reciente
-                                results['conflicts'].append({
-                                    'type': 'lot_update',
-                                    'lot_id': lot_id,
-                                    'server_version': current_lot,
-                                    'client_version': update_data
-                                })
-                            else:
-                                # Actualizar con datos del cliente
-                                db.collection('lots').document(lot_id).update(update_data)
-                                results['synced'].append({
-                                    'type': 'lot_update',
-                                    'lot_id': lot_id
-                                })
-                        else:
-                            results['failed'].append({
-                                'type': 'lot_update',
-                                'lot_id': lot_id,
-                                'error': 'Lote no encontrado'
-                            })
-                    
-                    elif item['type'] == 'lot_deletion':
-                        # Eliminar lote
-                        lot_id = item['lot_id']
-                        db.collection('lots').document(lot_id).update({
-                            'status': 'deleted',
-                            'updated_at': datetime.fromisoformat(item['timestamp'])
-                        })
-                        results['synced'].append({
-                            'type': 'lot_deletion',
-                            'lot_id': lot_id
-                        })
-                
-                except Exception as e:
-                    results['failed'].append({
-                        'item': item,
-                        'error': str(e)
-                    })
-            
+
+            chunk_size = Config.SYNC_CHUNK_SIZE
+            for start in range(0, len(offline_data), chunk_size):
+                chunk = offline_data[start:start + chunk_size]
+                for bucket, entry in OfflineSyncService.process_chunk(farmer_uid, chunk):
+                    results[bucket].append(entry)
+
             return results, 200
-            
+
         except Exception as e:
             return {'error': str(e)}, 500
-    
+
+    @staticmethod
+    def parse_ndjson(lines):
+        """Generador de (número de línea, item, error) a partir de líneas NDJSON"""
+        for line_no, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"JSON inválido: {str(e)}"
+                continue
+            if not isinstance(item, dict):
+                yield line_no, None, 'Cada línea debe ser un objeto JSON'
+                continue
+            yield line_no, item, None
+
+    @staticmethod
+    def sync_stream(farmer_uid, parsed_items, chunk_size=None):
+        """Sincronizar un flujo de items devolviendo resultados a medida que se confirman
+
+        Consume `parsed_items` (ver parse_ndjson) en bloques acotados, así la
+        memoria no depende del tamaño del backlog. Cada bloque se confirma
+        antes de emitir sus resultados: si el cliente se desconecta, lo ya
+        emitido está guardado y un reintento se deduplica por offline_id.
+
+        Si un bloque falla, la última línea lleva 'error' y done=True y el
+        flujo termina: las líneas sin resultado no se confirmaron.
+        """
+        chunk_size = chunk_size or Config.SYNC_CHUNK_SIZE
+        totals = {'synced': 0, 'failed': 0, 'conflicts': 0}
+        chunk = []
+
+        def flush(chunk):
+            items = [item for _, item, error in chunk if error is None]
+            outcomes = iter(OfflineSyncService.process_chunk(farmer_uid, items)) if items else iter(())
+            for line_no, _, error in chunk:
+                if error is not None:
+                    bucket, entry = 'failed', {'error': error}
+                else:
+                    bucket, entry = next(outcomes)
+                totals[bucket] += 1
+                yield dict(entry, line=line_no, status=bucket)
+
+        try:
+            for parsed in parsed_items:
+                chunk.append(parsed)
+                if len(chunk) >= chunk_size:
+                    yield from flush(chunk)
+                    chunk = []
+            if chunk:
+                yield from flush(chunk)
+        except Exception as e:
+            # Sin esta línea el cliente vería el flujo cortado sin explicación
+            log.exception('Error en sync en streaming', farmer_uid=farmer_uid, totals=totals)
+            yield dict(totals, error=f'Error al sincronizar: {str(e)}', done=True)
+            return
+
+        yield dict(totals, done=True)
+
+    @staticmethod
+    def process_chunk(farmer_uid, items):
+        """Procesar un bloque de items offline como un pipeline por lotes
+
+        1. Descarta duplicados por offline_id (recibos de syncs anteriores).
+        2. Precarga con un solo db.get_all todos los lotes referenciados.
+        3. Detecta conflictos en memoria.
+        4. Renderiza los QR de los lotes nuevos en paralelo.
+        5. Escribe todo en WriteBatch de hasta 500 operaciones.
+
+        Las actualizaciones y bajas llevan como precondición el update_time
+        leído en el paso 2: si otra petición cambió el lote entretanto, los
+        items que faltan vuelven al paso 2 (hasta WRITE_CONFLICT_RETRIES).
+
+        Devuelve una lista de (bucket, resultado) en el orden de los items.
+        """
+        from google.api_core.exceptions import FailedPrecondition
+
+        outcomes = [None] * len(items)
+
+        # 1. Deduplicar por offline_id
+        receipt_refs, first_index = OfflineSyncService._dedupe(farmer_uid, items, outcomes)
+        if receipt_refs:
+            OfflineSyncService._apply_receipts(db.get_all(list(receipt_refs.values())), first_index, outcomes)
+
+        for attempt in range(Config.WRITE_CONFLICT_RETRIES):
+            # 2. Precargar los lotes referenciados (con su update_time)
+            lot_ids = OfflineSyncService._referenced_lots(items, outcomes)
+            current, versions = {}, {}
+            if lot_ids:
+                refs = [db.collection('lots').document(lot_id) for lot_id in lot_ids]
+                current, versions = OfflineSyncService._index_snapshots(db.get_all(refs))
+
+            # 3. Conflictos en memoria y preparación de escrituras
+            writes, new_lots = OfflineSyncService._prepare_writes(farmer_uid, items, outcomes, current, receipt_refs)
+
+            # 4. QR de los lotes creados offline, en paralelo
+            if new_lots:
+                payloads = [lot.qr_payload() for _, lot in new_lots]
+                try:
+                    images = qr_renderer.render_many(payloads)
+                except Exception as e:
+                    log.warning('Error en el pool de QR, renderizando en el hilo actual', error=str(e))
+                    images = [qr_renderer.render(payload) for payload in payloads]
+                OfflineSyncService._attach_qr(writes, new_lots, images)
+
+            # 5. Escribir en bloques sin partir las operaciones de un item
+            conflict = False
+            for batch_items in OfflineSyncService._plan_batches(writes):
+                batch = db.batch()
+                guarded = OfflineSyncService._fill_batch(batch, farmer_uid, batch_items, versions, db.write_option)
+                try:
+                    write_results = batch.commit()
+                except FailedPrecondition:
+                    log.warning('Lote modificado durante el sync, reintentando', farmer_uid=farmer_uid,
+                                attempt=attempt + 1)
+                    conflict = True
+                    break
+                except Exception as e:
+                    OfflineSyncService._record_failure(batch_items, outcomes, e)
+                    continue
+                OfflineSyncService._record_commit(batch_items, outcomes, guarded, versions, write_results)
+
+            OfflineSyncService._invalidate(farmer_uid, writes, outcomes)
+            if not conflict:
+                break
+
+        OfflineSyncService._fail_pending(items, outcomes)
+        return outcomes
+
+    @staticmethod
+    def _dedupe(farmer_uid, items, outcomes):
+        """Marcar los offline_id repetidos en el bloque y preparar sus recibos
+
+        Devuelve ({offline_id: ref del recibo}, {offline_id: índice del primer item}).
+        """
+        receipt_refs = {}
+        first_index = {}
+        for index, item in enumerate(items):
+            offline_id = item.get('offline_id') if isinstance(item, dict) else None
+            if not offline_id:
+                continue
+            if offline_id in receipt_refs:
+                outcomes[index] = ('synced', {'type': item.get('type'), 'offline_id': offline_id, 'duplicate': True})
+            else:
+                receipt_refs[offline_id] = OfflineSyncService._receipt_ref(farmer_uid, offline_id)
+                first_index[offline_id] = index
+        return receipt_refs, first_index
+
+    @staticmethod
+    def _apply_receipts(snapshots, first_index, outcomes):
+        """Los items con recibo de un sync anterior se devuelven como duplicados
+
+        Se repite el bucket original: una fusión parcial sigue siendo un
+        conflicto con sus conflicting_fields.
+        """
+        for snapshot in snapshots:
+            if snapshot.exists:
+                receipt = snapshot.to_dict()
+                index = first_index.get(receipt.get('offline_id'))
+                if index is not None:
+                    bucket = receipt.get('bucket', 'synced')
+                    outcomes[index] = (bucket, dict(receipt.get('result') or {}, duplicate=True))
+
     @staticmethod
-    def resolve_conflict(lot_id, resolution_strategy='server'):
-        """Resolver conflictos de sincronización"""
-        # resolution_strategy: 'server', 'client', 'merge'
-        # Implementar lógica de resolución según estrategia
-        pass
\ No newline at end of file
+    def _index_snapshots(snapshots):
+        """({lot_id: datos}, {lot_id: update_time}) de los lotes precargados"""
+        current = {}
+        versions = {}
+        for snapshot in snapshots:
+            if snapshot.exists:
+                current[snapshot.id] = snapshot.to_dict()
+                versions[snapshot.id] = snapshot.update_time
+        return current, versions
+
+    @staticmethod
+    def _referenced_lots(items, outcomes):
+        """Ids de los lotes que tocan los items todavía sin resultado"""
+        return {
+            item['lot_id'] for index, item in enumerate(items)
+            if outcomes[index] is None and isinstance(item, dict) and item.get('lot_id')
+        }
+
+    @staticmethod
+    def _prepare_writes(farmer_uid, items, outcomes, current, receipt_refs):
+        """Convertir los items pendientes en escrituras
+
+        Devuelve (writes, new_lots): writes es una lista de
+        (índice, [(operación, ref, datos)], bucket, resultado) y new_lots
+        los (índice de write, lote) que todavía necesitan su QR.
+        """
+        writes = []
+        new_lots = []
+        for index, item in enumerate(items):
+            if outcomes[index] is not None:
+                continue
+            try:
+                prepared = OfflineSyncService._prepare_item(farmer_uid, item, current)
+            except Exception as e:
+                outcomes[index] = ('failed', {'item': item, 'error': str(e)})
+                continue
+
+            bucket, entry, operations, lot = prepared
+            if not operations:
+                outcomes[index] = (bucket, entry)
+                continue
+
+            offline_id = item.get('offline_id')
+            if offline_id:
+                operations.append(('set', receipt_refs[offline_id], {
+                    'farmer_uid': farmer_uid,
+                    'offline_id': offline_id,
+                    'bucket': bucket,
+                    'result': entry,
+                    'created_at': datetime.utcnow()
+                }))
+            if lot is not None:
+                new_lots.append((len(writes), lot))
+            writes.append((index, operations, bucket, entry))
+        return writes, new_lots
+
+    @staticmethod
+    def _attach_qr(writes, new_lots, images):
+        """Guardar los QR renderizados y serializar los lotes nuevos"""
+        for (write_index, lot), image in zip(new_lots, images):
+            lot.qr_ref = qr_store.put(image, qr_renderer.extension)
+            lot.qr_status = 'ready'
+            # El documento se serializa ahora que tiene su QR
+            writes[write_index][1][0] = ('set', db.collection('lots').document(lot.id), lot.to_document())
+
+    @staticmethod
+    def _plan_batches(writes):
+        """Agrupar los writes en bloques de hasta FIRESTORE_BATCH_LIMIT operaciones
+
+        Nunca se parten las operaciones de un item; se reserva una operación
+        por bloque para el delta de agregados.
+        """
+        batch_items = []
+        ops = 0
+        for write in writes:
+            size = sum(1 for op in write[1] if op[0] != 'stats')
+            if ops + size > Config.FIRESTORE_BATCH_LIMIT - 1 and batch_items:
+                yield batch_items
+                batch_items = []
+                ops = 0
+            batch_items.append(write)
+            ops += size
+        if batch_items:
+            yield batch_items
+
+    @staticmethod
+    def _fill_batch(batch, farmer_uid, batch_items, versions, write_option):
+        """Agregar al batch las operaciones de sus items y un solo delta de agregados
+
+        La primera escritura de cada lote lleva la precondición sobre su
+        update_time; las siguientes del mismo bloque van en el mismo commit
+        atómico. Devuelve los ids de los lotes con precondición.
+        """
+        deltas = []
+        guarded = set()
+        for _, operations, _, _ in batch_items:
+            for operation, ref, data in operations:
+                if operation == 'stats':
+                    deltas.append(data)
+                elif operation == 'guarded_update':
+                    if ref.id in guarded:
+                        batch.update(ref, data)
+                    else:
+                        guarded.add(ref.id)
+                        batch.update(ref, data, option=write_option(last_update_time=versions[ref.id]))
+                else:
+                    getattr(batch, operation)(ref, data)
+        ReportService.apply_delta(batch, farmer_uid, ReportService.combine(deltas))
+        return guarded
+
+    @staticmethod
+    def _invalidate(farmer_uid, writes, outcomes):
+        """Invalidar la caché de los lotes que efectivamente se escribieron"""
+        touched = []
+        for index, _, _, _ in writes:
+            outcome = outcomes[index]
+            if outcome is not None and outcome[0] != 'failed':
+                touched.append(outcome[1].get('lot_id') or outcome[1].get('id'))
+        if touched:
+            lot_cache.invalidate(lot_ids=touched, farmer_uids=[farmer_uid])
+
+    @staticmethod
+    def _record_commit(batch_items, outcomes, guarded, versions, write_results):
+        """Registrar un bloque confirmado
+
+        Los items de bloques siguientes sobre los mismos lotes usan como
+        precondición el update_time de este commit.
+        """
+        for index, _, bucket, entry in batch_items:
+            outcomes[index] = (bucket, entry)
+        if write_results:
+            for lot_id in guarded:
+                versions[lot_id] = write_results[0].update_time
+
+    @staticmethod
+    def _record_failure(batch_items, outcomes, error):
+        log.error('Error al confirmar bloque de sync', items=len(batch_items), error=str(error))
+        for index, _, _, entry in batch_items:
+            outcomes[index] = ('failed', dict(entry, error=str(error)))
+
+    @staticmethod
+    def _fail_pending(items, outcomes):
+        """Items que agotaron los reintentos por conflictos de escritura"""
+        for index, outcome in enumerate(outcomes):
+            if outcome is None:
+                item = items[index]
+                outcomes[index] = ('failed', {
+                    'type': item.get('type'),
+                    'lot_id': item.get('lot_id'),
+                    'offline_id': item.get('offline_id'),
+                    'error': 'El lote fue modificado por otra operación, intenta de nuevo'
+                })
+
+    @staticmethod
+    def _prepare_item(farmer_uid, item, current):
+        """Convertir un item offline en operaciones de escritura
+
+        Devuelve (bucket, resultado, operaciones, lote nuevo o None).
+        """
+        item_type = item['type']
+
+        if item_type == 'lot_creation':
+            # Crear lote desde datos offline
+            lot_data = item['data']
+            lot = Lot(
+                farmer_uid=farmer_uid,
+                crop_type=lot_data['crop_type'],
+                quantity=float(lot_data['quantity']),
+                unit=lot_data.get('unit', 'kg'),
+                location=lot_data.get('location')
+            )
+            lot.created_at = OfflineSyncService._parse_timestamp(item['timestamp'])
+            event = Lot.new_event('creation', 'Lote creado (offline)', {'initial_quantity': lot.quantity},
+                                  lot_id=lot.id, farmer_uid=farmer_uid)
+            operations = [
+                # Los datos del lote se completan después de renderizar su QR
+                ('set', db.collection('lots').document(lot.id), None),
+                ('set', Lot.event_ref(lot.id, event['id']), event),
+                ('set', Lot.trace_code_ref(lot.traceability_code), lot.trace_index()),
+                ('stats', None, ReportService.delta(None, lot.to_dict(), created=1))
+            ]
+            entry = {
+                'type': 'lot_creation',
+                'id': lot.id,
+                'offline_id': item.get('offline_id')
+            }
+            return 'synced', entry, operations, lot
+
+        if item_type not in ('lot_update', 'lot_deletion'):
+            return 'failed', {'item': item, 'error': f"Tipo de item desconocido: {item_type}"}, [], None
+
+        lot_id = item['lot_id']
+        current_lot = current.get(lot_id)
+        if not current_lot:
+            return 'failed', {'type': item_type, 'lot_id': lot_id, 'error': 'Lote no encontrado'}, [], None
+        if current_lot.get('farmer_uid') != farmer_uid:
+            return 'failed', {'type': item_type, 'lot_id': lot_id, 'error': 'No autorizado'}, [], None
+
+        client_updated = OfflineSyncService._parse_timestamp(item['timestamp'])
+        lot_ref = db.collection('lots').document(lot_id)
+
+        if item_type == 'lot_update':
+            # Merge por campo: solo chocan los campos que el servidor cambió después
+            client_data = {k: v for k, v in item['data'].items() if k in OfflineSyncService.UPDATABLE_FIELDS}
+            apply, conflicts = OfflineSyncService.merge_fields(current_lot, client_data, client_updated)
+            entry = {'type': 'lot_update', 'lot_id': lot_id, 'offline_id': item.get('offline_id')}
+
+            operations = []
+            if apply:
+                now = datetime.utcnow()
+                update_data = dict(apply, updated_at=now)
+                event = Lot.new_event('update', 'Lote actualizado (offline)',
+                                      {'updated_fields': list(apply.keys())},
+                                      lot_id=lot_id, farmer_uid=farmer_uid)
+                operations = [
+                    ('guarded_update', lot_ref, Lot.versioned(update_data, now)),
+                    ('set', Lot.event_ref(lot_id, event['id']), event),
+                    ('stats', None, ReportService.delta(current_lot, dict(current_lot, **apply)))
+                ]
+                entry['applied_fields'] = list(apply.keys())
+                # Items siguientes del mismo bloque ven el lote ya actualizado
+                current[lot_id] = dict(current_lot, **apply)
+
+            if conflicts:
+                # Conflicto: solo se envían los campos que difieren
+                entry['conflicting_fields'] = conflicts
+                return 'conflicts', entry, operations, None
+            return 'synced', entry, operations, None
+
+        # Eliminar lote
+        now = datetime.utcnow()
+        event = Lot.new_event('deletion', 'Lote eliminado (offline)', {'client_timestamp': item['timestamp']},
+                              lot_id=lot_id, farmer_uid=farmer_uid)
+        operations = [
+            # updated_at es la hora del servidor para que el pull delta vea la baja
+            ('guarded_update', lot_ref, Lot.versioned({'status': 'deleted', 'updated_at': now})),
+            ('set', Lot.event_ref(lot_id, event['id']), event),
+            ('stats', None, ReportService.delta(current_lot, None))
+        ]
+        current[lot_id] = dict(current_lot, status='deleted')
+        entry = {'type': 'lot_deletion', 'lot_id': lot_id, 'offline_id': item.get('offline_id')}
+        return 'synced', entry, operations, None
+
+    @staticmethod
+    def field_version(lot_data, field):
+        """Última vez que el servidor modificó un campo del lote"""
+        versions = lot_data.get('field_versions')
+        if versions is None:
+            # Lotes anteriores a field_versions: se usa la versión del documento
+            return OfflineSyncService._as_utc(lot_data.get('updated_at'))
+        return OfflineSyncService._as_utc(versions.get(field) or lot_data.get('created_at'))
+
+    @staticmethod
+    def merge_fields(lot_data, client_data, client_updated):
+        """Separar los cambios del cliente en aplicables y en conflicto
+
+        Un campo choca si el servidor lo modificó después de client_updated
+        y su valor actual es distinto al del cliente. Devuelve
+        (campos a aplicar, {campo: {'server', 'client', 'server_updated_at'}}).
+        """
+        apply = {}
+        conflicts = {}
+        for field, client_value in client_data.items():
+            server_value = lot_data.get(field)
+            if server_value == client_value:
+                continue
+            server_updated = OfflineSyncService.field_version(lot_data, field)
+            if server_updated and server_updated > client_updated:
+                conflicts[field] = {
+                    'server': server_value,
+                    'client': client_value,
+                    'server_updated_at': server_updated
+                }
+            else:
+                apply[field] = client_value
+        return apply, conflicts
+
+    @staticmethod
+    def encode_changes_cursor(lots_position, events_position, rewind=False):
+        """Cursor opaco con la posición en lotes y en eventos
+
+        rewind marca el cursor de la última página: al reanudar se relee
+        desde SYNC_CHANGES_WINDOW_SECONDS antes de cada posición.
+        """
+        raw = json.dumps({
+            'l': [lots_position[0].isoformat(), lots_position[1]] if lots_position else None,
+            'e': [events_position[0].isoformat(), events_position[1]] if events_position else None,
+            'w': 1 if rewind else 0
+        })
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_changes_cursor(cursor):
+        """Obtener (posición en lotes, posición en eventos, rewind); cada posición es (timestamp, id)"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            positions = []
+            for key in ('l', 'e'):
+                value = raw.get(key)
+                positions.append((datetime.fromisoformat(value[0]), str(value[1])) if value else None)
+            positions.append(bool(raw.get('w')))
+            return positions
+        except Exception:
+            raise InvalidCursorError('Cursor inválido')
+
+    @staticmethod
+    def get_changes(farmer_uid, since=None, limit=None):
+        """Lotes y eventos que cambiaron desde `since`
+
+        Los lotes se recorren por (updated_at, id) y los eventos por
+        (timestamp, id) con un grupo de colecciones; el cursor guarda ambas
+        posiciones. Los lotes eliminados se devuelven como tombstones.
+
+        updated_at es la hora del commit (Lot.stamped), pero un commit puede
+        hacerse visible después de otro posterior. Por eso el cursor de la
+        última página relee los últimos SYNC_CHANGES_WINDOW_SECONDS: el
+        cliente puede recibir de nuevo un lote o evento y debe deduplicar
+        por id (quedarse con el updated_at más reciente).
+        """
+        try:
+            limit = min(int(limit or Config.LOTS_PAGE_SIZE), Config.LOTS_MAX_PAGE_SIZE)
+            if limit <= 0:
+                return {'error': 'El parámetro limit debe ser mayor a 0'}, 400
+        except (TypeError, ValueError):
+            return {'error': 'El parámetro limit debe ser un número entero'}, 400
+
+        from firebase_admin import firestore
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        try:
+            lots_position, events_position, rewind = (
+                OfflineSyncService.decode_changes_cursor(since) if since else (None, None, False)
+            )
+            window = timedelta(seconds=Config.SYNC_CHANGES_WINDOW_SECONDS)
+
+            lots_query = (db.collection('lots')
+                          .where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
+                          .order_by('updated_at')
+                          .order_by(FieldPath.document_id()))
+            if lots_position and rewind:
+                lots_query = lots_query.where(
+                    filter=firestore.FieldFilter('updated_at', '>=', lots_position[0] - window))
+            elif lots_position:
+                lots_query = lots_query.start_after({'updated_at': lots_position[0], '__name__': lots_position[1]})
+            lot_docs = list(lots_query.limit(limit + 1).stream())
+
+            events_query = (db.collection_group('events')
+                            .where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
+                            .order_by('timestamp')
+                            .order_by(FieldPath.document_id()))
+            if events_position and rewind:
+                events_query = events_query.where(
+                    filter=firestore.FieldFilter('timestamp', '>=', events_position[0] - window))
+            elif events_position:
+                events_query = events_query.start_after({
+                    'timestamp': events_position[0],
+                    '__name__': db.document(events_position[1])
+                })
+            event_docs = list(events_query.limit(limit + 1).stream())
+
+            has_more = len(lot_docs) > limit or len(event_docs) > limit
+            lot_docs = lot_docs[:limit]
+            event_docs = event_docs[:limit]
+
+            lots = []
+            tombstones = []
+            for doc in lot_docs:
+                lot_data = doc.to_dict()
+                lot_data['id'] = doc.id
+                if lot_data.get('status') == 'deleted':
+                    tombstones.append({'id': doc.id, 'deleted': True, 'updated_at': lot_data.get('updated_at')})
+                    continue
+                lot_data.pop('qr_code', None)
+                lot_data.pop('events', None)
+                lots.append(lot_data)
+
+            events = [doc.to_dict() for doc in event_docs]
+
+            if lot_docs:
+                lots_position = (lot_docs[-1].get('updated_at'), lot_docs[-1].id)
+            if event_docs:
+                # Los eventos viven en subcolecciones: se guarda la ruta completa
+                events_position = (event_docs[-1].get('timestamp'), event_docs[-1].reference.path)
+
+            return {
+                'lots': lots,
+                'deleted': tombstones,
+                'events': events,
+                'next_cursor': OfflineSyncService.encode_changes_cursor(lots_position, events_position,
+                                                                       rewind=not has_more),
+                'has_more': has_more
+            }, 200
+
+        except InvalidCursorError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            log.exception('Error al obtener cambios', farmer_uid=farmer_uid)
+            return {'error': f'Error al obtener cambios: {str(e)}'}, 500
+
+    @staticmethod
+    def resolve_conflict(lot_id, resolution_strategy='server', farmer_uid=None,
+                         client_data=None, client_timestamp=None):
+        """Resolver conflictos de sincronización
+
+        resolution_strategy:
+        - 'server': se conserva la versión del servidor (no se escribe nada).
+        - 'client': se aplican todos los campos enviados por el cliente.
+        - 'merge': se aplican solo los campos que el servidor no modificó
+          después de client_timestamp; el resto se devuelve como conflicto.
+        """
+        try:
+            if resolution_strategy not in ('server', 'client', 'merge'):
+                return {'error': f"Estrategia inválida: {resolution_strategy}"}, 400
+
+            client_data = {k: v for k, v in (client_data or {}).items()
+                           if k in OfflineSyncService.UPDATABLE_FIELDS}
+            client_updated = None
+            if resolution_strategy == 'merge' and client_data:
+                if not client_timestamp:
+                    return {'error': 'client_timestamp es obligatorio para merge'}, 400
+                client_updated = OfflineSyncService._parse_timestamp(client_timestamp)
+
+            # Merge y delta se calculan sobre el snapshot que se escribe: si
+            # el lote cambia entre la lectura y el commit, se vuelve a leer
+            for attempt in range(Config.WRITE_CONFLICT_RETRIES):
+                snapshot = Lot.get_snapshot(lot_id)
+                if not snapshot:
+                    return {'error': 'Lote no encontrado'}, 404
+                lot_data = snapshot.to_dict()
+                if farmer_uid and lot_data['farmer_uid'] != farmer_uid:
+                    return {'error': 'No autorizado'}, 403
+
+                if resolution_strategy == 'server' or not client_data:
+                    return {'lot_id': lot_id, 'strategy': resolution_strategy, 'applied_fields': []}, 200
+
+                if resolution_strategy == 'client':
+                    apply, conflicts = client_data, {}
+                else:
+                    apply, conflicts = OfflineSyncService.merge_fields(lot_data, client_data, client_updated)
+                if not apply:
+                    break
+
+                now = datetime.utcnow()
+                event = Lot.new_event('conflict_resolution', 'Conflicto de sincronización resuelto',
+                                      {'strategy': resolution_strategy, 'updated_fields': list(apply.keys())},
+                                      lot_id=lot_id, farmer_uid=lot_data['farmer_uid'])
+                try:
+                    lot_writer.update_if_unchanged(
+                        snapshot, Lot.versioned(dict(apply, updated_at=now), now), event,
+                        stats_delta=ReportService.delta(lot_data, dict(lot_data, **apply))
+                    )
+                    break
+                except ConcurrentModificationError:
+                    log.warning('Conflicto al resolver conflicto de sync', lot_id=lot_id, attempt=attempt + 1)
+            else:
+                return {'error': 'El lote fue modificado por otra operación, intenta de nuevo'}, 409
+
+            if apply:
+                lot_cache.invalidate(lot_ids=[lot_id], farmer_uids=[lot_data['farmer_uid']])
+
+            return {
+                'lot_id': lot_id,
+                'strategy': resolution_strategy,
+                'applied_fields': list(apply.keys()),
+                'conflicting_fields': conflicts
+            }, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
@@ -0,0 +1,100 @@
+import asyncio
+from firebase_config import get_async_db
+from services.offline_sync import OfflineSyncService
+from services.qr_worker import qr_renderer
+from storage.aio import RebasedBatch
+from config import Config
+from services.structured_log import get_logger
+
+log = get_logger('offline_sync_async')
+
+
+class AsyncOfflineSyncService:
+    """Variante async de OfflineSyncService para el modo ASGI
+
+    Las fases puras (deduplicar, detectar conflictos, armar escrituras y
+    agruparlas) son las de OfflineSyncService; aquí cambian la E/S y la
+    concurrencia: los recibos y los lotes se precargan a la vez y los QR
+    se renderizan fuera del loop.
+    """
+
+    @staticmethod
+    async def sync_offline_data(farmer_uid, offline_data):
+        """Sincronizar datos offline con Firebase"""
+        try:
+            results = {
+                'synced': [],
+                'failed': [],
+                'conflicts': []
+            }
+
+            chunk_size = Config.SYNC_CHUNK_SIZE
+            for start in range(0, len(offline_data), chunk_size):
+                chunk = offline_data[start:start + chunk_size]
+                for bucket, entry in await AsyncOfflineSyncService.process_chunk(farmer_uid, chunk):
+                    results[bucket].append(entry)
+
+            return results, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+    @staticmethod
+    async def _get_all(references):
+        if not references:
+            return []
+        client = get_async_db()
+        return [snapshot async for snapshot in client.get_all([client.document(ref.path) for ref in references])]
+
+    @staticmethod
+    async def process_chunk(farmer_uid, items):
+        """Procesar un bloque de items offline (ver OfflineSyncService.process_chunk)"""
+        from google.api_core.exceptions import FailedPrecondition
+
+        outcomes = [None] * len(items)
+        receipt_refs, first_index = OfflineSyncService._dedupe(farmer_uid, items, outcomes)
+        client = get_async_db()
+
+        for attempt in range(Config.WRITE_CONFLICT_RETRIES):
+            # Recibos y lotes en paralelo: se precargan los lotes de todos los
+            # items aunque alguno resulte ser un reintento ya sincronizado
+            lot_ids = OfflineSyncService._referenced_lots(items, outcomes)
+            lots_ref = client.collection('lots')
+            receipts, lots = await asyncio.gather(
+                AsyncOfflineSyncService._get_all(list(receipt_refs.values()) if attempt == 0 else []),
+                AsyncOfflineSyncService._get_all([lots_ref.document(lot_id) for lot_id in lot_ids])
+            )
+            OfflineSyncService._apply_receipts(receipts, first_index, outcomes)
+            current, versions = OfflineSyncService._index_snapshots(lots)
+
+            writes, new_lots = OfflineSyncService._prepare_writes(farmer_uid, items, outcomes, current, receipt_refs)
+
+            if new_lots:
+                images = await qr_renderer.render_many_async([lot.qr_payload() for _, lot in new_lots])
+                await asyncio.to_thread(OfflineSyncService._attach_qr, writes, new_lots, images)
+
+            # Los bloques se confirman en orden: dos items del mismo lote pueden
+            # caer en bloques distintos
+            conflict = False
+            for batch_items in OfflineSyncService._plan_batches(writes):
+                batch = RebasedBatch(client)
+                guarded = OfflineSyncService._fill_batch(batch, farmer_uid, batch_items, versions,
+                                                         client.write_option)
+                try:
+                    write_results = await batch.commit()
+                except FailedPrecondition:
+                    log.warning('Lote modificado durante el sync, reintentando', farmer_uid=farmer_uid,
+                                attempt=attempt + 1)
+                    conflict = True
+                    break
+                except Exception as e:
+                    OfflineSyncService._record_failure(batch_items, outcomes, e)
+                    continue
+                OfflineSyncService._record_commit(batch_items, outcomes, guarded, versions, write_results)
+
+            OfflineSyncService._invalidate(farmer_uid, writes, outcomes)
+            if not conflict:
+                break
+
+        OfflineSyncService._fail_pending(items, outcomes)
+        return outcomes
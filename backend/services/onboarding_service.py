@@ -0,0 +1,274 @@
+import csv
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from firebase_config import db, get_auth
+from models.user import User
+from services.auth_service import AuthService
+from services.user_cache import user_cache
+from config import Config
+from services.structured_log import get_logger
+
+log = get_logger('onboarding_service')
+
+# Máximo de usuarios por llamada a auth.import_users
+IMPORT_CHUNK_SIZE = 1000
+# auth.get_users acepta hasta 100 identificadores: uid y email de 50 filas
+LOOKUP_CHUNK_SIZE = 50
+RESULT_FIELDS = ('row', 'email', 'status', 'uid', 'error')
+JOB_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class OnboardingService:
+    """Alta masiva de agricultores (cooperativas) con auth.import_users
+
+    El resultado de cada fila se agrega a un CSV al terminar cada bloque.
+    Si el proceso se interrumpe, volver a ejecutarlo con el mismo archivo
+    salta las filas ya creadas. El uid se deriva del email: reimportar una
+    fila que quedó a medias sobrescribe la misma cuenta en vez de duplicarla.
+
+    import_users sobrescribe sin avisar, así que antes de cada bloque se
+    buscan las cuentas existentes y se saltan. Solo se reimportan las que
+    este mismo trabajo intentó crear (filas 'importing' del archivo). En
+    el archivo vale la última línea de cada email.
+    """
+
+    @staticmethod
+    def parse_csv(text):
+        """Convertir un CSV de agricultores en una lista de diccionarios"""
+        return [{k.strip(): v.strip() for k, v in row.items() if k and isinstance(v, str) and v.strip()}
+                for row in csv.DictReader(io.StringIO(text))]
+
+    @staticmethod
+    def valid_job(job):
+        return isinstance(job, str) and JOB_PATTERN.match(job) is not None
+
+    @staticmethod
+    def results_path(job):
+        """Archivo de resultados de un trabajo iniciado por HTTP"""
+        return os.path.join(Config.ONBOARDING_RESULTS_PATH, f"{job}.csv")
+
+    @staticmethod
+    def uid_for(email):
+        """uid estable para un email normalizado"""
+        return 'f' + hashlib.sha256(email.encode('utf-8')).hexdigest()[:27]
+
+    @staticmethod
+    def load_results(path):
+        """Estado previo de un trabajo: ({email: uid} creados, emails que intentó importar)"""
+        created = {}
+        attempted = set()
+        if not os.path.exists(path):
+            return created, attempted
+        with open(path, newline='', encoding='utf-8') as f:
+            for entry in csv.DictReader(f):
+                if entry.get('status') == 'created':
+                    created[entry['email']] = entry['uid']
+                elif entry.get('status') == 'importing':
+                    attempted.add(entry['email'])
+        return created, attempted
+
+    @staticmethod
+    def validate_rows(rows, created):
+        """Una sola pasada: normalizar, validar y descartar lo ya creado
+
+        Devuelve (pendientes, resultados); cada pendiente es (fila, email, datos).
+        """
+        pending = []
+        results = []
+        seen = set()
+        for index, data in enumerate(rows):
+            email = data.get('email') if isinstance(data, dict) else None
+            email = email.strip().lower() if isinstance(email, str) else ''
+
+            errors = []
+            if not isinstance(data, dict):
+                errors.append('Fila inválida')
+            elif not AuthService.validate_email(email):
+                errors.append('Email inválido')
+            elif email in seen:
+                errors.append('Email repetido en el archivo')
+            elif email in created:
+                seen.add(email)
+                results.append({'row': index, 'email': email, 'status': 'skipped', 'uid': created[email]})
+                continue
+            if isinstance(data, dict):
+                password = data.get('password')
+                if not isinstance(password, str):
+                    errors.append('La contraseña es obligatoria')
+                else:
+                    valid, msg = AuthService.validate_password(password)
+                    if not valid:
+                        errors.append(msg)
+
+            if errors:
+                results.append({'row': index, 'email': email, 'status': 'invalid', 'error': '; '.join(errors)})
+                continue
+            seen.add(email)
+            pending.append((index, email, data))
+        return pending, results
+
+    @staticmethod
+    def _hash_passwords(pending, rounds):
+        """PBKDF2-SHA256 con sal aleatoria; hashlib suelta el GIL, así se reparte entre hilos"""
+        def hash_one(item):
+            salt = os.urandom(16)
+            return hashlib.pbkdf2_hmac('sha256', item[2]['password'].encode('utf-8'), salt, rounds), salt
+
+        with ThreadPoolExecutor(max_workers=Config.ONBOARDING_HASH_THREADS) as pool:
+            return list(pool.map(hash_one, pending))
+
+    @staticmethod
+    def _existing_accounts(auth, chunk):
+        """Emails del bloque que ya tienen cuenta en Firebase Auth (por uid o por email)"""
+        found = set()
+        for start in range(0, len(chunk), LOOKUP_CHUNK_SIZE):
+            identifiers = []
+            for _, email, _ in chunk[start:start + LOOKUP_CHUNK_SIZE]:
+                identifiers.append(auth.UidIdentifier(OnboardingService.uid_for(email)))
+                identifiers.append(auth.EmailIdentifier(email))
+            for user in auth.get_users(identifiers).users:
+                found.add(user.uid)
+                if user.email:
+                    found.add(user.email.lower())
+        return {email for _, email, _ in chunk
+                if email in found or OnboardingService.uid_for(email) in found}
+
+    @staticmethod
+    def _import_chunk(auth, chunk, rounds):
+        """Crear las cuentas de un bloque; devuelve {índice en el bloque: error}"""
+        records = []
+        for (_, email, data), (password_hash, salt) in zip(chunk, OnboardingService._hash_passwords(chunk, rounds)):
+            records.append(auth.ImportUserRecord(
+                uid=OnboardingService.uid_for(email),
+                email=email,
+                display_name=data.get('name'),
+                password_hash=password_hash,
+                password_salt=salt
+            ))
+        try:
+            result = auth.import_users(records, hash_alg=auth.UserImportHash.pbkdf2_sha256(rounds=rounds))
+        except Exception as e:
+            log.error('Error al importar bloque de usuarios', users=len(records), error=str(e))
+            return {position: str(e) for position in range(len(chunk))}
+        return {error.index: error.reason for error in result.errors}
+
+    @staticmethod
+    def _save_profiles(imported):
+        """Perfiles en WriteBatch de hasta FIRESTORE_BATCH_LIMIT; devuelve {email: error}"""
+        failed = {}
+        for start in range(0, len(imported), Config.FIRESTORE_BATCH_LIMIT):
+            chunk = imported[start:start + Config.FIRESTORE_BATCH_LIMIT]
+            batch = db.batch()
+            for _, email, data in chunk:
+                user = User(
+                    uid=OnboardingService.uid_for(email),
+                    email=email,
+                    name=data.get('name'),
+                    phone=data.get('phone'),
+                    farm_name=data.get('farm_name')
+                )
+                batch.set(db.collection('users').document(user.uid), user.to_dict())
+            try:
+                batch.commit()
+            except Exception as e:
+                log.error('Error al guardar bloque de perfiles', users=len(chunk), error=str(e))
+                failed.update((email, f'Perfil: {e}') for _, email, _ in chunk)
+                continue
+            for _, email, _ in chunk:
+                user_cache.invalidate_user(OnboardingService.uid_for(email))
+        return failed
+
+    @staticmethod
+    def import_farmers(rows, results_path):
+        """Registrar muchos agricultores y dejar el resultado de cada fila en results_path
+
+        Devuelve ({created, skipped, failed, results}, status).
+        """
+        if not isinstance(rows, list) or not rows:
+            return {'error': 'Se esperaba una lista de agricultores'}, 400
+
+        auth = get_auth()
+        rounds = Config.ONBOARDING_HASH_ROUNDS
+        created, attempted = OnboardingService.load_results(results_path)
+        pending, results = OnboardingService.validate_rows(rows, created)
+
+        directory = os.path.dirname(results_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+        with open(results_path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+            if write_header:
+                writer.writeheader()
+
+            def record(entries):
+                writer.writerows(entries)
+                f.flush()
+                os.fsync(f.fileno())
+
+            record([entry for entry in results if entry['status'] != 'skipped'])
+
+            for start in range(0, len(pending), IMPORT_CHUNK_SIZE):
+                chunk = pending[start:start + IMPORT_CHUNK_SIZE]
+                entries = []
+                try:
+                    existing = OnboardingService._existing_accounts(auth, chunk)
+                except Exception as e:
+                    log.error('Error al buscar cuentas existentes', users=len(chunk), error=str(e))
+                    entries = [{'row': index, 'email': email, 'status': 'error', 'error': str(e)}
+                               for index, email, _ in chunk]
+                    record(entries)
+                    results.extend(entries)
+                    continue
+
+                # Una cuenta existente solo se sobrescribe si la dejó a medias este trabajo
+                for index, email, _ in chunk:
+                    if email in existing and email not in attempted:
+                        entries.append({'row': index, 'email': email, 'status': 'skipped',
+                                        'error': 'Ya existe una cuenta con este email'})
+                chunk = [item for item in chunk if item[1] not in existing or item[1] in attempted]
+                # Registrar el intento antes de crear las cuentas
+                record([{'row': index, 'email': email, 'status': 'importing',
+                         'uid': OnboardingService.uid_for(email)} for index, email, _ in chunk])
+                attempted.update(email for _, email, _ in chunk)
+
+                import_errors = OnboardingService._import_chunk(auth, chunk, rounds) if chunk else {}
+                imported = [item for position, item in enumerate(chunk) if position not in import_errors]
+                profile_errors = OnboardingService._save_profiles(imported)
+
+                for position, (index, email, _) in enumerate(chunk):
+                    entry = {'row': index, 'email': email, 'status': 'created',
+                             'uid': OnboardingService.uid_for(email)}
+                    error = import_errors.get(position) or profile_errors.get(email)
+                    if error:
+                        entry.update(status='error', error=error)
+                    entries.append(entry)
+                # Se registra solo después de guardar perfiles: si se corta
+                # antes, la siguiente ejecución repite el bloque
+                record(entries)
+                results.extend(entries)
+                log.info('Bloque de agricultores importado', rows=len(chunk),
+                         created=sum(1 for entry in entries if entry['status'] == 'created'))
+
+        results.sort(key=lambda entry: entry['row'])
+        created = sum(1 for entry in results if entry['status'] == 'created')
+        skipped = sum(1 for entry in results if entry['status'] == 'skipped')
+        failed = len(results) - created - skipped
+
+        if failed == 0:
+            status_code = 201
+        elif created == 0 and skipped == 0:
+            status_code = 400
+        else:
+            status_code = 207
+
+        log.info('Alta masiva de agricultores', created=created, skipped=skipped, failed=failed)
+        return {
+            'created': created,
+            'skipped': skipped,
+            'failed': failed,
+            'results': results
+        }, status_code
@@ -0,0 +1,53 @@
+import base64
+import hashlib
+import hmac
+from urllib.parse import urlsplit
+from config import Config
+
+# 'json' es el contenido histórico; 'compact' y 'signed' codifican una URL corta
+PAYLOAD_MODES = ('json', 'compact', 'signed')
+
+# Caracteres base32 de la firma (80 bits)
+SIGNATURE_LENGTH = 16
+
+
+def sign_code(code, secret=None):
+    """Firma HMAC-SHA256 de un código de trazabilidad, truncada y en base32"""
+    key = (secret or Config.SECRET_KEY).encode()
+    digest = hmac.new(key, code.encode(), hashlib.sha256).digest()
+    return base64.b32encode(digest).decode()[:SIGNATURE_LENGTH]
+
+
+def base_url(url=None):
+    """URL base con esquema y host en mayúsculas
+
+    Así todo el QR cabe en el modo alfanumérico (5.5 bits por carácter
+    en lugar de 8) y la versión resultante es menor.
+    """
+    parts = urlsplit(Config.QR_BASE_URL if url is None else url)
+    if not parts.netloc:
+        return ''
+    return f"{parts.scheme.upper()}://{parts.netloc.upper()}{parts.path.rstrip('/')}"
+
+
+def compact_payload(code, signed=False, url=None, secret=None):
+    """URL corta (o solo el código si no hay URL base) para el QR de un lote"""
+    token = f"{code}.{sign_code(code, secret)}" if signed else code
+    prefix = base_url(url)
+    return f"{prefix}/T/{token}" if prefix else token
+
+
+def parse_token(token, secret=None):
+    """Separar el código de su firma
+
+    Devuelve (código, verificado). Si la firma no coincide devuelve
+    (None, False) sin tocar Firestore.
+    """
+    code, separator, signature = token.partition('.')
+    if not separator:
+        return code, False
+    # compare_digest solo acepta str ASCII: se comparan bytes para que
+    # una firma con otros caracteres sea un 403 y no un TypeError
+    if hmac.compare_digest(signature.upper().encode(), sign_code(code, secret).encode()):
+        return code, True
+    return None, False
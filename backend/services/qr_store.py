@@ -0,0 +1,132 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from config import Config
+
+# Extensión -> tipo MIME de las imágenes guardadas
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'json': 'application/json'}
+
+
+class QRStore:
+    """Almacén en disco direccionado por contenido para imágenes QR
+
+    Cada imagen se guarda como <raíz>/<2 primeros hex>/<sha256>.<ext> y el
+    documento del lote solo guarda la referencia (qr_ref): el sha256 para
+    PNG y "<sha256>.<ext>" para los demás formatos. Las imágenes más usadas
+    se mantienen además en un LRU en memoria acotado por bytes.
+    """
+
+    def __init__(self, root, memory_bytes=8 * 1024 * 1024):
+        self.root = root
+        self.memory_bytes = memory_bytes
+
+        self._images = OrderedDict()  # qr_ref -> bytes
+        self._images_size = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, qr_ref):
+        digest, _, ext = qr_ref.partition('.')
+        return os.path.join(self.root, digest[:2], f"{digest}.{ext or 'png'}")
+
+    @staticmethod
+    def is_valid_ref(qr_ref):
+        if not isinstance(qr_ref, str):
+            return False
+        digest, _, ext = qr_ref.partition('.')
+        return (len(digest) == 64 and all(c in '0123456789abcdef' for c in digest)
+                and (not ext or (ext != 'png' and ext in MIMETYPES)))
+
+    @staticmethod
+    def mimetype(qr_ref):
+        """Tipo MIME de una referencia"""
+        _, _, ext = qr_ref.partition('.')
+        return MIMETYPES[ext or 'png']
+
+    @staticmethod
+    def ref_of(png_bytes, ext='png'):
+        """Referencia que tendría una imagen al guardarla"""
+        digest = hashlib.sha256(png_bytes).hexdigest()
+        return digest if ext == 'png' else f"{digest}.{ext}"
+
+    def exists(self, qr_ref):
+        """True si la imagen está en disco (sin cargarla en memoria)"""
+        return self.is_valid_ref(qr_ref) and os.path.exists(self._path(qr_ref))
+
+    def put(self, png_bytes, ext='png'):
+        """Guardar una imagen y devolver su referencia"""
+        qr_ref = self.ref_of(png_bytes, ext)
+        path = self._path(qr_ref)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Escritura atómica: varios workers pueden guardar la misma imagen
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(png_bytes)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        self._cache_image(qr_ref, png_bytes)
+        return qr_ref
+
+    def get(self, qr_ref):
+        """Obtener los bytes de una imagen o None si no existe"""
+        if not self.is_valid_ref(qr_ref):
+            return None
+
+        with self._lock:
+            data = self._images.get(qr_ref)
+            if data is not None:
+                self._images.move_to_end(qr_ref)
+                self.memory_hits += 1
+                return data
+
+        try:
+            with open(self._path(qr_ref), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        self._cache_image(qr_ref, data)
+        return data
+
+    def _cache_image(self, qr_ref, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if qr_ref in self._images:
+                self._images.move_to_end(qr_ref)
+                return
+            self._images[qr_ref] = data
+            self._images_size += len(data)
+            while self._images_size > self.memory_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._images_size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_items': len(self._images),
+                'memory_bytes': self._images_size,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+
+qr_store = QRStore(
+    root=Config.QR_CODES_PATH,
+    memory_bytes=Config.QR_CACHE_BYTES
+)
@@ -0,0 +1,350 @@
+import asyncio
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BytesIO
+from config import Config
+from services.metrics import QR_RENDER_LATENCY
+from services.structured_log import get_logger
+
+log = get_logger('qr_worker')
+
+
+class QRQueueFullError(Exception):
+    """La cola de renderizado de QR está llena (backpressure)"""
+
+
+# Formato de salida -> extensión con la que se guarda en el QRStore
+QR_OUTPUT_FORMATS = {'png': 'png', 'svg': 'svg', 'matrix': 'json'}
+
+
+def qr_matrix(payload, border=4):
+    """Versión y matriz de módulos (con borde) del QR de un payload"""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=border,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.version, qr.get_matrix()
+
+
+def matrix_to_image(matrix, box_size=10):
+    """Imagen PIL en escala de grises (0 o 255) a partir de la matriz de módulos"""
+    from PIL import Image
+
+    size = len(matrix)
+    pixels = bytes(0 if module else 255 for row in matrix for module in row)
+    img = Image.frombytes('L', (size, size), pixels)
+    if box_size > 1:
+        img = img.resize((size * box_size, size * box_size), Image.NEAREST)
+    return img
+
+
+def matrix_to_png(matrix, box_size=10):
+    """PNG de 1 bit por píxel a partir de la matriz de módulos"""
+    from PIL import Image
+
+    buffered = BytesIO()
+    img = matrix_to_image(matrix, box_size)
+    img.convert('1', dither=Image.NONE).save(buffered, format='PNG', optimize=True)
+    return buffered.getvalue()
+
+
+def matrix_to_svg(matrix, box_size=10):
+    """SVG con un único path; los módulos contiguos de cada fila se unen"""
+    size = len(matrix)
+    parts = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            parts.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(parts)}"/></svg>'
+    ).encode()
+
+
+def matrix_to_json(version, matrix, border):
+    """Matriz cruda para clientes que dibujan el QR ellos mismos"""
+    rows = [''.join('1' if module else '0' for module in row) for row in matrix]
+    return json.dumps({'version': version, 'border': border, 'rows': rows}, separators=(',', ':')).encode()
+
+
+def render_qr(payload, fmt='png', box_size=10, border=4):
+    """Renderizar un QR a bytes en el formato pedido
+
+    Función de módulo para poder ejecutarse en un proceso hijo.
+    """
+    version, matrix = qr_matrix(payload, border)
+    if fmt == 'png':
+        return matrix_to_png(matrix, box_size)
+    if fmt == 'svg':
+        return matrix_to_svg(matrix, box_size)
+    if fmt == 'matrix':
+        return matrix_to_json(version, matrix, border)
+    raise ValueError(f"Formato de QR inválido: {fmt}")
+
+
+def render_qr_png(payload, box_size=10, border=4):
+    """Renderizar un QR a bytes PNG"""
+    return render_qr(payload, 'png', box_size, border)
+
+
+def _mp_context():
+    """Contexto de los procesos de renderizado
+
+    Con fork, cada hijo heredaría los hilos y locks del worker (gRPC de
+    Firestore, pools de write-back) en el estado en que estuvieran. forkserver
+    arranca los hijos desde un proceso limpio; spawn donde no existe.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class QRRenderer:
+    """Renderizado de QR en un pool de procesos con cola acotada
+
+    mode='process' renderiza en segundo plano, guarda la imagen en el
+    QRStore y completa la referencia del lote al terminar; mode='sync'
+    renderiza en el hilo que llama (tests).
+    """
+
+    def __init__(self, mode='process', max_workers=None, max_pending=64, queue_timeout=2.0,
+                 output_format='png', box_size=10, border=4):
+        if output_format not in QR_OUTPUT_FORMATS:
+            raise ValueError(f"Formato de QR inválido: {output_format}")
+        self.mode = mode
+        self.output_format = output_format
+        # Extensión con la que se guardan las imágenes en el QRStore
+        self.extension = QR_OUTPUT_FORMATS[output_format]
+        # partial de una función de módulo: se puede enviar al pool de procesos
+        self._render = partial(render_qr, fmt=output_format, box_size=box_size, border=border)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # Los contadores se actualizan desde hilos de peticiones y de write-back
+        self._stats_lock = threading.Lock()
+        self._pool = None
+        self._writeback = None
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def is_sync(self):
+        return self.mode == 'sync'
+
+    def set_mode(self, mode):
+        """Cambiar entre 'process' y 'sync'"""
+        if mode not in ('process', 'sync'):
+            raise ValueError(f"Modo de renderizado inválido: {mode}")
+        self.mode = mode
+
+    def render(self, payload):
+        """Renderizar de forma síncrona en el hilo actual"""
+        with QR_RENDER_LATENCY.time(format=self.output_format, path='sync'):
+            return self._render(payload)
+
+    def warmup(self):
+        """Importar qrcode/Pillow y sus tablas renderizando un QR sin registrarlo"""
+        self._render('warmup')
+
+    def render_many(self, payloads):
+        """Renderizar varios QR en paralelo y devolver las imágenes en orden"""
+        if self.is_sync or len(payloads) < 2:
+            return [self.render(payload) for payload in payloads]
+        self._ensure_pools()
+        start = time.perf_counter()
+        chunksize = max(1, len(payloads) // ((self.max_workers or os.cpu_count() or 1) * 4))
+        pool = self._pool
+        try:
+            images = list(pool.map(self._render, payloads, chunksize=chunksize))
+        except BrokenProcessPool:
+            # Renderizar no tiene efectos: se repite el lote en un pool nuevo
+            self._replace_pool(pool)
+            images = list(self._pool.map(self._render, payloads, chunksize=chunksize))
+        # Tiempo de pared por QR dentro del lote
+        per_item = (time.perf_counter() - start) / len(payloads)
+        for _ in payloads:
+            QR_RENDER_LATENCY.observe(per_item, format=self.output_format, path='batch')
+        return images
+
+    async def render_async(self, payload):
+        """Renderizar sin bloquear el loop (pool de procesos o executor del loop)"""
+        if self.is_sync:
+            return await asyncio.get_running_loop().run_in_executor(None, self.render, payload)
+        start = time.perf_counter()
+        image = await asyncio.wrap_future(self._submit(self._render, payload))
+        QR_RENDER_LATENCY.observe(time.perf_counter() - start, format=self.output_format, path='executor')
+        return image
+
+    async def render_many_async(self, payloads):
+        """Renderizar varios QR a la vez sin bloquear el loop"""
+        return await asyncio.gather(*(self.render_async(payload) for payload in payloads))
+
+    def imap(self, fn, items, window=None):
+        """Aplicar fn a cada item en el pool de procesos, devolviendo en orden
+
+        Como mucho `window` tareas en vuelo, así la memoria no depende del
+        número de items (fn debe ser una función de módulo o un partial).
+        """
+        if self.is_sync:
+            for item in items:
+                yield fn(item)
+            return
+
+        window = window or (self.max_workers or os.cpu_count() or 1) * 2
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(self._submit(fn, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Cliente desconectado: no renderizar lo que ya nadie va a leer
+            for future in pending:
+                future.cancel()
+
+    def _ensure_pools(self):
+        # El pool se crea de forma perezosa para no lanzar procesos al importar
+        if self._pool is not None:
+            return
+        with self._lock:
+            if self._pool is None:
+                self._writeback = ThreadPoolExecutor(max_workers=2, thread_name_prefix='qr-writeback')
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_mp_context())
+
+    def _replace_pool(self, broken):
+        """Sustituir un pool roto (murió un proceso de renderizado) por uno nuevo"""
+        with self._lock:
+            if self._pool is broken:
+                log.warning('Pool de renderizado de QR roto, se crea uno nuevo')
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_mp_context())
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        """Enviar una tarea al pool de procesos; si está roto se recrea y se reintenta una vez"""
+        self._ensure_pools()
+        pool = self._pool
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:
+            self._replace_pool(pool)
+            return self._pool.submit(fn, *args)
+
+    def count(self, name):
+        """Incrementar un contador (submitted, completed, failed o rejected)"""
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def reserve(self):
+        """Reservar un lugar en la cola o lanzar QRQueueFullError"""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.count('rejected')
+            raise QRQueueFullError('Demasiados códigos QR pendientes, intenta de nuevo en unos segundos')
+
+    def release(self):
+        """Liberar un lugar reservado que no llegó a usarse"""
+        self._slots.release()
+
+    def submit_reserved(self, lot_id, payload, farmer_uid=None):
+        """Encolar el renderizado de un lote con un lugar ya reservado"""
+        try:
+            future = self._submit(self._render, payload)
+        except Exception:
+            self._slots.release()
+            raise
+
+        self.count('submitted')
+        submitted_at = time.perf_counter()
+        future.add_done_callback(lambda f: self._writeback.submit(self._on_done, lot_id, farmer_uid, f, submitted_at))
+        return future
+
+    def _on_done(self, lot_id, farmer_uid, future, submitted_at=None):
+        """Guardar el resultado del worker en el documento del lote"""
+        from firebase_config import db
+        from services.qr_store import qr_store
+        from services.lot_cache import lot_cache
+        from models.lot import Lot
+
+        try:
+            image = future.result()
+            if submitted_at is not None:
+                QR_RENDER_LATENCY.observe(time.perf_counter() - submitted_at, format=self.output_format, path='async')
+            qr_ref = qr_store.put(image, self.extension)
+            # Con updated_at para que el pull delta entregue el QR listo
+            db.collection('lots').document(lot_id).update(Lot.stamped({
+                'qr_ref': qr_ref,
+                'qr_status': 'ready'
+            }))
+            lot_cache.invalidate(lot_ids=[lot_id], farmer_uids=[farmer_uid] if farmer_uid else [])
+            self.count('completed')
+        except Exception as e:
+            self.count('failed')
+            log.error('Error al generar QR', lot_id=lot_id, error=str(e))
+            try:
+                db.collection('lots').document(lot_id).update(Lot.stamped({'qr_status': 'failed'}))
+            except Exception:
+                pass
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        """Contadores del pool de renderizado"""
+        with self._stats_lock:
+            return {
+                'mode': self.mode,
+                'output_format': self.output_format,
+                'max_pending': self.max_pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+    def shutdown(self, wait=True):
+        """Esperar a que terminen los QR pendientes y cerrar los pools"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+        if self._writeback is not None:
+            self._writeback.shutdown(wait=wait)
+
+
+qr_renderer = QRRenderer(
+    mode=Config.QR_RENDER_MODE,
+    max_workers=Config.QR_WORKERS,
+    max_pending=Config.QR_MAX_PENDING,
+    queue_timeout=Config.QR_QUEUE_TIMEOUT,
+    output_format=Config.QR_OUTPUT_FORMAT,
+    box_size=Config.QR_BOX_SIZE,
+    border=Config.QR_BORDER
+)
+atexit.register(qr_renderer.shutdown)
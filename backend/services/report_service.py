@@ -0,0 +1,183 @@
+from datetime import datetime
+from firebase_config import db
+from services.structured_log import get_logger
+
+log = get_logger('report_service')
+
+# Métricas acumuladas en cada documento farmer_stats/{uid}
+METRIC_FIELDS = ('carbon_saved', 'water_saved', 'emissions_reduced', 'revenue', 'active_lots', 'quantity')
+
+
+def _to_float(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ReportService:
+    @staticmethod
+    def stats_ref(farmer_uid):
+        """Documento de agregados del agricultor"""
+        return db.collection('farmer_stats').document(farmer_uid)
+
+    @staticmethod
+    def lot_contribution(lot_data):
+        """Aporte de un lote a los agregados (cero si no está activo)"""
+        if not lot_data or lot_data.get('status', 'active') != 'active':
+            return {field: 0.0 for field in METRIC_FIELDS}
+
+        metrics = lot_data.get('sustainability_metrics') or {}
+        quantity = _to_float(lot_data.get('quantity'))
+        return {
+            'carbon_saved': _to_float(metrics.get('carbonSaved')),
+            'water_saved': _to_float(metrics.get('waterSaved')),
+            'emissions_reduced': _to_float(metrics.get('emissionsReduced')),
+            'revenue': _to_float(lot_data.get('price')) * quantity,
+            'active_lots': 1.0,
+            'quantity': quantity
+        }
+
+    @staticmethod
+    def delta(old_lot=None, new_lot=None, created=0):
+        """Diferencia de agregados entre la versión anterior y la nueva de un lote"""
+        before = ReportService.lot_contribution(old_lot)
+        after = ReportService.lot_contribution(new_lot)
+        result = {field: after[field] - before[field] for field in METRIC_FIELDS}
+        result['lots_created'] = created
+        return result
+
+    @staticmethod
+    def combine(deltas):
+        """Sumar varios deltas en uno (una sola escritura por batch)"""
+        total = {field: 0.0 for field in METRIC_FIELDS}
+        total['lots_created'] = 0
+        for delta in deltas:
+            for field, value in delta.items():
+                total[field] += value
+        return total
+
+    @staticmethod
+    def apply_delta(batch, farmer_uid, delta):
+        """Agregar al batch el incremento de los agregados del agricultor"""
+        from firebase_admin import firestore
+
+        increments = {field: firestore.Increment(value) for field, value in delta.items() if value}
+        if not increments:
+            return False
+        increments['updated_at'] = datetime.utcnow()
+        batch.set(ReportService.stats_ref(farmer_uid), {'totals': increments}, merge=True)
+        return True
+
+    @staticmethod
+    def build_report(stats):
+        """Reporte a partir del documento farmer_stats (vacío si no existe)"""
+        totals = stats.get('totals', {})
+        return {
+            'total_carbon_saved': round(_to_float(totals.get('carbon_saved')), 2),
+            'total_water_saved': round(_to_float(totals.get('water_saved')), 2),
+            'total_emissions_reduced': round(_to_float(totals.get('emissions_reduced')), 2),
+            'lots_created': int(_to_float(totals.get('lots_created'))),
+            'active_lots': int(_to_float(totals.get('active_lots'))),
+            'revenue': round(_to_float(totals.get('revenue')), 2),
+            'series': stats.get('series', {}),
+            'recomputed_at': stats.get('recomputed_at')
+        }
+
+    @staticmethod
+    def get_sustainability_report(farmer_uid):
+        """Reporte de impacto leído de un solo documento (O(1) en número de lotes)"""
+        try:
+            doc = ReportService.stats_ref(farmer_uid).get()
+            return ReportService.build_report(doc.to_dict() if doc.exists else {}), 200
+
+        except Exception as e:
+            log.exception('Error al obtener reporte', farmer_uid=farmer_uid)
+            return {'error': f'Error al obtener reporte: {str(e)}'}, 500
+
+    @staticmethod
+    def recompute(farmer_uid=None):
+        """Recalcular agregados y series (mensual y por cultivo) con NumPy
+
+        Corrige cualquier deriva de los deltas y genera las series que no
+        se mantienen de forma incremental. Sin farmer_uid procesa a todos.
+        Devuelve el número de agricultores actualizados.
+        """
+        import numpy as np
+        from firebase_admin import firestore
+
+        query = db.collection('lots')
+        if farmer_uid:
+            query = query.where(filter=firestore.FieldFilter('farmer_uid', '==', farmer_uid))
+        query = query.select(['farmer_uid', 'crop_type', 'quantity', 'price', 'status',
+                              'created_at', 'sustainability_metrics'])
+
+        farmers, crops, months = [], [], []
+        values = {field: [] for field in METRIC_FIELDS}
+        for doc in query.stream():
+            lot_data = doc.to_dict()
+            created_at = lot_data.get('created_at')
+            farmers.append(lot_data.get('farmer_uid'))
+            crops.append(lot_data.get('crop_type') or '')
+            months.append(created_at.strftime('%Y-%m') if created_at else '')
+            contribution = ReportService.lot_contribution(lot_data)
+            for field in METRIC_FIELDS:
+                values[field].append(contribution[field])
+
+        if not farmers:
+            return 0
+
+        farmer_keys, farmer_idx = np.unique(np.array(farmers, dtype=object).astype(str), return_inverse=True)
+        crop_keys, crop_idx = np.unique(np.array(crops, dtype=str), return_inverse=True)
+        month_keys, month_idx = np.unique(np.array(months, dtype=str), return_inverse=True)
+        matrix = {field: np.asarray(values[field], dtype=np.float64) for field in METRIC_FIELDS}
+
+        n_farmers = len(farmer_keys)
+        totals = {field: np.bincount(farmer_idx, weights=matrix[field], minlength=n_farmers)
+                  for field in METRIC_FIELDS}
+        lots_created = np.bincount(farmer_idx, minlength=n_farmers)
+
+        # Celdas (agricultor, mes) y (agricultor, cultivo) con bincount sobre índices planos
+        def grouped(idx, n_keys):
+            flat = farmer_idx * n_keys + idx
+            size = n_farmers * n_keys
+            sums = {field: np.bincount(flat, weights=matrix[field], minlength=size).reshape(n_farmers, n_keys)
+                    for field in METRIC_FIELDS}
+            counts = np.bincount(flat, minlength=size).reshape(n_farmers, n_keys)
+            return sums, counts
+
+        monthly, monthly_counts = grouped(month_idx, len(month_keys))
+        by_crop, crop_counts = grouped(crop_idx, len(crop_keys))
+
+        def series(keys, sums, counts, row, label):
+            result = []
+            for col in np.nonzero(counts[row])[0]:
+                entry = {label: str(keys[col]), 'lots': int(counts[row, col])}
+                entry.update({field: round(float(sums[field][row, col]), 2) for field in METRIC_FIELDS})
+                result.append(entry)
+            return result
+
+        now = datetime.utcnow()
+        batch = db.batch()
+        ops = 0
+        for row, uid in enumerate(farmer_keys):
+            doc_totals = {field: float(totals[field][row]) for field in METRIC_FIELDS}
+            doc_totals['lots_created'] = int(lots_created[row])
+            doc_totals['updated_at'] = now
+            batch.set(ReportService.stats_ref(str(uid)), {
+                'totals': doc_totals,
+                'series': {
+                    'monthly': series(month_keys, monthly, monthly_counts, row, 'month'),
+                    'by_crop': series(crop_keys, by_crop, crop_counts, row, 'crop_type')
+                },
+                'recomputed_at': now
+            })
+            ops += 1
+            if ops >= 500:
+                batch.commit()
+                batch = db.batch()
+                ops = 0
+        if ops:
+            batch.commit()
+
+        return n_farmers
@@ -0,0 +1,104 @@
+import json
+import logging
+import random
+import sys
+import time
+from config import Config
+
+_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos extra al mismo nivel"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible para desarrollo: mensaje y campos clave=valor"""
+
+    def format(self, record):
+        fields = ' '.join(f"{k}={v}" for k, v in getattr(record, 'fields', {}).items())
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar solo una fracción de los registros por debajo de WARNING
+
+    Los avisos y errores nunca se descartan.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+def configure(level=None, fmt=None, sample_rate=None):
+    """Configurar el logger raíz de la aplicación (una sola vez)"""
+    global _configured
+    root = logging.getLogger('biotrazo')
+    if _configured:
+        return root
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if (fmt or Config.LOG_FORMAT) == 'json' else TextFormatter())
+    handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_RATE if sample_rate is None else sample_rate))
+    root.addHandler(handler)
+    root.setLevel((level or Config.LOG_LEVEL).upper())
+    root.propagate = False
+    _configured = True
+    return root
+
+
+class StructuredLogger:
+    """Logger con campos estructurados: log.info('Lote creado', lot_id=...)"""
+
+    def __init__(self, name):
+        configure()
+        self._logger = logging.getLogger(f'biotrazo.{name}')
+
+    def is_enabled(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+def get_logger(name):
+    return StructuredLogger(name)
@@ -0,0 +1,144 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from firebase_config import get_auth
+from services.structured_log import get_logger
+
+log = get_logger('token_cache')
+
+# URL de los certificados públicos con los que Google firma los ID tokens
+ID_TOKEN_CERT_URI = ('https://www.googleapis.com/robot/v1/metadata/x509/'
+                     'securetoken@system.gserviceaccount.com')
+
+
+class TokenCache:
+    """Caché acotada y thread-safe de ID tokens ya verificados"""
+
+    def __init__(self, max_size=1024, max_ttl=300, expiry_skew=30,
+                 certs_refresh_interval=1800, check_revoked=False):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.expiry_skew = expiry_skew
+        self.certs_refresh_interval = certs_refresh_interval
+        self.check_revoked = check_revoked
+
+        # hash del token -> (instante de expiración, claims decodificados)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(id_token):
+        """Nunca guardamos el token en claro, solo su hash"""
+        return hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+
+    def verify(self, id_token):
+        """Verificar un ID token usando la caché cuando sea posible"""
+        self._ensure_refresher()
+
+        # La verificación de revocación requiere consultar a Firebase siempre
+        if self.check_revoked:
+            return get_auth().verify_id_token(id_token, check_revoked=True)
+
+        key = self._key(id_token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, claims = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+
+        # La verificación se hace fuera del lock para no serializar peticiones
+        claims = get_auth().verify_id_token(id_token)
+
+        # Nunca cachear más allá del 'exp' del propio token
+        expires_at = min(claims.get('exp', now) - self.expiry_skew, now + self.max_ttl)
+        if expires_at > now:
+            with self._lock:
+                self._entries[key] = (expires_at, claims)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return claims
+
+    def invalidate(self, id_token=None):
+        """Eliminar un token de la caché (o vaciarla completa)"""
+        with self._lock:
+            if id_token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(id_token), None)
+
+    def stats(self):
+        """Contadores de aciertos y fallos de la caché"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0
+            }
+
+    # ===================== CERTIFICADOS DE GOOGLE =====================
+
+    def refresh_certs(self):
+        """Descargar los certificados en la sesión HTTP que usa firebase_admin
+
+        La sesión respeta Cache-Control, así que una petición periódica
+        mantiene los certificados calientes y ninguna petición de usuario
+        tiene que esperar su descarga.
+        """
+        try:
+            client = get_auth()._get_client(None)
+            client._token_verifier.request(ID_TOKEN_CERT_URI, method='GET')
+            return True
+        except Exception as e:
+            log.warning('Error al refrescar certificados de Firebase', error=str(e))
+            return False
+
+    def _ensure_refresher(self):
+        """Arrancar (una sola vez) el hilo que refresca los certificados"""
+        if self._refresher is not None or self.certs_refresh_interval <= 0:
+            return
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name='firebase-certs-refresher', daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            self.refresh_certs()
+            self._stop.wait(self.certs_refresh_interval)
+
+    def stop(self):
+        """Detener el hilo de refresco"""
+        self._stop.set()
+
+
+token_cache = TokenCache(
+    max_size=Config.AUTH_TOKEN_CACHE_SIZE,
+    max_ttl=Config.AUTH_TOKEN_CACHE_TTL,
+    certs_refresh_interval=Config.AUTH_CERTS_REFRESH_INTERVAL,
+    check_revoked=Config.AUTH_CHECK_REVOKED
+)
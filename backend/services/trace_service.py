@@ -0,0 +1,127 @@
+import re
+import threading
+from firebase_config import db
+from models.lot import Lot
+from services.lot_cache import MemoryBackend
+from services.qr_payload import parse_token
+from config import Config
+from services.structured_log import get_logger
+
+log = get_logger('trace_service')
+
+# Formato generado en Lot.__init__: LOT-<AAAAMMDDhhmmss>-<8 hex en mayúsculas>
+TRACE_CODE_PATTERN = re.compile(r'^LOT-\d{14}-[0-9A-F]{8}$')
+
+# Campos del lote que se muestran a quien escanea el QR
+PUBLIC_FIELDS = ('traceability_code', 'crop_type', 'quantity', 'unit', 'location', 'status',
+                 'harvest_date', 'certifications', 'sustainability_metrics', 'created_at')
+
+# Marca de "código inexistente" en la caché negativa
+_MISSING = ''
+
+
+class TraceService:
+    # código -> lot_id (la relación nunca cambia) y códigos inexistentes
+    _codes = MemoryBackend(max_items=Config.TRACE_CACHE_MAX_ITEMS)
+    _lock = threading.Lock()
+    stats_counters = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'rejected': 0, 'bad_signatures': 0}
+
+    @staticmethod
+    def _count(name):
+        with TraceService._lock:
+            TraceService.stats_counters[name] += 1
+
+    @staticmethod
+    def is_valid_code(code):
+        return isinstance(code, str) and TRACE_CODE_PATTERN.match(code) is not None
+
+    @staticmethod
+    def resolve_lot_id(code):
+        """Obtener el lot_id de un código, o None si no existe"""
+        cached = TraceService._codes.get(code)
+        if cached is not None:
+            if cached == _MISSING:
+                TraceService._count('negative_hits')
+                return None
+            TraceService._count('hits')
+            return cached
+
+        TraceService._count('misses')
+        doc = Lot.trace_code_ref(code).get()
+        if not doc.exists:
+            TraceService._codes.set(code, _MISSING, Config.TRACE_NEGATIVE_TTL)
+            return None
+
+        lot_id = doc.to_dict()['lot_id']
+        TraceService._codes.set(code, lot_id, Config.TRACE_POSITIVE_TTL)
+        return lot_id
+
+    @staticmethod
+    def lookup(code):
+        """Información pública de un lote a partir de su código de trazabilidad
+
+        Acepta el código solo o firmado (<código>.<firma>) como en los QR
+        en modo 'signed'.
+        """
+        try:
+            # Las firmas falsas y los códigos malformados nunca llegan a Firestore
+            code, verified = parse_token(code)
+            if code is None:
+                TraceService._count('bad_signatures')
+                return {'error': 'Firma del código inválida'}, 403
+            if not TraceService.is_valid_code(code):
+                TraceService._count('rejected')
+                return {'error': 'Código de trazabilidad inválido'}, 400
+
+            lot_id = TraceService.resolve_lot_id(code)
+            if not lot_id:
+                return {'error': 'Código de trazabilidad no encontrado'}, 404
+
+            lot_data = Lot.get_by_id(lot_id)
+            if not lot_data:
+                return {'error': 'Código de trazabilidad no encontrado'}, 404
+            if lot_data.get('status') == 'deleted':
+                return {'error': 'El lote ya no está disponible'}, 410
+
+            lot = {field: lot_data.get(field) for field in PUBLIC_FIELDS}
+            lot['qr_url'] = f"/api/lots/{lot_id}/qr"
+            return {'lot': lot, 'verified': verified}, 200
+
+        except Exception as e:
+            log.exception('Error al buscar código de trazabilidad', code=code)
+            return {'error': f'Error al buscar código de trazabilidad: {str(e)}'}, 500
+
+    @staticmethod
+    def backfill_index(batch_limit=500):
+        """Crear las entradas del índice para los lotes existentes
+
+        Es idempotente: reescribir una entrada deja el mismo contenido.
+        Devuelve el número de entradas escritas.
+        """
+        written = 0
+        batch = db.batch()
+        ops = 0
+        for doc in db.collection('lots').select(['traceability_code', 'farmer_uid', 'created_at']).stream():
+            lot_data = doc.to_dict()
+            code = lot_data.get('traceability_code')
+            if not code:
+                continue
+            batch.set(Lot.trace_code_ref(code), {
+                'lot_id': doc.id,
+                'farmer_uid': lot_data.get('farmer_uid'),
+                'created_at': lot_data.get('created_at')
+            })
+            ops += 1
+            written += 1
+            if ops >= batch_limit:
+                batch.commit()
+                batch = db.batch()
+                ops = 0
+        if ops:
+            batch.commit()
+        return written
+
+    @staticmethod
+    def stats():
+        with TraceService._lock:
+            return dict(TraceService.stats_counters, size=TraceService._codes.size())
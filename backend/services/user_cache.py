@@ -0,0 +1,45 @@
+from config import Config
+from services.lot_cache import LotCache, create_backend
+
+
+class UserCache(LotCache):
+    """Caché read-through de perfiles (users/{uid}) y del uid de cada email
+
+    La comparten User.get_by_uid, AsyncUser y los flujos de AuthService.
+    El uid de un email es solo una pista para adelantar la lectura del
+    perfil: Firebase Auth sigue siendo quien confirma la cuenta en cada login.
+    """
+
+    def user_key(self, uid):
+        return f"user:{uid}"
+
+    def email_key(self, email):
+        return f"email:{email.strip().lower()}"
+
+    def uid_for_email(self, email):
+        """uid visto por última vez para este email (o None)"""
+        if not self.enabled:
+            return None
+        raw = self.backend.get(self.email_key(email))
+        self._count(raw is not None)
+        return raw.decode() if raw is not None else None
+
+    def remember_email(self, email, uid):
+        # La pista dura más que el perfil: cuando el perfil expira, el
+        # siguiente login lo relee en paralelo con Firebase Auth
+        if self.enabled:
+            self.backend.set(self.email_key(email), uid.encode(), self.ttl * 12)
+
+    def invalidate_user(self, uid):
+        """Olvidar el perfil de un usuario"""
+        self._forget(self.user_key(uid))
+
+    def forget_email(self, email):
+        self._forget(self.email_key(email))
+
+
+user_cache = UserCache(
+    backend=create_backend(Config.USER_CACHE_BACKEND, path=Config.USER_CACHE_PATH,
+                           max_items=Config.USER_CACHE_MAX_ITEMS),
+    ttl=Config.USER_CACHE_TTL
+)
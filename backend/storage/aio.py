@@ -0,0 +1,176 @@
+"""API asíncrona (estilo firestore.AsyncClient) sobre un DocumentStore síncrono
+
+El modo ASGI usa firestore.AsyncClient cuando STORAGE_BACKEND=firestore.
+Con el almacén local (SQLite) cada llamada se ejecuta en el executor del
+loop: son operaciones de disco cortas y así los servicios async tienen
+una sola API para los dos backends.
+"""
+import asyncio
+
+
+class AsyncDocumentReference:
+    def __init__(self, reference):
+        self._ref = reference
+
+    @property
+    def id(self):
+        return self._ref.id
+
+    @property
+    def path(self):
+        return self._ref.path
+
+    def collection(self, name):
+        return AsyncCollectionReference(self._ref.collection(name))
+
+    async def get(self, field_paths=None, **kwargs):
+        return await asyncio.to_thread(self._ref.get, field_paths)
+
+    async def set(self, data, merge=False, **kwargs):
+        return await asyncio.to_thread(self._ref.set, data, merge)
+
+    async def create(self, data, **kwargs):
+        return await asyncio.to_thread(self._ref.create, data)
+
+    async def update(self, data, option=None, **kwargs):
+        return await asyncio.to_thread(self._ref.update, data, option)
+
+    async def delete(self, option=None, **kwargs):
+        return await asyncio.to_thread(self._ref.delete, option)
+
+
+class AsyncQuery:
+    def __init__(self, query):
+        self._query = query
+
+    @property
+    def id(self):
+        return self._query.id
+
+    def where(self, *args, **kwargs):
+        return AsyncQuery(self._query.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return AsyncQuery(self._query.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return AsyncQuery(self._query.limit(count))
+
+    def start_after(self, values):
+        return AsyncQuery(self._query.start_after(values))
+
+    def select(self, field_paths):
+        return AsyncQuery(self._query.select(field_paths))
+
+    async def get(self, **kwargs):
+        return await asyncio.to_thread(self._query.get)
+
+    async def stream(self, **kwargs):
+        for snapshot in await self.get():
+            yield snapshot
+
+
+class AsyncCollectionReference(AsyncQuery):
+    def document(self, document_id=None):
+        return AsyncDocumentReference(self._query.document(document_id))
+
+
+def _unwrap(reference):
+    # Los snapshots del almacén traen referencias síncronas
+    return getattr(reference, '_ref', reference)
+
+
+class AsyncWriteBatch:
+    def __init__(self, batch):
+        self._batch = batch
+
+    def set(self, reference, data, merge=False):
+        self._batch.set(_unwrap(reference), data, merge=merge)
+        return self
+
+    def create(self, reference, data):
+        self._batch.create(_unwrap(reference), data)
+        return self
+
+    def update(self, reference, data, option=None):
+        self._batch.update(_unwrap(reference), data, option=option)
+        return self
+
+    def delete(self, reference, option=None):
+        self._batch.delete(_unwrap(reference), option=option)
+        return self
+
+    def __len__(self):
+        return len(self._batch)
+
+    async def commit(self, **kwargs):
+        return await asyncio.to_thread(self._batch.commit)
+
+
+class AsyncStoreAdapter:
+    """Cliente asíncrono sobre un DocumentStore (por ejemplo SQLiteStore)"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def collection(self, name):
+        return AsyncCollectionReference(self.store.collection(name))
+
+    def document(self, path):
+        return AsyncDocumentReference(self.store.document(path))
+
+    def collection_group(self, name):
+        return AsyncQuery(self.store.collection_group(name))
+
+    def batch(self):
+        return AsyncWriteBatch(self.store.batch())
+
+    def write_option(self, last_update_time=None, exists=None):
+        return self.store.write_option(last_update_time=last_update_time, exists=exists)
+
+    async def get_all(self, references, field_paths=None, **kwargs):
+        references = [_unwrap(reference) for reference in references]
+        snapshots = await asyncio.to_thread(lambda: list(self.store.get_all(references, field_paths)))
+        for snapshot in snapshots:
+            yield snapshot
+
+
+class RebasedBatch:
+    """WriteBatch asíncrono que acepta referencias del cliente síncrono
+
+    Permite reutilizar el código que arma escrituras con referencias de
+    firebase_config.db (ReportService.apply_delta, OfflineSyncService):
+    cada referencia se traduce por su ruta al cliente asíncrono.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._batch = client.batch()
+
+    def _rebase(self, reference):
+        return self._client.document(reference.path)
+
+    def set(self, reference, data, merge=False):
+        self._batch.set(self._rebase(reference), data, merge=merge)
+        return self
+
+    def create(self, reference, data):
+        self._batch.create(self._rebase(reference), data)
+        return self
+
+    def update(self, reference, data, option=None):
+        if option is None:
+            self._batch.update(self._rebase(reference), data)
+        else:
+            self._batch.update(self._rebase(reference), data, option=option)
+        return self
+
+    def delete(self, reference, option=None):
+        self._batch.delete(self._rebase(reference), option=option)
+        return self
+
+    def __len__(self):
+        return len(self._batch)
+
+    async def commit(self):
+        return await self._batch.commit()
@@ -0,0 +1,563 @@
+"""Interfaz de almacenamiento de documentos con la API del cliente de Firestore
+
+Los modelos y servicios solo usan un subconjunto del cliente de Firestore
+(documentos, subcolecciones, consultas con filtros/orden/cursores,
+collection_group, WriteBatch con precondiciones, get_all, on_snapshot,
+Increment y DELETE_FIELD). DocumentStore implementa esa semántica una sola
+vez; cada backend solo decide cómo leer, recorrer y escribir documentos.
+"""
+import copy
+import enum
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1.transforms import DELETE_FIELD, Increment, Sentinel
+
+
+def _aware(value):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _sort_key(value):
+    """Orden de tipos de Firestore: null < bool < número < fecha < texto < resto"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, _aware(value))
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, DocumentReference):
+        return (6, value.path)
+    return (7, str(value))
+
+
+_MISSING = object()
+
+
+def _get_path(data, field_path):
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set_path(data, field_path, value, now=None):
+    parts = field_path.split('.')
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    _assign(target, parts[-1], value, now)
+
+
+def _assign(target, key, value, now=None):
+    """Asignar aplicando las transformaciones (Increment, DELETE_FIELD, SERVER_TIMESTAMP)
+
+    Como en Firestore, SERVER_TIMESTAMP toma el update_time del commit (now).
+    """
+    if isinstance(value, Increment):
+        current = target.get(key)
+        target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    elif value is DELETE_FIELD:
+        target.pop(key, None)
+    elif isinstance(value, Sentinel):
+        # SERVER_TIMESTAMP
+        target[key] = now or datetime.now(timezone.utc)
+    elif isinstance(value, dict):
+        target[key] = {}
+        for sub_key, sub_value in value.items():
+            _assign(target[key], sub_key, sub_value, now)
+    else:
+        target[key] = copy.deepcopy(value)
+
+
+def _merge(target, data, now=None):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value, now)
+        else:
+            _assign(target, key, value, now)
+
+
+class WriteOption:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, fields=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self._fields = fields
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self._fields is None:
+            return copy.deepcopy(self._data)
+        result = {}
+        for field in self._fields:
+            value = _get_path(self._data, field)
+            if value is not _MISSING:
+                _set_path(result, field, value)
+        return result
+
+    def get(self, field_path):
+        value = _get_path(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class DocumentChange:
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class Watch:
+    """Listener de una consulta; se notifica después de cada escritura confirmada"""
+
+    def __init__(self, store, query, callback):
+        self._store = store
+        self._query = query
+        self._callback = callback
+        self._versions = {}  # ruta -> update_time del último snapshot entregado
+        self._delivered = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        with self._lock:
+            docs = self._query._results()
+            current = {doc.reference._path: doc for doc in docs}
+            changes = []
+            for path, doc in current.items():
+                previous = self._versions.get(path)
+                if previous is None:
+                    changes.append(DocumentChange(ChangeType.ADDED, doc))
+                elif previous != doc.update_time:
+                    changes.append(DocumentChange(ChangeType.MODIFIED, doc))
+            for path in self._versions:
+                if path not in current:
+                    reference = DocumentReference(self._store, path)
+                    changes.append(DocumentChange(ChangeType.REMOVED, DocumentSnapshot(reference, None)))
+            # Igual que Firestore, el primer snapshot se entrega aunque esté vacío
+            first = not self._delivered
+            self._versions = {path: doc.update_time for path, doc in current.items()}
+            self._delivered = True
+        if changes or first:
+            self._callback(docs, changes, datetime.now(timezone.utc))
+
+    def unsubscribe(self):
+        self._store._unwatch(self)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self._path = tuple(path)
+
+    @property
+    def id(self):
+        return self._path[-1]
+
+    @property
+    def path(self):
+        return '/'.join(self._path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._path[:-1])
+
+    def collection(self, name):
+        return CollectionReference(self._client, self._path + (name,))
+
+    def get(self, field_paths=None, **kwargs):
+        self._client._round_trip('document.get')
+        return self._client._snapshot(self, field_paths)
+
+    def set(self, data, merge=False, **kwargs):
+        self._client._round_trip('document.set')
+        return self._client._commit([('set', self, data, {'merge': merge})])[0]
+
+    def create(self, data, **kwargs):
+        self._client._round_trip('document.create')
+        return self._client._commit([('create', self, data, {})])[0]
+
+    def update(self, data, option=None, **kwargs):
+        self._client._round_trip('document.update')
+        return self._client._commit([('update', self, data, {'option': option})])[0]
+
+    def delete(self, option=None, **kwargs):
+        self._client._round_trip('document.delete')
+        return self._client._commit([('delete', self, None, {'option': option})])[0]
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError('on_snapshot solo está disponible para consultas')
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+
+class Query:
+    def __init__(self, client, parent_path=None, group=None, filters=(), orders=(),
+                 limit=None, start_after=None, fields=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._group = group
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        params = dict(parent_path=self._parent_path, group=self._group, filters=self._filters,
+                      orders=self._orders, limit=self._limit, start_after=self._start_after,
+                      fields=self._fields)
+        params.update(changes)
+        return Query(self._client, **params)
+
+    @property
+    def id(self):
+        return self._parent_path[-1] if self._parent_path else self._group
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        return self._copy(start_after=values)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def _matches(self, path, data):
+        if self._group is not None:
+            if len(path) < 2 or path[-2] != self._group:
+                return False
+        elif path[:-1] != self._parent_path:
+            return False
+        for field, op, expected in self._filters:
+            value = _get_path(data, field)
+            if value is _MISSING:
+                if op == '!=':
+                    continue
+                return False
+            a = _sort_key(value)
+            b = _sort_key(expected) if op not in ('in', 'not-in', 'array_contains') else None
+            if op == '==' and a != b:
+                return False
+            if op == '!=' and a == b:
+                return False
+            if op == '<' and not a < b:
+                return False
+            if op == '<=' and not a <= b:
+                return False
+            if op == '>' and not a > b:
+                return False
+            if op == '>=' and not a >= b:
+                return False
+            if op == 'in' and a not in [_sort_key(v) for v in expected]:
+                return False
+            if op == 'not-in' and a in [_sort_key(v) for v in expected]:
+                return False
+            if op == 'array_contains' and (not isinstance(value, list) or expected not in value):
+                return False
+        return True
+
+    def _order_value(self, path, data, field):
+        if field == '__name__':
+            # Dentro de una colección basta el id; en collection_group, la ruta
+            return (8, '/'.join(path) if self._group is not None else path[-1])
+        value = _get_path(data, field)
+        return _sort_key(None if value is _MISSING else value)
+
+    def _cursor_value(self, field, value):
+        if field == '__name__':
+            if isinstance(value, DocumentReference):
+                value = value.path if self._group is not None else value.id
+            return (8, value)
+        return _sort_key(value)
+
+    def _results(self):
+        orders = list(self._orders)
+        docs = [(path, entry) for path, entry in self._client._scan(self) if self._matches(path, entry['data'])]
+        # Los documentos sin el campo de orden no aparecen en la consulta
+        for field, _ in orders:
+            if field != '__name__':
+                docs = [(p, e) for p, e in docs if _get_path(e['data'], field) is not _MISSING]
+        if not any(field == '__name__' for field, _ in orders):
+            orders.append(('__name__', 'ASCENDING'))
+
+        for field, direction in reversed(orders):
+            docs.sort(key=lambda item: self._order_value(item[0], item[1]['data'], field),
+                      reverse=direction == 'DESCENDING')
+
+        if self._start_after is not None:
+            cursor = [self._cursor_value(field, self._start_after[field])
+                      for field, _ in orders if field in self._start_after]
+
+            def after(item):
+                values = [self._order_value(item[0], item[1]['data'], field)
+                          for field, _ in orders if field in self._start_after]
+                return values > cursor
+
+            docs = [item for item in docs if after(item)]
+
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        return [DocumentSnapshot(DocumentReference(self._client, path), entry['data'],
+                                 entry['create_time'], entry['update_time'], self._fields)
+                for path, entry in docs]
+
+    def stream(self, **kwargs):
+        self._client._round_trip('query.stream')
+        yield from self._results()
+
+    def get(self, **kwargs):
+        self._client._round_trip('query.get')
+        return self._results()
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, parent_path=tuple(path))
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._parent_path + (document_id or uuid.uuid4().hex[:20],))
+
+    def add(self, data, document_id=None):
+        ref = self.document(document_id)
+        ref.set(data)
+        return None, ref
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, {'merge': merge}))
+        return self
+
+    def create(self, reference, data):
+        self._writes.append(('create', reference, data, {}))
+        return self
+
+    def update(self, reference, data, option=None):
+        self._writes.append(('update', reference, data, {'option': option}))
+        return self
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, {'option': option}))
+        return self
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self, **kwargs):
+        if len(self._writes) > 500:
+            raise ValueError('Un WriteBatch admite como máximo 500 operaciones')
+        self._client._round_trip('batch.commit')
+        results = self._client._commit(self._writes)
+        self._writes = []
+        return results
+
+
+class DocumentStore:
+    """Cliente de documentos compatible con el subconjunto de Firestore del backend
+
+    Cada backend implementa:
+      _read(path)    -> entrada {'data', 'create_time', 'update_time'} o None
+      _scan(query)   -> (ruta, entrada) candidatas; la consulta vuelve a filtrar
+      _write(writes) -> aplicar un lote de forma atómica usando _resolve() y
+                        devolver su update_time
+
+    Las entradas son inmutables: _resolve() copia antes de modificar, así
+    los snapshots pueden compartir el dict guardado.
+    """
+
+    def __init__(self):
+        self._watches = []
+        self._watches_lock = threading.Lock()
+        self._clock_lock = threading.Lock()
+        self._last_time = None
+
+    # ---------------- API pública del cliente ----------------
+
+    def collection(self, name):
+        return CollectionReference(self, tuple(name.split('/')))
+
+    def document(self, path):
+        return DocumentReference(self, tuple(path.split('/')))
+
+    def collection_group(self, name):
+        return Query(self, group=name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return WriteOption(last_update_time, exists)
+
+    def get_all(self, references, field_paths=None, **kwargs):
+        references = list(references)
+        self._round_trip('get_all')
+        for reference in references:
+            yield self._snapshot(reference, field_paths)
+
+    # ---------------- a implementar por cada backend ----------------
+
+    def _read(self, path):
+        raise NotImplementedError
+
+    def _scan(self, query):
+        raise NotImplementedError
+
+    def _write(self, writes):
+        raise NotImplementedError
+
+    # ---------------- internos compartidos ----------------
+
+    def _round_trip(self, operation):
+        """Punto de enganche por cada llamada que en Firestore sería un viaje de red"""
+
+    def _now(self):
+        # Reloj monótono: dos escrituras nunca comparten update_time
+        with self._clock_lock:
+            now = datetime.now(timezone.utc)
+            if self._last_time is not None and now <= self._last_time:
+                now = self._last_time + timedelta(microseconds=1)
+            self._last_time = now
+            return now
+
+    def _snapshot(self, reference, field_paths=None):
+        entry = self._read(reference._path)
+        if entry is None:
+            return DocumentSnapshot(reference, None)
+        return DocumentSnapshot(reference, entry['data'], entry['create_time'],
+                                entry['update_time'], list(field_paths) if field_paths else None)
+
+    @staticmethod
+    def _check(kind, reference, options, entry):
+        option = options.get('option')
+        if kind == 'create' and entry is not None:
+            raise AlreadyExists(f"El documento ya existe: {reference.path}")
+        if kind == 'update' and entry is None:
+            raise NotFound(f"No existe el documento: {reference.path}")
+        if option is not None and option.last_update_time is not None:
+            if entry is None or entry['update_time'] != option.last_update_time:
+                raise FailedPrecondition(f"El documento cambió: {reference.path}")
+
+    def _resolve(self, writes, read):
+        """Validar todas las escrituras y calcular el estado final de cada documento
+
+        read(path) devuelve la entrada actual dentro de la transacción del
+        backend. Devuelve ({ruta: entrada nueva o None si se borra}, update_time).
+        """
+        initial = {}
+        for kind, reference, _, options in writes:
+            path = reference._path
+            if path not in initial:
+                initial[path] = read(path)
+            self._check(kind, reference, options, initial[path])
+
+        update_time = self._now()
+        states = dict(initial)
+        for kind, reference, data, options in writes:
+            path = reference._path
+            entry = states[path]
+            if kind == 'delete':
+                states[path] = None
+                continue
+
+            if kind in ('set', 'create'):
+                if entry is None or not options.get('merge'):
+                    document = {}
+                    for key, value in data.items():
+                        _assign(document, key, value, update_time)
+                else:
+                    document = copy.deepcopy(entry['data'])
+                    _merge(document, data, update_time)
+            else:
+                document = copy.deepcopy(entry['data'])
+                for field_path, value in data.items():
+                    _set_path(document, field_path, value, update_time)
+
+            states[path] = {
+                'data': document,
+                'create_time': entry['create_time'] if entry else update_time,
+                'update_time': update_time
+            }
+        return states, update_time
+
+    def _commit(self, writes):
+        """Aplicar las escrituras; como Firestore, un WriteResult por escritura"""
+        update_time = self._write(writes)
+        if self._watches:
+            self._notify()
+        return [WriteResult(update_time) for _ in writes]
+
+    def _watch(self, query, callback):
+        watch = Watch(self, query, callback)
+        with self._watches_lock:
+            self._watches.append(watch)
+        watch._refresh()
+        return watch
+
+    def _unwatch(self, watch):
+        with self._watches_lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _notify(self):
+        """Reevaluar las consultas escuchadas (solo ve escrituras de este proceso)"""
+        with self._watches_lock:
+            watches = list(self._watches)
+        for watch in watches:
+            watch._refresh()
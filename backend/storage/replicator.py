@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+import uuid
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from services.structured_log import get_logger
+
+log = get_logger('replicator')
+
+LEASE_NAME = 'firestore-replicator'
+
+# Último seq del outbox confirmado en Firestore por cada nodo
+MARKS_COLLECTION = 'replication_marks'
+
+# Errores con los que Firestore rechaza una operación (no la conexión)
+CONFLICT_ERRORS = (AlreadyExists, FailedPrecondition, NotFound)
+
+# Colecciones (y subcolecciones, vía collection_group) que usa el backend
+PULL_COLLECTIONS = ('users', 'lots', 'events', 'trace_codes', 'farmer_stats', 'sync_receipts')
+
+
+class FirestoreReplicator:
+    """Sube a Firestore, por lotes, las escrituras del almacén local
+
+    Se repiten las operaciones originales y no el estado local: un update
+    solo toca sus campos y los agregados llegan como Increment, así no se
+    pisan las escrituras hechas en la nube desde otros nodos. Cada lote
+    anota en replication_marks/<nodo> el último seq enviado, en la misma
+    escritura atómica: reintentar un lote que ya llegó no repite los
+    incrementos. Si Firestore rechaza un commit local (el documento se
+    borró o ya existe en la nube) gana la copia remota y se vuelve a bajar.
+
+    Si no hay conexión el outbox sigue creciendo y se reintenta con espera
+    exponencial. Un lease en SQLite garantiza un solo replicador por host
+    aunque haya varios workers.
+    """
+
+    def __init__(self, store, client_factory, batch_size=500, interval=5, max_backoff=300):
+        self.store = store
+        self.client_factory = client_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._client = None
+        self._confirmed_seq = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        self.replicated = 0
+        self.batches = 0
+        self.conflicts = 0
+        self.failures = 0
+        self.last_success_at = None
+        self.last_error = None
+
+    @property
+    def remote(self):
+        """Cliente de Firestore remoto, o None si aún no se creó"""
+        return self._client
+
+    def _firestore(self):
+        # El cliente remoto se crea al primer envío: el nodo arranca sin red
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    def replicate_once(self):
+        """Subir el siguiente lote del outbox; devuelve cuántos cambios se confirmaron"""
+        rows = self.store.pending_changes(self.batch_size - 1)
+        if not rows:
+            return 0
+
+        client = self._firestore()
+        marker = client.collection(MARKS_COLLECTION).document(self.store.node_id())
+        try:
+            if self._confirmed_seq is None:
+                snapshot = marker.get()
+                self._confirmed_seq = snapshot.to_dict().get('seq', 0) if snapshot.exists else 0
+            # Un envío anterior llegó a Firestore pero no se confirmó en local
+            done = [row for row in rows if row[0] <= self._confirmed_seq]
+            if done:
+                self.store.ack_changes(done[-1][0])
+                return len(done)
+
+            rows = self._plan(rows)
+            try:
+                self._send(client, marker, rows)
+            except CONFLICT_ERRORS:
+                # El lote es atómico: se reintenta commit a commit para
+                # descartar solo el que Firestore rechaza
+                for commit_rows in self._commits(rows):
+                    try:
+                        self._send(client, marker, commit_rows)
+                    except CONFLICT_ERRORS as e:
+                        self._discard(client, commit_rows, e)
+        except Exception:
+            # No se sabe si el lote llegó: la marca remota lo dirá
+            self._confirmed_seq = None
+            raise
+
+        with self._lock:
+            self.replicated += len(rows)
+            self.batches += 1
+            self.last_success_at = time.time()
+            self.last_error = None
+        return len(rows)
+
+    @staticmethod
+    def _commits(rows):
+        """Agrupar las entradas por commit local (son contiguas en el outbox)"""
+        commits = []
+        for row in rows:
+            if commits and row[2] is not None and commits[-1][-1][2] == row[2]:
+                commits[-1].append(row)
+            else:
+                commits.append([row])
+        return commits
+
+    def _plan(self, rows):
+        """Commits locales completos que caben en un lote (con su marca)"""
+        planned = []
+        for commit_rows in self._commits(rows):
+            if planned and len(planned) + len(commit_rows) > self.batch_size - 1:
+                break
+            planned.extend(commit_rows)
+        return planned
+
+    def _send(self, client, marker, rows):
+        """Repetir las operaciones en un WriteBatch junto con la marca del nodo"""
+        # Entradas anteriores a registrar operaciones: se sube el estado actual
+        legacy = self.store.read_many([path for _, path, _, operation in rows if operation is None])
+        batch = client.batch()
+        for _, path, _, operation in rows:
+            reference = client.document(path)
+            if operation is None:
+                entry = legacy.get(path)
+                operation = ('delete', None, False) if entry is None else ('set', entry['data'], False)
+            kind, data, merge = operation
+            if kind == 'delete':
+                batch.delete(reference)
+            elif kind == 'update':
+                batch.update(reference, data)
+            elif kind == 'create':
+                batch.create(reference, data)
+            else:
+                batch.set(reference, data, merge=merge)
+        batch.set(marker, {'seq': rows[-1][0]})
+        batch.commit()
+
+        self._confirmed_seq = rows[-1][0]
+        self.store.ack_changes(rows[-1][0])
+
+    def _discard(self, client, rows, error):
+        """Descartar un commit rechazado y bajar la versión remota de sus documentos"""
+        paths = list(dict.fromkeys(path for _, path, _, _ in rows))
+        snapshots = list(client.get_all([client.document(path) for path in paths]))
+        self.store.ack_changes(rows[-1][0])
+        self.store.import_documents([
+            (snapshot.reference.path, snapshot.to_dict() if snapshot.exists else None,
+             snapshot.create_time, snapshot.update_time)
+            for snapshot in snapshots
+        ])
+        with self._lock:
+            self.conflicts += 1
+        log.warning('Commit local rechazado por Firestore; se conserva la copia remota',
+                    paths=paths, error=str(error))
+
+    def drain(self, max_batches=None):
+        """Replicar hasta vaciar el outbox (o hasta max_batches lotes)"""
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self.replicate_once()
+            if not count:
+                break
+            total += count
+            batches += 1
+        return total
+
+    def pull(self, collections=PULL_COLLECTIONS, chunk_size=500):
+        """Copiar a local los documentos de Firestore (carga inicial de un nodo)"""
+        client = self._firestore()
+        imported = 0
+        for name in collections:
+            chunk = []
+            for snapshot in client.collection_group(name).stream():
+                chunk.append((snapshot.reference.path, snapshot.to_dict(),
+                              snapshot.create_time, snapshot.update_time))
+                if len(chunk) >= chunk_size:
+                    imported += self.store.import_documents(chunk)
+                    chunk = []
+            if chunk:
+                imported += self.store.import_documents(chunk)
+            log.info('Colección importada desde Firestore', collection=name, total=imported)
+        return imported
+
+    def start(self):
+        """Arrancar (una sola vez) el hilo de replicación"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='firestore-replicator', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def shutdown(self, timeout=10, max_batches=10):
+        """Detener el hilo y subir lo pendiente si este proceso tiene el lease
+
+        Se usa al apagar un worker y nunca tarda más de `timeout`: sin
+        conexión lo pendiente queda en el outbox y lo sube el próximo
+        replicador.
+        """
+        deadline = time.monotonic() + timeout
+        self.stop()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                log.warning('El replicador sigue ocupado al apagar', pending=self.store.pending_count())
+                return
+
+        # Un envío sin red puede quedarse reintentando: corre en su propio hilo
+        final = threading.Thread(target=self._final_drain, args=(timeout, max_batches),
+                                 name='firestore-replicator-final', daemon=True)
+        final.start()
+        final.join(max(0.0, deadline - time.monotonic()))
+        if final.is_alive():
+            log.warning('Outbox sin vaciar al apagar', pending=self.store.pending_count())
+
+    def _final_drain(self, timeout, max_batches):
+        try:
+            if self.store.acquire_lease(LEASE_NAME, self.owner, timeout + 30):
+                replicated = self.drain(max_batches=max_batches)
+                log.info('Replicador detenido', replicated=replicated, pending=self.store.pending_count())
+            self.store.release_lease(LEASE_NAME, self.owner)
+        except Exception as e:
+            log.warning('No se pudo vaciar el outbox al apagar', error=str(e))
+
+    def _run(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            wait = self.interval
+            try:
+                # El lease dura varios intervalos para tolerar una pasada lenta
+                if self.store.acquire_lease(LEASE_NAME, self.owner, self.interval * 6 + 30):
+                    count = self.replicate_once()
+                    # Con el lote lleno puede quedar más pendiente: seguir sin esperar
+                    if count >= self.batch_size:
+                        wait = 0
+                backoff = self.interval
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                    self.last_error = str(e)
+                log.warning('Error al replicar a Firestore', error=str(e), retry_in=backoff)
+                wait = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+            if wait:
+                self._stop.wait(wait)
+
+    def stats(self):
+        """Cambios pendientes, replicados y estado del último envío"""
+        with self._lock:
+            return {
+                'pending': self.store.pending_count(),
+                'replicated': self.replicated,
+                'batches': self.batches,
+                'conflicts': self.conflicts,
+                'failures': self.failures,
+                'last_success_age': round(time.time() - self.last_success_at, 1) if self.last_success_at else -1,
+                'healthy': self.last_error is None
+            }
@@ -0,0 +1,357 @@
+"""Almacén local en SQLite para nodos de cooperativa con mala conectividad
+
+Los documentos se guardan serializados con pickle; los campos por los que
+filtran las consultas del backend (farmer_uid, status, traceability_code)
+se copian a columnas indexadas para no recorrer la colección completa.
+Cada escritura se anota además, con su operación original, en una bandeja
+de salida (outbox) que el replicador sube a Firestore cuando hay conexión.
+"""
+import io
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from google.cloud.firestore_v1.transforms import DELETE_FIELD, SERVER_TIMESTAMP
+from storage.documents import DocumentStore
+from services.structured_log import get_logger
+
+log = get_logger('sqlite_store')
+
+# Campos copiados a columnas propias (solo si el valor es texto)
+INDEXED_FIELDS = ('farmer_uid', 'status', 'traceability_code')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS documents ('
+    'path TEXT PRIMARY KEY, parent TEXT NOT NULL, collection TEXT NOT NULL, data BLOB NOT NULL, '
+    'create_time INTEGER NOT NULL, update_time INTEGER NOT NULL, '
+    'farmer_uid TEXT, status TEXT, traceability_code TEXT)',
+    'CREATE INDEX IF NOT EXISTS documents_parent ON documents (parent)',
+    'CREATE INDEX IF NOT EXISTS documents_farmer ON documents (collection, farmer_uid, status)',
+    'CREATE INDEX IF NOT EXISTS documents_status ON documents (collection, status)',
+    'CREATE INDEX IF NOT EXISTS documents_trace ON documents (collection, traceability_code)',
+    'CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT NOT NULL, '
+    'commit_time INTEGER, operation BLOB)',
+    'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+)
+
+# Columnas que los archivos creados antes de replicar operaciones no tienen
+_OUTBOX_COLUMNS = (('commit_time', 'INTEGER'), ('operation', 'BLOB'))
+
+# Centinelas de Firestore: se comparan por identidad, pickle no la conserva
+_SENTINELS = {'SERVER_TIMESTAMP': SERVER_TIMESTAMP, 'DELETE_FIELD': DELETE_FIELD}
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(value):
+    # Aritmética entera: las precondiciones comparan update_time exacto
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(value):
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def _indexed(data, field):
+    value = data.get(field)
+    return value if isinstance(value, str) else None
+
+
+class _OperationPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        for name, sentinel in _SENTINELS.items():
+            if obj is sentinel:
+                return name
+        return None
+
+
+class _OperationUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return _SENTINELS[pid]
+
+
+def _dump_operation(kind, data, merge):
+    """Serializar (tipo, datos, merge) conservando Increment y los centinelas"""
+    buffer = io.BytesIO()
+    _OperationPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump((kind, data, merge))
+    return buffer.getvalue()
+
+
+def _load_operation(blob):
+    if blob is None:
+        return None
+    return _OperationUnpickler(io.BytesIO(blob)).load()
+
+
+class SQLiteStore(DocumentStore):
+    """Cliente de documentos sobre un archivo SQLite (lecturas y escrituras locales)
+
+    Varios workers del mismo host pueden compartir el archivo. Los
+    listeners on_snapshot se avisan al instante de las escrituras del
+    propio proceso; las de otros procesos (y las del replicador) se
+    detectan cada watch_interval segundos con PRAGMA data_version.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, track_changes=True, watch_interval=1.0):
+        super().__init__()
+        self.path = path
+        self.track_changes = track_changes
+        self.watch_interval = watch_interval
+        self.replicator = None
+        self._local = threading.local()
+        self._poller_pid = None
+        conn = self._conn()
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(outbox)')}
+        for column, kind in _OUTBOX_COLUMNS:
+            if column not in columns:
+                conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {kind}')
+
+    def _conn(self):
+        # Una conexión por hilo y por proceso, igual que la caché de lotes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _entry(row):
+        data, create_time, update_time = row
+        return {
+            'data': pickle.loads(data),
+            'create_time': _from_micros(create_time),
+            'update_time': _from_micros(update_time)
+        }
+
+    def _read_with(self, conn, path):
+        row = conn.execute(
+            'SELECT data, create_time, update_time FROM documents WHERE path = ?', ('/'.join(path),)
+        ).fetchone()
+        return self._entry(row) if row is not None else None
+
+    # ---------------- backend ----------------
+
+    def _read(self, path):
+        return self._read_with(self._conn(), path)
+
+    def _scan(self, query):
+        """Candidatas de la consulta usando los índices disponibles"""
+        if query._group is not None:
+            clauses, params = ['collection = ?'], [query._group]
+        else:
+            # collection primero para aprovechar los índices compuestos
+            clauses = ['collection = ?', 'parent = ?']
+            params = [query._parent_path[-1], '/'.join(query._parent_path)]
+        for field, op, value in query._filters:
+            if op == '==' and field in INDEXED_FIELDS and isinstance(value, str):
+                clauses.append(f'{field} = ?')
+                params.append(value)
+        rows = self._conn().execute(
+            'SELECT path, data, create_time, update_time FROM documents WHERE ' + ' AND '.join(clauses),
+            params
+        )
+        return [(tuple(row[0].split('/')), self._entry(row[1:])) for row in rows]
+
+    def _write(self, writes):
+        """Validar y escribir el lote en una sola transacción (con su entrada en el outbox)"""
+        conn = self._conn()
+        # IMMEDIATE toma el bloqueo de escritura antes de leer: las
+        # precondiciones se validan contra datos que nadie más puede cambiar
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            states, update_time = self._resolve(writes, lambda path: self._read_with(conn, path))
+            for path, entry in states.items():
+                key = '/'.join(path)
+                if entry is None:
+                    conn.execute('DELETE FROM documents WHERE path = ?', (key,))
+                else:
+                    data = entry['data']
+                    blob = sqlite3.Binary(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+                    conn.execute(
+                        'INSERT OR REPLACE INTO documents (path, parent, collection, data, create_time, '
+                        'update_time, farmer_uid, status, traceability_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (key, '/'.join(path[:-1]), path[-2], blob,
+                         _to_micros(entry['create_time']), _to_micros(entry['update_time']),
+                         *(_indexed(data, field) for field in INDEXED_FIELDS))
+                    )
+            if self.track_changes:
+                # Una entrada por operación: el replicador las repite tal cual
+                # (Increment, update por campo) en vez de pisar el documento remoto
+                commit_time = _to_micros(update_time)
+                for kind, reference, data, options in writes:
+                    conn.execute(
+                        'INSERT INTO outbox (path, commit_time, operation) VALUES (?, ?, ?)',
+                        ('/'.join(reference._path), commit_time,
+                         sqlite3.Binary(_dump_operation(kind, data, options.get('merge', False))))
+                    )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return update_time
+
+    # ---------------- listeners entre procesos ----------------
+
+    def _watch(self, query, callback):
+        watch = super()._watch(query, callback)
+        self._ensure_poller()
+        return watch
+
+    def _ensure_poller(self):
+        # Un hilo por proceso: después de un fork el del padre no existe
+        with self._watches_lock:
+            if self._poller_pid == os.getpid():
+                return
+            self._poller_pid = os.getpid()
+        threading.Thread(target=self._poll_changes, name='sqlite-watch', daemon=True).start()
+
+    def _poll_changes(self):
+        """Reevaluar los listeners cuando otra conexión confirma una transacción
+
+        data_version cambia con los commits de cualquier otra conexión al
+        archivo (otros workers o hilos); los del propio proceso ya se
+        notificaron y Watch solo entrega lo que cambió.
+        """
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        while True:
+            time.sleep(self.watch_interval)
+            with self._watches_lock:
+                if not self._watches:
+                    continue
+            try:
+                current = conn.execute('PRAGMA data_version').fetchone()[0]
+            except sqlite3.Error:
+                # El archivo puede estar bloqueado un momento: se reintenta
+                continue
+            if current == version:
+                continue
+            version = current
+            try:
+                self._notify()
+            except Exception as e:
+                log.warning('Error al notificar listeners', error=str(e))
+
+    # ---------------- outbox para el replicador ----------------
+
+    def pending_changes(self, limit):
+        """Primeras entradas del outbox en orden de escritura
+
+        Devuelve [(seq, ruta, commit, (tipo, datos, merge) o None)]; las
+        entradas de un mismo commit local comparten commit y nunca se
+        cortan: si el límite cae dentro de un commit se incluye completo.
+        None es una entrada anterior a registrar operaciones.
+        """
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT seq, path, commit_time, operation FROM outbox ORDER BY seq LIMIT ?', (limit,)
+        ).fetchall()
+        if len(rows) == limit and rows[-1][2] is not None:
+            rows += conn.execute(
+                'SELECT seq, path, commit_time, operation FROM outbox WHERE seq > ? AND commit_time = ? '
+                'ORDER BY seq', (rows[-1][0], rows[-1][2])
+            ).fetchall()
+        return [(seq, path, commit, _load_operation(operation)) for seq, path, commit, operation in rows]
+
+    def read_many(self, paths):
+        """Estado actual de varias rutas: {ruta: entrada o None}"""
+        conn = self._conn()
+        return {path: self._read_with(conn, tuple(path.split('/'))) for path in paths}
+
+    def ack_changes(self, last_seq):
+        """Olvidar las entradas del outbox ya replicadas"""
+        self._conn().execute('DELETE FROM outbox WHERE seq <= ?', (last_seq,))
+
+    def import_documents(self, documents):
+        """Cargar documentos remotos [(ruta, data, create_time, update_time)] sin pasar por el outbox
+
+        data None borra la copia local (el documento ya no existe en la
+        nube). Se saltan los documentos con cambios locales pendientes de
+        subir: la copia local es más nueva que la remota.
+        """
+        conn = self._conn()
+        imported = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            pending = {row[0] for row in conn.execute('SELECT DISTINCT path FROM outbox')}
+            for key, data, create_time, update_time in documents:
+                if key in pending:
+                    continue
+                if data is None:
+                    conn.execute('DELETE FROM documents WHERE path = ?', (key,))
+                    imported += 1
+                    continue
+                path = key.split('/')
+                conn.execute(
+                    'INSERT OR REPLACE INTO documents (path, parent, collection, data, create_time, '
+                    'update_time, farmer_uid, status, traceability_code) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, '/'.join(path[:-1]), path[-2],
+                     sqlite3.Binary(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)),
+                     _to_micros(create_time), _to_micros(update_time),
+                     *(_indexed(data, field) for field in INDEXED_FIELDS))
+                )
+                imported += 1
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return imported
+
+    def pending_count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def node_id(self):
+        """Identificador estable de este archivo (lo comparten todos sus workers)"""
+        conn = self._conn()
+        conn.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', ('node_id', uuid.uuid4().hex))
+        return conn.execute("SELECT value FROM meta WHERE key = 'node_id'").fetchone()[0]
+
+    def acquire_lease(self, name, owner, ttl):
+        """Tomar o renovar un lease entre procesos; True si owner lo tiene"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            'INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+            'WHERE leases.owner = excluded.owner OR leases.expires_at < ?',
+            (name, owner, now + ttl, now)
+        )
+        row = conn.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name, owner):
+        """Soltar un lease para que otro proceso lo tome sin esperar a que expire"""
+        self._conn().execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def document_count(self, collection=None):
+        if collection is None:
+            return self._conn().execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM documents WHERE collection = ?', (collection,)
+        ).fetchone()[0]
+
+    def stats(self):
+        """Tamaño del almacén local y cambios pendientes de replicar"""
+        return {
+            'backend': self.name,
+            'documents': self.document_count(),
+            'pending_changes': self.pending_count() if self.track_changes else 0
+        }
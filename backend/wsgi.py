@@ -0,0 +1,14 @@
+"""Punto de entrada WSGI
+
+Uso (desde backend/):
+    gunicorn wsgi:app
+    gunicorn --preload wsgi:app   # importaciones y warmup una sola vez, antes del fork
+
+Con --preload el proceso maestro paga aquí las importaciones pesadas, la
+lectura de credenciales y la carga de qrcode/Pillow, y los workers las
+heredan ya hechas. Los clientes de red se siguen creando en cada worker.
+"""
+from app import create_app, warmup
+
+app = create_app()
+warmup()
@@ -75,7 +75,7 @@ class LotsService {
         price: data.price,
         currency: data.currency,
         status: backendLot.status,
-        qrCode: backendLot.qr_code,
+        qrCode: `${API_URL}/lots/${backendLot.id}/qr`,
         createdAt: backendLot.created_at,
         sustainabilityMetrics: data.sustainabilityMetrics || {
           carbonSaved: 0,
@@ -95,20 +95,35 @@ class LotsService {
 
   async getLots(): Promise<Lot[]> {
     try {
-      const response = await fetch(`${API_URL}/lots`, {
-        headers: {
-          'Authorization': `Bearer ${this.getAuthToken()}`,
-        },
-      });
+      // Recorrer las páginas sin pedir el historial de eventos
+      const fields = 'farmer_uid,crop_type,quantity,unit,harvest_date,location,price,status,traceability_code,created_at';
+      const backendLots: any[] = [];
+      let cursor: string | null = null;
 
-      const result = await response.json();
+      do {
+        const params = new URLSearchParams({ fields });
+        if (cursor) {
+          params.set('cursor', cursor);
+        }
 
-      if (!response.ok) {
-        throw new Error(result.error || 'Error al obtener lotes');
-      }
+        const response = await fetch(`${API_URL}/lots?${params.toString()}`, {
+          headers: {
+            'Authorization': `Bearer ${this.getAuthToken()}`,
+          },
+        });
+
+        const result = await response.json();
+
+        if (!response.ok) {
+          throw new Error(result.error || 'Error al obtener lotes');
+        }
+
+        backendLots.push(...result.lots);
+        cursor = result.next_cursor;
+      } while (cursor);
 
       // Transformar lotes del backend al formato del frontend
-      return result.lots.map((backendLot: any) => ({
+      return backendLots.map((backendLot: any) => ({
         id: backendLot.id,
         farmerId: backendLot.farmer_uid,
         farmerName: 'Agricultor', // Puedes obtener esto de otro lugar
@@ -121,7 +136,7 @@ class LotsService {
         price: backendLot.price,
         currency: 'COP',
         status: backendLot.status,
-        qrCode: backendLot.qr_code,
+        qrCode: `${API_URL}/lots/${backendLot.id}/qr`,
         traceabilityCode: backendLot.traceability_code,
         createdAt: backendLot.created_at,
         sustainabilityMetrics: {
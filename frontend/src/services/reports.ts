@@ -1,17 +1,33 @@
 import { SustainabilityImpact } from '../types';
 
+const API_URL = 'http://127.0.0.1:5000/api';
+
 export const reportsService = {
   async getSustainabilityImpact(userId: string): Promise<SustainabilityImpact> {
-    return new Promise((resolve) => {
-      setTimeout(() => {
-        resolve({
-          totalCarbonSaved: 234.8,
-          totalEmissionsReduced: 156.3,
-          totalWaterSaved: 1240,
-          lotsCreated: 12,
-          revenue: 15680.50,
-        });
-      }, 800);
+    const token = localStorage.getItem('agrotraceToken');
+    if (!token) {
+      throw new Error('No authentication token found');
+    }
+
+    // El backend mantiene los agregados por agricultor (userId sale del token)
+    const response = await fetch(`${API_URL}/reports/sustainability`, {
+      headers: {
+        'Authorization': `Bearer ${token}`,
+      },
     });
+
+    const result = await response.json();
+
+    if (!response.ok) {
+      throw new Error(result.error || `Error al obtener reporte de ${userId}`);
+    }
+
+    return {
+      totalCarbonSaved: result.total_carbon_saved,
+      totalEmissionsReduced: result.total_emissions_reduced,
+      totalWaterSaved: result.total_water_saved,
+      lotsCreated: result.lots_created,
+      revenue: result.revenue,
+    };
   },
-};
\ No newline at end of file
+};
@@ -0,0 +1,32 @@
+"""Pruebas del backend contra el Firestore en memoria de los benchmarks
+
+firebase_config se sustituye antes de importar cualquier servicio, igual
+que en benchmarks/run.py: ninguna prueba necesita credenciales ni red.
+"""
+import os
+import sys
+
+BACKEND = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+sys.path.insert(0, BACKEND)
+
+from benchmarks import run  # noqa: E402
+
+run.configure_environment()
+_fake = run.install_fake_firestore()
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def fake():
+    """Firestore en memoria vacío para cada prueba"""
+    with _fake._lock:
+        _fake._docs.clear()
+    _fake.reset_calls()
+    return _fake
+
+
+@pytest.fixture
+def farmer_uid(request):
+    # Un agricultor por prueba: las cachés por agricultor no se cruzan
+    return f"farmer-{request.node.name}"
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import asgi
+from config import Config
+from services.lot_service_async import AsyncLotService
+from services.qr_worker import qr_renderer
+from services.token_cache import token_cache
+
+
+def request(method, path, chunks=(), headers=()):
+    """Ejecutar una petición contra la app ASGI; devuelve (status, cuerpo, fragmentos leídos)"""
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+                for index, chunk in enumerate(chunks)] or [{'type': 'http.request', 'body': b''}]
+    received = []
+    sent = []
+
+    async def receive():
+        if len(received) < len(messages):
+            received.append(messages[len(received)])
+            return received[-1]
+        # El cliente sigue conectado
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(name.encode(), value.encode()) for name, value in headers]}
+    asyncio.run(asgi.app(scope, receive, send))
+    body = b''.join(message.get('body', b'') for message in sent if message['type'] == 'http.response.body')
+    return sent[0]['status'], body, len(received)
+
+
+def test_flask_routes_read_the_body_as_a_stream(fake, farmer_uid, monkeypatch):
+    monkeypatch.setattr(token_cache, 'verify', lambda token: {'uid': farmer_uid})
+    items = [{'type': 'lot_creation', 'offline_id': f'o-{i}', 'timestamp': '2024-06-01T00:00:00Z',
+              'data': {'crop_type': 'cafe', 'quantity': 1}} for i in range(3)]
+    # Sin Content-Length (chunked) y con líneas partidas entre fragmentos
+    body = b''.join(json.dumps(item).encode() + b'\n' for item in items)
+    chunks = [body[start:start + 7] for start in range(0, len(body), 7)]
+
+    status, response, _ = request('POST', '/api/sync/stream', chunks,
+                                  [('authorization', 'Bearer t'), ('content-type', 'application/x-ndjson')])
+
+    lines = [json.loads(line) for line in response.splitlines()]
+    assert status == 200
+    assert lines[-1] == {'synced': 3, 'failed': 0, 'conflicts': 0, 'done': True}
+
+
+def test_flask_routes_do_not_buffer_unread_bodies(fake):
+    # Sin token Flask responde 401 sin leer el cuerpo
+    status, _, received = request('POST', '/api/sync/stream', [b'x' * 1024] * 50)
+
+    assert status == 401
+    assert received < 50
+
+
+def test_async_routes_cap_the_body(fake, monkeypatch):
+    monkeypatch.setattr(Config, 'ASGI_MAX_BODY_BYTES', 10)
+
+    declared = request('POST', '/api/sync', [b'{}'], [('content-length', '11')])
+    streamed = request('POST', '/api/sync', [b'[1, 2, ', b'3, 4, 5]'])
+
+    assert declared[0] == streamed[0] == 413
+    assert b'10 bytes' in streamed[1]
+
+
+def test_overview_is_served_in_both_modes(fake, farmer_uid, monkeypatch):
+    monkeypatch.setattr(token_cache, 'verify', lambda token: {'uid': farmer_uid})
+    fake.collection('users').document(farmer_uid).set({'uid': farmer_uid, 'email': 'ana@example.com'})
+    headers = [('authorization', 'Bearer t')]
+
+    status, body, _ = request('GET', '/api/overview', headers=headers)
+    flask_response = asgi.flask_app.test_client().get('/api/overview', headers=dict(headers))
+
+    assert status == flask_response.status_code == 200
+    assert json.loads(body) == flask_response.get_json()
+    assert json.loads(body)['user']['email'] == 'ana@example.com'
+
+
+def test_unhandled_errors_answer_json_500(fake, farmer_uid, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError('fallo inesperado')
+
+    monkeypatch.setattr(token_cache, 'verify', lambda token: {'uid': farmer_uid})
+    monkeypatch.setattr(AsyncLotService, 'get_farmer_lots', broken)
+
+    status, body, _ = request('GET', '/api/lots', headers=[('authorization', 'Bearer t'), ('origin', 'http://x')])
+
+    assert status == 500
+    assert json.loads(body) == {'error': 'Error interno del servidor'}
+
+
+def test_async_bulk_import_renders_in_thread_when_the_pool_fails(fake, farmer_uid, monkeypatch):
+    async def unavailable(payloads):
+        raise RuntimeError('Pool de renderizado no disponible')
+
+    monkeypatch.setattr(token_cache, 'verify', lambda token: {'uid': farmer_uid})
+    monkeypatch.setattr(qr_renderer, 'render_many_async', unavailable)
+    rows = json.dumps([{'crop_type': 'cafe', 'quantity': 1}, {'crop_type': 'cacao', 'quantity': 2}]).encode()
+
+    status, body, _ = request('POST', '/api/lots/bulk', [rows],
+                              [('authorization', 'Bearer t'), ('content-type', 'application/json')])
+
+    assert status == 201
+    assert json.loads(body)['created'] == 2
+    assert fake.document_count('lots') == 2
@@ -0,0 +1,113 @@
+from models.lot import Lot
+from services.lot_cache import LotCache, MemoryBackend, SQLiteBackend, lot_cache
+from services.lot_service import LotService
+
+
+def counting_loader(value):
+    calls = []
+
+    def load():
+        calls.append(1)
+        return value
+    return load, calls
+
+
+def test_get_or_load_caches_copies():
+    cache = LotCache(MemoryBackend(), ttl=30)
+    load, calls = counting_loader({'quantity': 1})
+
+    first = cache.get_or_load('lot:a', load)
+    first['quantity'] = 99
+    second = cache.get_or_load('lot:a', load)
+
+    assert len(calls) == 1
+    # Mutar lo leído no cambia la caché
+    assert second == {'quantity': 1}
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_none_is_not_cached():
+    cache = LotCache(MemoryBackend(), ttl=30)
+    load, calls = counting_loader(None)
+
+    cache.get_or_load('lot:missing', load)
+    cache.get_or_load('lot:missing', load)
+
+    assert len(calls) == 2
+
+
+def test_invalidate_lot_forgets_entry():
+    cache = LotCache(MemoryBackend(), ttl=30)
+    cache.get_or_load(cache.lot_key('a'), lambda: {'v': 1})
+
+    cache.invalidate_lot('a')
+
+    assert cache.get_or_load(cache.lot_key('a'), lambda: {'v': 2}) == {'v': 2}
+
+
+def test_invalidate_farmer_bumps_generation():
+    cache = LotCache(MemoryBackend(), ttl=30)
+    key = cache.farmer_key('f1', 'active', 50)
+    cache.get_or_load(key, lambda: ['viejo'])
+
+    cache.invalidate(lot_ids=['a', 'a'], farmer_uids=['f1'])
+
+    new_key = cache.farmer_key('f1', 'active', 50)
+    assert new_key != key
+    assert cache.get_or_load(new_key, lambda: ['nuevo']) == ['nuevo']
+    # Otro agricultor conserva sus páginas
+    assert cache.farmer_key('f2', 'active', 50) == LotCache(cache.backend).farmer_key('f2', 'active', 50)
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_expired_generation_never_revives_old_pages():
+    cache = LotCache(MemoryBackend(), ttl=30)
+    cache.invalidate_farmer('f1')
+    cache.get_or_load(cache.farmer_key('f1', 'active', 50), lambda: ['viejo'])
+
+    # La clave de generación expira antes que las páginas que dejó atrás
+    cache.backend.delete('gen:f1')
+    cache.invalidate_farmer('f1')
+
+    assert cache.get_or_load(cache.farmer_key('f1', 'active', 50), lambda: ['nuevo']) == ['nuevo']
+
+
+def test_disabled_cache_always_loads():
+    cache = LotCache(None)
+    load, calls = counting_loader({'v': 1})
+
+    cache.get_or_load('lot:a', load)
+    cache.get_or_load('lot:a', load)
+    cache.invalidate(lot_ids=['a'], farmer_uids=['f'])
+
+    assert len(calls) == 2
+    assert cache.stats()['backend'] == 'none'
+
+
+def test_sqlite_backend_shares_invalidations_between_workers(tmp_path):
+    path = str(tmp_path / 'lots.sqlite3')
+    worker_a = LotCache(SQLiteBackend(path), ttl=30)
+    worker_b = LotCache(SQLiteBackend(path), ttl=30)
+
+    worker_a.get_or_load('lot:a', lambda: {'v': 1})
+    assert worker_b.get_or_load('lot:a', lambda: {'v': 'no se usa'}) == {'v': 1}
+
+    worker_b.invalidate(lot_ids=['a'], farmer_uids=['f1'])
+
+    assert worker_a.get_or_load('lot:a', lambda: {'v': 2}) == {'v': 2}
+    assert worker_a.farmer_key('f1') == worker_b.farmer_key('f1')
+
+
+def test_lot_writes_invalidate_cached_reads(fake, farmer_uid):
+    result, _ = LotService.create_lot(farmer_uid, {'crop_type': 'cafe', 'quantity': 10})
+    lot_id = result['lot']['id']
+    assert Lot.get_by_id(lot_id)['quantity'] == 10
+    assert [lot['id'] for lot in Lot.get_by_farmer(farmer_uid)] == [lot_id]
+    assert lot_cache.backend.get(lot_cache.lot_key(lot_id)) is not None
+
+    assert LotService.update_lot(lot_id, farmer_uid, {'quantity': 42})[1] == 200
+    assert Lot.get_by_id(lot_id)['quantity'] == 42
+
+    assert LotService.delete_lot(lot_id, farmer_uid)[1] == 200
+    assert Lot.get_by_id(lot_id)['status'] == 'deleted'
+    assert Lot.get_by_farmer(farmer_uid) == []
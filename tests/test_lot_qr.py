@@ -0,0 +1,69 @@
+import base64
+
+import pytest
+
+import models.lot as lot_module
+from models.lot import Lot
+from services.lot_service import LotService
+from services.qr_store import QRStore
+
+
+@pytest.fixture
+def lot_id(fake, farmer_uid):
+    result, status_code = LotService.create_lot(farmer_uid, {'crop_type': 'cafe', 'quantity': 10})
+    assert status_code == 201, result
+    return result['lot']['id']
+
+
+def stored(fake, lot_id):
+    return fake.collection('lots').document(lot_id).get()
+
+
+def test_get_qr_serves_the_stored_image(lot_id):
+    qr_ref, image = Lot.get_qr(lot_id)
+
+    assert qr_ref == Lot.get_by_id(lot_id)['qr_ref']
+    assert image.startswith(b'\x89PNG')
+
+
+def test_get_qr_of_deleted_lot_is_not_found(lot_id, farmer_uid):
+    assert LotService.delete_lot(lot_id, farmer_uid)[1] == 200
+
+    assert Lot.get_qr(lot_id) == (None, None)
+
+
+def test_get_qr_never_writes_the_lot(fake, lot_id, tmp_path, monkeypatch):
+    # Otro disco: la imagen no está en este QRStore
+    monkeypatch.setattr(lot_module, 'qr_store', QRStore(str(tmp_path)))
+    before = stored(fake, lot_id).update_time
+
+    assert Lot.get_qr(lot_id) == (None, None)
+    assert stored(fake, lot_id).update_time == before
+
+
+def test_legacy_embedded_qr_is_served_read_only(fake, lot_id):
+    image = b'\x89PNG legado'
+    fake.collection('lots').document(lot_id).update({'qr_ref': None, 'qr_code': base64.b64encode(image).decode()})
+    lot_module.lot_cache.invalidate_lot(lot_id)
+    before = stored(fake, lot_id).update_time
+
+    assert Lot.get_qr(lot_id) == (QRStore.ref_of(image), image)
+    assert stored(fake, lot_id).update_time == before
+
+
+def test_repair_qr_migrates_and_rerenders(fake, lot_id, farmer_uid, tmp_path, monkeypatch):
+    legacy = LotService.create_lot(farmer_uid, {'crop_type': 'cacao', 'quantity': 1})[0]['lot']['id']
+    fake.collection('lots').document(legacy).update({
+        'qr_ref': None, 'qr_status': None, 'qr_code': base64.b64encode(b'\x89PNG legado').decode()})
+    monkeypatch.setattr(lot_module, 'qr_store', QRStore(str(tmp_path)))
+    updated_at = stored(fake, lot_id).to_dict()['updated_at']
+
+    assert Lot.repair_qr() == {'migrated': 1, 'rendered': 1, 'failed': 0}
+
+    migrated = stored(fake, legacy).to_dict()
+    assert 'qr_code' not in migrated and migrated['qr_status'] == 'ready'
+    assert Lot.get_qr(legacy) == (migrated['qr_ref'], b'\x89PNG legado')
+    # Misma imagen en otro disco: el lote no cambia para el cliente
+    assert Lot.get_qr(lot_id)[1] is not None
+    assert stored(fake, lot_id).to_dict()['updated_at'] == updated_at
+    assert Lot.repair_qr() == {'migrated': 0, 'rendered': 0, 'failed': 0}
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+from services.lot_service import LotService
+from services.offline_sync import OfflineSyncService
+
+
+# ===================== PLAN DE BATCHES =====================
+
+def write(index, size, stats_op=True):
+    operations = [('set', None, {}) for _ in range(size)]
+    if stats_op:
+        operations.append(('stats', None, {}))
+    return (index, operations, 'synced', {})
+
+
+def test_plan_batches_never_splits_an_item(monkeypatch):
+    monkeypatch.setattr(Config, 'FIRESTORE_BATCH_LIMIT', 10)
+    writes = [write(i, 3) for i in range(7)]
+
+    batches = list(OfflineSyncService._plan_batches(writes))
+
+    assert [item for batch in batches for item in batch] == writes
+    for batch in batches:
+        # Se reserva una operación por bloque para el delta de agregados
+        assert sum(len(item[1]) - 1 for item in batch) <= Config.FIRESTORE_BATCH_LIMIT - 1
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_plan_batches_keeps_oversized_item_alone(monkeypatch):
+    monkeypatch.setattr(Config, 'FIRESTORE_BATCH_LIMIT', 4)
+    writes = [write(0, 1), write(1, 6), write(2, 1)]
+
+    assert [len(batch) for batch in OfflineSyncService._plan_batches(writes)] == [1, 1, 1]
+
+
+def test_plan_batches_empty():
+    assert list(OfflineSyncService._plan_batches([])) == []
+
+
+# ===================== DEDUPLICACIÓN =====================
+
+def test_dedupe_marks_repeated_offline_ids(fake):
+    items = [
+        {'type': 'lot_creation', 'offline_id': 'a'},
+        {'type': 'lot_update', 'offline_id': 'b'},
+        {'type': 'lot_creation', 'offline_id': 'a'},
+        {'type': 'lot_deletion'},
+    ]
+    outcomes = [None] * len(items)
+
+    refs, first_index = OfflineSyncService._dedupe('farmer', items, outcomes)
+
+    assert set(refs) == {'a', 'b'}
+    assert first_index == {'a': 0, 'b': 1}
+    assert outcomes[0] is None and outcomes[1] is None and outcomes[3] is None
+    assert outcomes[2] == ('synced', {'type': 'lot_creation', 'offline_id': 'a', 'duplicate': True})
+    # El recibo depende del agricultor: otro agricultor no ve los mismos ids
+    other, _ = OfflineSyncService._dedupe('otro', items, [None] * len(items))
+    assert other['a'].id != refs['a'].id
+
+
+def test_retried_item_is_answered_from_its_receipt(fake, farmer_uid):
+    item = {'type': 'lot_creation', 'offline_id': 'o-1', 'timestamp': '2024-06-01T00:00:00Z',
+            'data': {'crop_type': 'cafe', 'quantity': 5}}
+
+    (bucket, first), = OfflineSyncService.process_chunk(farmer_uid, [item])
+    (again_bucket, again), = OfflineSyncService.process_chunk(farmer_uid, [item])
+
+    assert bucket == again_bucket == 'synced'
+    assert again['duplicate'] is True
+    assert again['id'] == first['id']
+    assert fake.document_count('lots') == 1
+
+
+def test_retried_partial_merge_is_still_a_conflict(fake, farmer_uid):
+    lot_id = LotService.create_lot(farmer_uid, {'crop_type': 'cafe', 'quantity': 10})[0]['lot']['id']
+    client_time = datetime.now(timezone.utc) + timedelta(hours=1)
+    # El servidor cambió quantity después de la edición offline del cliente
+    fake.collection('lots').document(lot_id).update({
+        'quantity': 30, 'field_versions.quantity': client_time + timedelta(hours=1)})
+    item = {'type': 'lot_update', 'offline_id': 'o-2', 'lot_id': lot_id, 'timestamp': client_time.isoformat(),
+            'data': {'quantity': 1, 'unit': 't'}}
+
+    (bucket, first), = OfflineSyncService.process_chunk(farmer_uid, [item])
+    (again_bucket, again), = OfflineSyncService.process_chunk(farmer_uid, [item])
+
+    assert bucket == again_bucket == 'conflicts'
+    assert again['duplicate'] is True
+    assert again['applied_fields'] == first['applied_fields'] == ['unit']
+    assert set(again['conflicting_fields']) == {'quantity'}
@@ -0,0 +1,159 @@
+import csv
+
+import pytest
+from firebase_admin import auth
+
+import services.onboarding_service as onboarding
+from config import Config
+from models.user import User
+from services.onboarding_service import OnboardingService
+
+
+class FakeAuth:
+    """import_users/get_users sobre un dict uid -> email (como Firebase Auth)"""
+
+    def __init__(self, accounts=None):
+        self.accounts = dict(accounts or {})
+        self.imported = []
+        self.crash_after = None
+
+    def get_users(self, identifiers):
+        assert len(identifiers) <= 100
+        uids = {getattr(i, 'uid', None) for i in identifiers}
+        emails = {getattr(i, 'email', None) for i in identifiers}
+        users = [auth.UserRecord({'localId': uid, 'email': email}) for uid, email in self.accounts.items()
+                 if uid in uids or email in emails]
+        return auth.GetUsersResult(users, [])
+
+    def import_users(self, records, hash_alg=None):
+        for record in records:
+            self.accounts[record.uid] = record.email
+        self.imported.append([record.email for record in records])
+        if self.crash_after is not None and len(self.imported) >= self.crash_after:
+            raise KeyboardInterrupt
+        return auth.UserImportResult({'error': []}, len(records))
+
+
+@pytest.fixture
+def fake_auth(monkeypatch):
+    fake = FakeAuth()
+    monkeypatch.setattr(auth, 'get_users', fake.get_users)
+    monkeypatch.setattr(auth, 'import_users', fake.import_users)
+    monkeypatch.setattr(Config, 'ONBOARDING_HASH_ROUNDS', 1000)
+    monkeypatch.setattr(onboarding, 'IMPORT_CHUNK_SIZE', 2)
+    return fake
+
+
+def row(email, password='secreto1', **extra):
+    return dict(extra, email=email, password=password)
+
+
+def read_results(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+# ===================== VALIDACIÓN =====================
+
+def test_validate_rows_normalizes_and_rejects():
+    rows = [
+        row(' Ana@Example.com '),
+        row('no-es-email'),
+        row('ana@example.com'),
+        row('beto@example.com', password='123'),
+        {'email': 'carla@example.com'},
+        'fila suelta',
+        row('dario@example.com'),
+    ]
+
+    pending, results = OnboardingService.validate_rows(rows, {'dario@example.com': 'uid-dario'})
+
+    assert [(index, email) for index, email, _ in pending] == [(0, 'ana@example.com')]
+    by_row = {entry['row']: entry for entry in results}
+    assert by_row[1]['status'] == 'invalid' and 'Email inválido' in by_row[1]['error']
+    assert by_row[2]['error'].startswith('Email repetido')
+    assert by_row[3]['status'] == 'invalid'
+    assert 'La contraseña es obligatoria' in by_row[4]['error']
+    assert by_row[5]['error'].startswith('Fila inválida')
+    assert by_row[6] == {'row': 6, 'email': 'dario@example.com', 'status': 'skipped', 'uid': 'uid-dario'}
+
+
+def test_uid_is_stable_per_email():
+    assert OnboardingService.uid_for('ana@example.com') == OnboardingService.uid_for('ana@example.com')
+    assert OnboardingService.uid_for('ana@example.com') != OnboardingService.uid_for('beto@example.com')
+    assert len(OnboardingService.uid_for('ana@example.com')) == 28
+
+
+@pytest.mark.parametrize('job, valid', [('lote-2024_01', True), ('../x', False), ('', False), (None, False)])
+def test_valid_job(job, valid):
+    assert OnboardingService.valid_job(job) is valid
+
+
+# ===================== IMPORTACIÓN =====================
+
+def test_import_farmers_creates_accounts_and_profiles(fake, fake_auth, tmp_path):
+    path = str(tmp_path / 'job.csv')
+    rows = [row(f'f{i}@example.com', name=f'Agricultor {i}', farm_name='La Loma') for i in range(3)]
+
+    result, status_code = OnboardingService.import_farmers(rows + [row('malo')], path)
+
+    assert status_code == 207
+    assert (result['created'], result['skipped'], result['failed']) == (3, 0, 1)
+    assert fake_auth.imported == [['f0@example.com', 'f1@example.com'], ['f2@example.com']]
+    profile = User.get_by_uid(OnboardingService.uid_for('f1@example.com'))
+    assert profile['farm_name'] == 'La Loma'
+    assert OnboardingService.load_results(path)[0] == {
+        f'f{i}@example.com': OnboardingService.uid_for(f'f{i}@example.com') for i in range(3)}
+
+
+def test_import_farmers_skips_existing_accounts(fake, fake_auth, tmp_path):
+    taken = OnboardingService.uid_for('mismo-uid@example.com')
+    fake_auth.accounts = {'uid-aleatorio': 'registrado@example.com', taken: 'mismo-uid@example.com'}
+    rows = [row('registrado@example.com'), row('mismo-uid@example.com'), row('nuevo@example.com')]
+
+    result, status_code = OnboardingService.import_farmers(rows, str(tmp_path / 'job.csv'))
+
+    assert status_code == 201
+    assert (result['created'], result['skipped']) == (1, 2)
+    assert fake_auth.imported == [['nuevo@example.com']]
+    assert {entry['email']: entry['status'] for entry in result['results']} == {
+        'registrado@example.com': 'skipped', 'mismo-uid@example.com': 'skipped', 'nuevo@example.com': 'created'}
+
+
+def test_import_farmers_resumes_after_interruption(fake, fake_auth, tmp_path):
+    path = str(tmp_path / 'job.csv')
+    rows = [row(f'f{i}@example.com') for i in range(5)]
+    fake_auth.crash_after = 2
+
+    with pytest.raises(KeyboardInterrupt):
+        OnboardingService.import_farmers(rows, path)
+
+    # El segundo bloque creó las cuentas pero no llegó a registrarlas
+    statuses = {(entry['email'], entry['status']) for entry in read_results(path)}
+    assert ('f2@example.com', 'importing') in statuses
+    assert ('f2@example.com', 'created') not in statuses
+
+    fake_auth.crash_after = None
+    fake_auth.imported.clear()
+    result, status_code = OnboardingService.import_farmers(rows, path)
+
+    assert status_code == 201
+    assert (result['created'], result['skipped'], result['failed']) == (3, 2, 0)
+    # Las cuentas que este trabajo dejó a medias se reimportan; las creadas se saltan
+    assert fake_auth.imported == [['f2@example.com', 'f3@example.com'], ['f4@example.com']]
+
+
+def test_import_farmers_reports_lookup_failure(fake, fake_auth, tmp_path, monkeypatch):
+    def unavailable(identifiers):
+        raise RuntimeError('Auth no disponible')
+
+    monkeypatch.setattr(auth, 'get_users', unavailable)
+    result, status_code = OnboardingService.import_farmers([row('a@example.com')], str(tmp_path / 'job.csv'))
+
+    assert status_code == 400
+    assert result['results'][0]['status'] == 'error'
+    assert fake_auth.imported == []
+
+
+def test_import_farmers_requires_rows(tmp_path):
+    assert OnboardingService.import_farmers([], str(tmp_path / 'job.csv'))[1] == 400
@@ -0,0 +1,30 @@
+from services.qr_payload import compact_payload, parse_token, sign_code
+
+
+def test_sign_code_is_deterministic_base32():
+    signature = sign_code('BT-20240101-ABCD', secret='s3cret')
+    assert signature == sign_code('BT-20240101-ABCD', secret='s3cret')
+    assert len(signature) == 16
+    assert signature.isupper()
+    assert signature != sign_code('BT-20240101-ABCD', secret='otro')
+
+
+def test_parse_token_accepts_valid_signature_in_any_case():
+    signature = sign_code('BT-1', secret='s3cret')
+    assert parse_token(f'BT-1.{signature}', secret='s3cret') == ('BT-1', True)
+    assert parse_token(f'BT-1.{signature.lower()}', secret='s3cret') == ('BT-1', True)
+
+
+def test_parse_token_without_signature_is_unverified():
+    assert parse_token('BT-1', secret='s3cret') == ('BT-1', False)
+
+
+def test_parse_token_rejects_wrong_signature():
+    assert parse_token('BT-1.AAAAAAAAAAAAAAAA', secret='s3cret') == (None, False)
+    assert parse_token(f"BT-2.{sign_code('BT-1', secret='s3cret')}", secret='s3cret') == (None, False)
+
+
+def test_compact_payload_round_trips_through_parse_token():
+    payload = compact_payload('BT-1', signed=True, url='https://biotrazo.example/trace', secret='s3cret')
+    assert payload.startswith('HTTPS://BIOTRAZO.EXAMPLE/trace/T/')
+    assert parse_token(payload.rsplit('/', 1)[1], secret='s3cret') == ('BT-1', True)
@@ -0,0 +1,36 @@
+import os
+
+from models.lot import Lot
+from services.lot_service import LotService
+from services.qr_worker import QRRenderer, qr_renderer
+
+
+def test_broken_pool_is_replaced():
+    renderer = QRRenderer(mode='process', max_workers=1)
+    try:
+        # Un proceso de renderizado que muere deja el pool roto
+        renderer._submit(os._exit, 1).exception()
+        broken = renderer._pool
+
+        images = renderer.render_many(['a', 'b'])
+
+        assert renderer._pool is not broken
+        assert images == [renderer.render('a'), renderer.render('b')]
+        assert renderer._submit(renderer._render, 'c').result() == renderer.render('c')
+    finally:
+        renderer.shutdown()
+
+
+def test_lot_is_created_when_its_qr_cannot_be_queued(fake, farmer_uid, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError('Pool de renderizado no disponible')
+
+    monkeypatch.setattr(qr_renderer, 'mode', 'process')
+    monkeypatch.setattr(qr_renderer, 'submit_reserved', unavailable)
+
+    result, status_code = LotService.create_lot(farmer_uid, {'crop_type': 'cafe', 'quantity': 10})
+
+    assert status_code == 201
+    stored = Lot.get_by_id(result['lot']['id'])
+    assert stored['qr_status'] == 'ready' and stored['qr_ref']
+    assert fake.document_count('lots') == 1
@@ -0,0 +1,79 @@
+import pytest
+from firebase_admin import firestore
+
+from benchmarks.fake_firestore import FakeFirestore
+from storage.replicator import FirestoreReplicator
+from storage.sqlite_store import SQLiteStore
+
+
+@pytest.fixture
+def nodes(tmp_path):
+    remote = FakeFirestore()
+    local = SQLiteStore(str(tmp_path / 'nodo.sqlite3'))
+    return local, remote, FirestoreReplicator(local, lambda: remote, batch_size=10)
+
+
+def remote_data(remote, path):
+    return remote.document(path).get().to_dict()
+
+
+def test_stats_are_replicated_as_increments(nodes):
+    local, remote, replicator = nodes
+    # Otro nodo ya sumó sus lotes en la nube
+    remote.document('farmer_stats/f1').set({'totals': {'quantity': 100}})
+
+    local.document('farmer_stats/f1').set({'totals': {'quantity': firestore.Increment(5)}}, merge=True)
+    local.document('farmer_stats/f1').set({'totals': {'quantity': firestore.Increment(2)}}, merge=True)
+
+    assert replicator.drain() == 2
+    assert remote_data(remote, 'farmer_stats/f1') == {'totals': {'quantity': 107}}
+    assert local.pending_count() == 0
+
+
+def test_updates_keep_fields_changed_in_the_cloud(nodes):
+    local, remote, replicator = nodes
+    remote.document('lots/a').set({'quantity': 10, 'notes': 'nube', 'updated_at': None})
+    replicator.pull(collections=('lots',))
+
+    remote.document('lots/a').update({'notes': 'cambiado en la nube'})
+    local.document('lots/a').update({'quantity': 20, 'updated_at': firestore.SERVER_TIMESTAMP})
+    replicator.drain()
+
+    data = remote_data(remote, 'lots/a')
+    assert (data['quantity'], data['notes']) == (20, 'cambiado en la nube')
+    assert data['updated_at'] is not None
+
+
+def test_retry_after_lost_ack_does_not_repeat_increments(nodes, monkeypatch):
+    local, remote, replicator = nodes
+    local.document('farmer_stats/f1').set({'totals': {'quantity': firestore.Increment(5)}}, merge=True)
+
+    def lost(last_seq):
+        raise RuntimeError('Se cayó el proceso antes de confirmar en local')
+
+    monkeypatch.setattr(local, 'ack_changes', lost)
+    with pytest.raises(RuntimeError):
+        replicator.replicate_once()
+    monkeypatch.undo()
+
+    assert replicator.drain() == 1
+    assert local.pending_count() == 0
+    assert remote_data(remote, 'farmer_stats/f1') == {'totals': {'quantity': 5}}
+
+
+def test_rejected_commit_is_discarded_and_pulled_again(nodes):
+    local, remote, replicator = nodes
+    remote.document('lots/a').set({'quantity': 10})
+    replicator.pull(collections=('lots',))
+    # El lote se borró en la nube mientras el nodo lo editaba
+    remote.document('lots/a').delete()
+
+    local.document('lots/a').update({'quantity': 20})
+    local.document('lots/b').set({'quantity': 1})
+    replicator.drain()
+
+    assert not remote.document('lots/a').get().exists
+    assert not local.document('lots/a').get().exists
+    assert remote_data(remote, 'lots/b') == {'quantity': 1}
+    assert replicator.stats()['conflicts'] == 1
+    assert local.pending_count() == 0
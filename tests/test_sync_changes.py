@@ -0,0 +1,257 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from config import Config
+from models.lot import Lot, InvalidCursorError
+from services.lot_service import LotService
+from services.offline_sync import OfflineSyncService
+
+T0 = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def create_lot(farmer_uid, quantity=10):
+    result, status_code = LotService.create_lot(farmer_uid, {'crop_type': 'cafe', 'quantity': quantity})
+    assert status_code == 201, result
+    return result['lot']['id']
+
+
+def stats(fake, farmer_uid):
+    return fake.collection('farmer_stats').document(farmer_uid).get().to_dict()['totals']
+
+
+# ===================== MERGE POR CAMPO =====================
+
+def test_merge_fields_applies_fields_the_server_did_not_touch_later():
+    lot_data = {
+        'quantity': 10, 'unit': 'kg', 'price': 5,
+        'created_at': T0,
+        'field_versions': {'quantity': T0 + timedelta(hours=2)}
+    }
+    client = {'quantity': 20, 'unit': 't', 'price': 5}
+
+    apply, conflicts = OfflineSyncService.merge_fields(lot_data, client, T0 + timedelta(hours=1))
+
+    assert apply == {'unit': 't'}
+    assert conflicts == {'quantity': {'server': 10, 'client': 20,
+                                      'server_updated_at': T0 + timedelta(hours=2)}}
+
+
+def test_merge_fields_client_newer_wins():
+    lot_data = {'quantity': 10, 'created_at': T0, 'field_versions': {'quantity': T0}}
+
+    apply, conflicts = OfflineSyncService.merge_fields(lot_data, {'quantity': 20}, T0 + timedelta(minutes=1))
+
+    assert apply == {'quantity': 20}
+    assert conflicts == {}
+
+
+def test_merge_fields_legacy_lot_uses_updated_at():
+    # Lotes sin field_versions: todos los campos tienen la versión del documento
+    lot_data = {'quantity': 10, 'unit': 'kg', 'updated_at': T0 + timedelta(hours=1)}
+
+    apply, conflicts = OfflineSyncService.merge_fields(lot_data, {'quantity': 20, 'unit': 'kg'}, T0)
+
+    assert apply == {}
+    assert set(conflicts) == {'quantity'}
+
+
+# ===================== PULL DELTA =====================
+
+def test_changes_cursor_round_trip():
+    lots_position = (T0, 'lot-1')
+    events_position = (T0 + timedelta(seconds=1), 'lots/lot-1/events/e-1')
+
+    cursor = OfflineSyncService.encode_changes_cursor(lots_position, events_position, rewind=True)
+
+    assert OfflineSyncService.decode_changes_cursor(cursor) == [lots_position, events_position, True]
+    empty = OfflineSyncService.encode_changes_cursor(None, None)
+    assert OfflineSyncService.decode_changes_cursor(empty) == [None, None, False]
+
+
+@pytest.mark.parametrize('cursor', ['no-es-un-cursor', 'WzEsMl0', '!!!'])
+def test_decode_changes_cursor_rejects_garbage(cursor):
+    with pytest.raises(InvalidCursorError):
+        OfflineSyncService.decode_changes_cursor(cursor)
+
+
+def test_get_changes_pages_through_lots_and_events(fake, farmer_uid):
+    lot_ids = [create_lot(farmer_uid, quantity=i + 1) for i in range(5)]
+    create_lot('otro-agricultor')
+
+    lots, events, pages = {}, {}, 0
+    cursor = None
+    while True:
+        result, status_code = OfflineSyncService.get_changes(farmer_uid, since=cursor, limit=2)
+        assert status_code == 200, result
+        pages += 1
+        assert len(result['lots']) <= 2 and len(result['events']) <= 2
+        lots.update((lot['id'], lot) for lot in result['lots'])
+        events.update((event['id'], event) for event in result['events'])
+        cursor = result['next_cursor']
+        if not result['has_more']:
+            break
+
+    assert pages == 3
+    assert set(lots) == set(lot_ids)
+    assert {event['lot_id'] for event in events.values()} == set(lot_ids)
+    assert all(event['farmer_uid'] == farmer_uid for event in events.values())
+
+
+def test_get_changes_reports_updates_and_tombstones(fake, farmer_uid):
+    kept, deleted = create_lot(farmer_uid), create_lot(farmer_uid)
+    result, _ = OfflineSyncService.get_changes(farmer_uid)
+    cursor = result['next_cursor']
+
+    assert LotService.update_lot(kept, farmer_uid, {'quantity': 99})[1] == 200
+    assert LotService.delete_lot(deleted, farmer_uid)[1] == 200
+    result, status_code = OfflineSyncService.get_changes(farmer_uid, since=cursor)
+
+    assert status_code == 200
+    # El cursor de la última página relee una ventana: el cliente deduplica por id
+    latest = {lot['id']: lot for lot in result['lots']}
+    assert latest[kept]['quantity'] == 99
+    assert [tombstone['id'] for tombstone in result['deleted']] == [deleted]
+    assert deleted not in latest
+
+
+def test_get_changes_sees_qr_write_back(fake, farmer_uid):
+    from concurrent.futures import Future
+    from services.qr_worker import qr_renderer
+
+    lot_id = create_lot(farmer_uid)
+    fake.collection('lots').document(lot_id).update({'qr_status': 'pending'})
+    result, _ = OfflineSyncService.get_changes(farmer_uid)
+    before = fake.collection('lots').document(lot_id).get().get('updated_at')
+
+    future = Future()
+    future.set_result(b'png')
+    qr_renderer._slots.acquire()
+    qr_renderer._on_done(lot_id, farmer_uid, future)
+    result, _ = OfflineSyncService.get_changes(farmer_uid, since=result['next_cursor'])
+
+    lot = {lot['id']: lot for lot in result['lots']}[lot_id]
+    assert lot['qr_status'] == 'ready'
+    assert lot['updated_at'] > before
+
+
+def test_get_changes_rewind_window_redelivers_late_commits(fake, farmer_uid, monkeypatch):
+    first = create_lot(farmer_uid)
+    result, _ = OfflineSyncService.get_changes(farmer_uid)
+    cursor = result['next_cursor']
+    last_seen = fake.collection('lots').document(first).get().get('updated_at')
+
+    # Un commit que se hace visible tarde con un updated_at anterior al cursor
+    late = Lot.stamped({'farmer_uid': farmer_uid, 'status': 'active', 'crop_type': 'cafe'})
+    fake.collection('lots').document('late').set(late)
+    fake.collection('lots').document('late').update({'updated_at': last_seen - timedelta(seconds=1)})
+
+    monkeypatch.setattr(Config, 'SYNC_CHANGES_WINDOW_SECONDS', 0)
+    result, _ = OfflineSyncService.get_changes(farmer_uid, since=cursor)
+    assert 'late' not in {lot['id'] for lot in result['lots']}
+
+    monkeypatch.setattr(Config, 'SYNC_CHANGES_WINDOW_SECONDS', 60)
+    result, _ = OfflineSyncService.get_changes(farmer_uid, since=cursor)
+    assert 'late' in {lot['id'] for lot in result['lots']}
+
+
+def test_get_changes_validates_limit(fake, farmer_uid):
+    assert OfflineSyncService.get_changes(farmer_uid, limit='0')[1] == 400
+    assert OfflineSyncService.get_changes(farmer_uid, limit='x')[1] == 400
+    assert OfflineSyncService.get_changes(farmer_uid, since='basura')[1] == 400
+
+
+def test_migrated_events_appear_in_changes(fake, farmer_uid):
+    fake.collection('lots').document('legacy').set(Lot.stamped({
+        'farmer_uid': farmer_uid, 'status': 'active', 'crop_type': 'cafe',
+        'events': [{'id': 'e-1', 'type': 'creation', 'description': 'x', 'timestamp': datetime.utcnow()}]
+    }))
+    # Evento copiado por una versión anterior de la migración, sin dueño
+    Lot.event_ref('legacy', 'e-0').set({'id': 'e-0', 'type': 'note', 'timestamp': datetime.utcnow()})
+
+    assert Lot.migrate_embedded_events() == (1, 1)
+    assert Lot.backfill_event_owners() == 1
+    assert Lot.backfill_event_owners() == 0
+
+    result, _ = OfflineSyncService.get_changes(farmer_uid)
+    assert sorted(event['id'] for event in result['events']) == ['e-0', 'e-1']
+
+
+# ===================== RESOLVER CONFLICTOS =====================
+
+def test_resolve_conflict_client_applies_and_updates_stats(fake, farmer_uid):
+    lot_id = create_lot(farmer_uid, quantity=10)
+
+    result, status_code = OfflineSyncService.resolve_conflict(lot_id, 'client', farmer_uid, {'quantity': 25})
+
+    assert status_code == 200
+    assert result['applied_fields'] == ['quantity']
+    assert fake.collection('lots').document(lot_id).get().get('quantity') == 25
+    assert stats(fake, farmer_uid)['quantity'] == 25
+
+
+def test_resolve_conflict_merge_returns_conflicts(fake, farmer_uid):
+    lot_id = create_lot(farmer_uid, quantity=10)
+    client_time = datetime.now(timezone.utc) + timedelta(hours=1)
+    # El servidor cambió quantity después de la edición offline del cliente
+    fake.collection('lots').document(lot_id).update({
+        'quantity': 30, 'field_versions.quantity': client_time + timedelta(hours=1)})
+
+    result, status_code = OfflineSyncService.resolve_conflict(
+        lot_id, 'merge', farmer_uid, {'quantity': 1, 'unit': 't'}, client_time.isoformat())
+
+    assert status_code == 200
+    assert result['applied_fields'] == ['unit']
+    assert set(result['conflicting_fields']) == {'quantity'}
+    assert OfflineSyncService.resolve_conflict(lot_id, 'merge', farmer_uid, {'quantity': 1})[1] == 400
+
+
+def test_resolve_conflict_checks_owner_and_strategy(fake, farmer_uid):
+    lot_id = create_lot(farmer_uid)
+
+    assert OfflineSyncService.resolve_conflict(lot_id, 'client', 'intruso', {'quantity': 1})[1] == 403
+    assert OfflineSyncService.resolve_conflict('no-existe', 'client', farmer_uid, {'quantity': 1})[1] == 404
+    assert OfflineSyncService.resolve_conflict(lot_id, 'otra', farmer_uid)[1] == 400
+    result, status_code = OfflineSyncService.resolve_conflict(lot_id, 'server', farmer_uid, {'quantity': 1})
+    assert status_code == 200 and result['applied_fields'] == []
+
+
+def test_resolve_conflict_retries_on_concurrent_write(fake, farmer_uid, monkeypatch):
+    lot_id = create_lot(farmer_uid, quantity=10)
+    get_snapshot = Lot.get_snapshot
+    reads = []
+
+    def racing_snapshot(lid):
+        snapshot = get_snapshot(lid)
+        reads.append(snapshot)
+        if len(reads) == 1:
+            # Otra petición cambia el lote después de la lectura
+            monkeypatch.setattr(Lot, 'get_snapshot', staticmethod(get_snapshot))
+            assert LotService.update_lot(lid, farmer_uid, {'quantity': 300})[1] == 200
+            monkeypatch.setattr(Lot, 'get_snapshot', staticmethod(racing_snapshot))
+        return snapshot
+
+    monkeypatch.setattr(Lot, 'get_snapshot', staticmethod(racing_snapshot))
+    result, status_code = OfflineSyncService.resolve_conflict(lot_id, 'client', farmer_uid, {'quantity': 50})
+
+    assert status_code == 200
+    assert len(reads) == 2
+    assert fake.collection('lots').document(lot_id).get().get('quantity') == 50
+    # El delta se calculó sobre el snapshot que se escribió (300 -> 50)
+    assert stats(fake, farmer_uid)['quantity'] == 50
+
+
+def test_resolve_conflict_gives_up_after_retries(fake, farmer_uid, monkeypatch):
+    lot_id = create_lot(farmer_uid)
+    get_snapshot = Lot.get_snapshot
+
+    def always_stale(lid):
+        snapshot = get_snapshot(lid)
+        fake.collection('lots').document(lid).update({'crop_type': 'otro'})
+        return snapshot
+
+    monkeypatch.setattr(Lot, 'get_snapshot', staticmethod(always_stale))
+    result, status_code = OfflineSyncService.resolve_conflict(lot_id, 'client', farmer_uid, {'quantity': 50})
+
+    assert status_code == 409
+    assert 'error' in result
@@ -0,0 +1,42 @@
+import io
+import json
+
+from services.offline_sync import OfflineSyncService
+
+
+def ndjson(items):
+    return io.BytesIO(b''.join(json.dumps(item).encode() + b'\n' for item in items))
+
+
+def creation(index):
+    return {'type': 'lot_creation', 'offline_id': f'o-{index}', 'timestamp': '2024-06-01T00:00:00Z',
+            'data': {'crop_type': 'cafe', 'quantity': 1}}
+
+
+def test_sync_stream_reports_each_line_and_totals(fake, farmer_uid):
+    lines = list(OfflineSyncService.sync_stream(
+        farmer_uid, OfflineSyncService.parse_ndjson(ndjson([creation(i) for i in range(3)])), chunk_size=2))
+
+    assert [line['status'] for line in lines[:-1]] == ['synced'] * 3
+    assert lines[-1] == {'synced': 3, 'failed': 0, 'conflicts': 0, 'done': True}
+
+
+def test_sync_stream_ends_with_error_line_when_a_chunk_fails(fake, farmer_uid, monkeypatch):
+    process_chunk = OfflineSyncService.process_chunk
+    calls = []
+
+    def failing(uid, items):
+        calls.append(items)
+        if len(calls) == 2:
+            raise RuntimeError('Firestore no disponible')
+        return process_chunk(uid, items)
+
+    monkeypatch.setattr(OfflineSyncService, 'process_chunk', staticmethod(failing))
+    lines = list(OfflineSyncService.sync_stream(
+        farmer_uid, OfflineSyncService.parse_ndjson(ndjson([creation(i) for i in range(5)])), chunk_size=2))
+
+    assert [line.get('status') for line in lines[:-1]] == ['synced', 'synced']
+    assert lines[-1]['done'] is True
+    assert 'Firestore no disponible' in lines[-1]['error']
+    assert lines[-1]['synced'] == 2
+    assert len(calls) == 2
@@ -0,0 +1,13 @@
+from services.qr_payload import parse_token
+from services.trace_service import TraceService
+
+
+def test_parse_token_rejects_non_ascii_signature():
+    # compare_digest con str no ASCII lanza TypeError: debe ser un rechazo
+    assert parse_token('BT-1.ÄÖÜñ', secret='s3cret') == (None, False)
+
+
+def test_trace_lookup_with_non_ascii_signature_is_forbidden(fake):
+    result, status_code = TraceService.lookup('BT-1.ÄÖÜ')
+    assert status_code == 403
+    assert 'error' in result